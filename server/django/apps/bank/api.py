@@ -1,18 +1,11 @@
-import json
-from collections import defaultdict
 from datetime import datetime, timedelta
-from decimal import Decimal
-from itertools import combinations
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.core.mail import send_mail
-from django.db import connection, transaction
-from django.db.models import Case, Count, F, OuterRef, Q, Subquery, When
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Prefetch, Q, Subquery, When
 from django.forms import ValidationError
 from django_filters import rest_framework as filters
-from django_q.tasks import async_task
 from rest_framework import filters as rf_filters
 from rest_framework import mixins
 from rest_framework.decorators import action
@@ -36,6 +29,7 @@ from apps.bank.models import (
     ReconciliationRowTransaction,
     ReconciliationStatement,
 )
+from apps.bank.reconciliation import ReconciliationGroups, create_statement_rows
 from apps.bank.resources import ChequeIssueResource
 from apps.bank.serializers import (
     BankAccountChequeIssueSerializer,
@@ -53,6 +47,7 @@ from apps.bank.serializers import (
     ReconciliationRowSerializer,
     ReconciliationStatementImportSerializer,
     ReconciliationStatementListSerializer,
+    ReconciliationStatementProgressSerializer,
     ReconciliationStatementSerializer,
 )
 from apps.ledger.models import Account, Party
@@ -378,970 +373,6 @@ class CashDepositViewSet(CRULViewSet):
         return Response({})
 
 
-def reconcile(
-    company_id,
-    statement_transactions,
-    start_date,
-    end_date,
-    account_id,
-    email,
-    merge_description=False,
-):
-    try:
-        start_date = start_date - timedelta(
-            days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS
-        )
-        end_date = end_date + timedelta(
-            days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-        )
-        system_transactions = (
-            Transaction.objects.filter(
-                company_id=company_id,
-                journal_entry__date__range=[start_date, end_date],
-                account_id=account_id,
-            )
-            .order_by("journal_entry__date")
-            .select_related("journal_entry")
-        )
-
-        def parse_amount(amount):
-            if amount and isinstance(amount, str):
-                return Decimal(amount.replace(",", ""))
-            return amount or Decimal("0")
-
-        # Prase statement transactions dr_amount and cr_amount
-        for statement_transaction in statement_transactions:
-            statement_transaction["dr_amount"] = parse_amount(
-                statement_transaction.get("dr_amount")
-            )
-            statement_transaction["cr_amount"] = parse_amount(
-                statement_transaction.get("cr_amount")
-            )
-            statement_transaction["balance"] = parse_amount(
-                statement_transaction.get("balance")
-            )
-
-        reconciled_transactions = []
-        unreconciled_statement_transactions = statement_transactions.copy()
-        unreconciled_system_transactions = list(system_transactions)
-
-        # Create a dictionary for quick lookup of system transactions by date
-        system_transactions_by_date = {}
-        for system_transaction in unreconciled_system_transactions:
-            date_str = system_transaction.journal_entry.date.strftime("%Y-%m-%d")
-            if date_str not in system_transactions_by_date:
-                system_transactions_by_date[date_str] = []
-            system_transactions_by_date[date_str].append(system_transaction)
-
-        def reconcile_exact_match_single_transactions(
-            statement_transaction, system_transactions
-        ):
-            """
-            Attempts to reconcile a single statement transaction with system transactions.
-
-            Parameters:
-                statement_transaction (dict): The statement transaction to reconcile.
-                system_transactions (list): A list of system transactions to match against.
-
-            Returns:
-                bool: True if the transaction was reconciled, False otherwise.
-            """
-            for system_transaction in system_transactions:
-                if (
-                    statement_transaction.get("dr_amount")
-                    and system_transaction.cr_amount
-                    and abs(
-                        statement_transaction["dr_amount"]
-                        - system_transaction.cr_amount
-                    )
-                    < settings.BANK_RECONCILIATION_TOLERANCE
-                ) or (
-                    statement_transaction.get("cr_amount")
-                    and system_transaction.dr_amount
-                    and abs(
-                        statement_transaction["cr_amount"]
-                        - system_transaction.dr_amount
-                    )
-                    < settings.BANK_RECONCILIATION_TOLERANCE
-                ):
-                    # Reconcile transactions
-                    statement_transaction["transactions"] = [
-                        {
-                            "id": system_transaction.pk,
-                            "updated_at": system_transaction.updated_at,
-                        }
-                    ]
-                    statement_transaction["status"] = "Reconciled"
-                    reconciled_transactions.append(statement_transaction)
-                    unreconciled_statement_transactions.remove(statement_transaction)
-                    unreconciled_system_transactions.remove(system_transaction)
-                    date_str = statement_transaction["date"]
-                    if date_str in system_transactions_by_date:
-                        if system_transaction in system_transactions_by_date[date_str]:
-                            system_transactions_by_date[date_str].remove(
-                                system_transaction
-                            )
-
-                        if not system_transactions_by_date[date_str]:
-                            del system_transactions_by_date[date_str]
-                    return True
-            return False
-
-        # iterate over statement transactions, if there is a matching system transaction, reconcile, add transaction_id to statement transaction
-        for statement_transaction in statement_transactions:
-            date_str = statement_transaction["date"]
-            if date_str in system_transactions_by_date:
-                if reconcile_exact_match_single_transactions(
-                    statement_transaction, system_transactions_by_date[date_str]
-                ):
-                    continue
-
-        def reconcile_statement_description_combinations(
-            system_transaction, statement_transactions, has_same_date=False
-        ):
-            """
-            Attempts to reconcile a single system transaction by finding combinations of statement transactions having the same description.
-
-            Parameters:
-                system_transaction (object): The system transaction to reconcile.
-                statement_transactions (list): A list of statement transactions to match against.
-                has_same_date (bool): Whether the system transactions have the same date as the statement transaction.
-
-            Returns:
-                bool: True if the transaction was reconciled, False otherwise.
-            """
-            combinations_data = {}
-            for statement_transaction in statement_transactions:
-                if statement_transaction.get("description") not in combinations_data:
-                    combinations_data[statement_transaction.get("description")] = []
-                combinations_data[statement_transaction.get("description")].append(
-                    statement_transaction
-                )
-
-            for description, combination in combinations_data.items():
-                total_dr = sum(t.get("dr_amount", 0) for t in combination)
-                total_cr = sum(t.get("cr_amount", 0) for t in combination)
-
-                if (
-                    abs(total_dr - (system_transaction.cr_amount or 0))
-                    < settings.BANK_RECONCILIATION_TOLERANCE
-                    and abs(total_cr - (system_transaction.dr_amount or 0))
-                    < settings.BANK_RECONCILIATION_TOLERANCE
-                ):
-                    # reconcile matched transactions combination
-                    for statement_transaction in combination:
-                        if statement_transaction.get("transactions"):
-                            statement_transaction["transactions"].append(
-                                {
-                                    "id": system_transaction.pk,
-                                    "updated_at": system_transaction.updated_at,
-                                }
-                            )
-                        else:
-                            statement_transaction["transactions"] = [
-                                {
-                                    "id": system_transaction.pk,
-                                    "updated_at": system_transaction.updated_at,
-                                }
-                            ]
-                        if has_same_date:
-                            statement_transaction["status"] = "Reconciled"
-                        reconciled_transactions.append(statement_transaction)
-                        unreconciled_statement_transactions.remove(
-                            statement_transaction
-                        )
-
-                    unreconciled_system_transactions.remove(system_transaction)
-                    date_str = system_transaction.journal_entry.date.strftime(
-                        "%Y-%m-%d"
-                    )
-                    if date_str in system_transactions_by_date:
-                        system_transactions_by_date[date_str].remove(system_transaction)
-                        if not system_transactions_by_date[date_str]:
-                            del system_transactions_by_date[date_str]
-                    return True
-            return False
-
-        if merge_description:
-            for system_transaction in unreconciled_system_transactions[:]:
-                date_str = system_transaction.journal_entry.date.strftime("%Y-%m-%d")
-                if date_str in system_transactions_by_date:
-                    # Filter statement transactions by date
-                    date_filtered_statement_transactions = [
-                        t
-                        for t in unreconciled_statement_transactions
-                        if t["date"] == date_str
-                    ]
-
-                if reconcile_statement_description_combinations(
-                    system_transaction,
-                    date_filtered_statement_transactions,
-                    has_same_date=True,
-                ):
-                    continue
-
-        def reconcile_statement_combinations(
-            system_transaction, statement_transactions, has_same_date=False
-        ):
-            """
-            Attempts to reconcile a single system transaction by finding combinations of statement transactions.
-
-            Parameters:
-                system_transaction (object): The system transaction to reconcile.
-                statement_transactions (list): A list of statement transactions to match against.
-                has_same_date (bool): Whether the system transactions have the same date as the statement transaction.
-
-            Returns:
-                bool: True if the transaction was reconciled, False otherwise.
-            """
-            for r in range(2, len(statement_transactions) + 1):
-                for combination in combinations(statement_transactions, r):
-                    total_dr = sum(t.get("dr_amount", 0) for t in combination)
-                    total_cr = sum(t.get("cr_amount", 0) for t in combination)
-
-                    if (
-                        abs(total_dr - (system_transaction.cr_amount or 0))
-                        < settings.BANK_RECONCILIATION_TOLERANCE
-                        and abs(total_cr - (system_transaction.dr_amount or 0))
-                        < settings.BANK_RECONCILIATION_TOLERANCE
-                    ):
-                        # Reconcile matched transactions
-                        for statement_transaction in combination:
-                            if statement_transaction.get("transactions"):
-                                statement_transaction["transactions"].append(
-                                    {
-                                        "id": system_transaction.pk,
-                                        "updated_at": system_transaction.updated_at,
-                                    }
-                                )
-                            else:
-                                statement_transaction["transactions"] = [
-                                    {
-                                        "id": system_transaction.pk,
-                                        "updated_at": system_transaction.updated_at,
-                                    }
-                                ]
-                            if has_same_date:
-                                statement_transaction["status"] = "Reconciled"
-                            reconciled_transactions.append(statement_transaction)
-                            unreconciled_statement_transactions.remove(
-                                statement_transaction
-                            )
-
-                        unreconciled_system_transactions.remove(system_transaction)
-
-                        date_str = system_transaction.journal_entry.date.strftime(
-                            "%Y-%m-%d"
-                        )
-                        if date_str in system_transactions_by_date:
-                            system_transactions_by_date[date_str].remove(
-                                system_transaction
-                            )
-                            if not system_transactions_by_date[date_str]:
-                                del system_transactions_by_date[date_str]
-
-                        return True
-            return False
-
-        # Reconcile transactions by sum
-        for system_transaction in unreconciled_system_transactions[:]:
-            date_str = system_transaction.journal_entry.date.strftime("%Y-%m-%d")
-            if date_str in system_transactions_by_date:
-                # Filter statement transactions by date
-                date_filtered_statement_transactions = [
-                    t
-                    for t in unreconciled_statement_transactions
-                    if t["date"] == date_str
-                ]
-
-            if reconcile_statement_combinations(
-                system_transaction,
-                date_filtered_statement_transactions,
-                has_same_date=True,
-            ):
-                continue
-
-        def reconcile_system_combinations(
-            statement_transaction, system_transactions, has_same_date=False
-        ):
-            """
-            Attempts to reconcile a single statement transaction by finding combinations of system transactions.
-
-            Parameters:
-                statement_transaction (dict): The statement transaction to reconcile.
-                system_transactions (list): A list of system transactions to match against.
-                has_same_date (bool): Whether the system transactions have the same date as the statement transaction.
-
-            Returns:
-                bool: True if the transaction was reconciled, False otherwise.
-            """
-            # first group system transactions by its source_id by dr_amount and cr_amount
-            system_transactions_by_source = {}
-            for system_transaction in system_transactions:
-                source_id = system_transaction.journal_entry.source_voucher_id
-                if source_id not in system_transactions_by_source:
-                    system_transactions_by_source[source_id] = []
-                system_transactions_by_source[source_id].append(system_transaction)
-
-            # loop over the grouped system transactions and try to reconcile
-            for source_id, system_transactions in list(
-                system_transactions_by_source.items()
-            ):
-                for r in range(2, len(system_transactions) + 1):
-                    for combination in combinations(system_transactions, r):
-                        total_dr = sum((t.dr_amount or 0) for t in combination)
-                        total_cr = sum((t.cr_amount or 0) for t in combination)
-
-                        if (
-                            abs(total_dr - statement_transaction.get("cr_amount", 0))
-                            < settings.BANK_RECONCILIATION_TOLERANCE
-                            and abs(
-                                total_cr - statement_transaction.get("dr_amount", 0)
-                            )
-                            < settings.BANK_RECONCILIATION_TOLERANCE
-                        ):
-                            # Reconcile matched transactions
-                            for system_transaction in combination:
-                                if statement_transaction.get("transactions"):
-                                    statement_transaction["transactions"].append(
-                                        {
-                                            "id": system_transaction.pk,
-                                            "updated_at": system_transaction.updated_at,
-                                        }
-                                    )
-                                else:
-                                    statement_transaction["transactions"] = [
-                                        {
-                                            "id": system_transaction.pk,
-                                            "updated_at": system_transaction.updated_at,
-                                        }
-                                    ]
-                                if has_same_date:
-                                    statement_transaction["status"] = "Reconciled"
-                                unreconciled_system_transactions.remove(
-                                    system_transaction
-                                )
-                                system_transactions_by_date[
-                                    system_transaction.journal_entry.date.strftime(
-                                        "%Y-%m-%d"
-                                    )
-                                ].remove(system_transaction)
-
-                            reconciled_transactions.append(statement_transaction)
-                            unreconciled_statement_transactions.remove(
-                                statement_transaction
-                            )
-
-                            return True
-
-                        elif (
-                            abs(
-                                total_dr
-                                - total_cr
-                                - statement_transaction.get("cr_amount", 0)
-                            )
-                            < settings.BANK_RECONCILIATION_TOLERANCE
-                        ):
-                            # dont remove the cr_amount transaction but remove the dr_amount transactions
-                            for system_transaction in combination:
-                                if statement_transaction.get("transactions"):
-                                    statement_transaction["transactions"].append(
-                                        {
-                                            "id": system_transaction.pk,
-                                            "updated_at": system_transaction.updated_at,
-                                        }
-                                    )
-                                else:
-                                    statement_transaction["transactions"] = [
-                                        {
-                                            "id": system_transaction.pk,
-                                            "updated_at": system_transaction.updated_at,
-                                        }
-                                    ]
-                                if has_same_date:
-                                    statement_transaction["status"] = "Reconciled"
-                                unreconciled_system_transactions.remove(
-                                    system_transaction
-                                )
-                                system_transactions_by_date[
-                                    system_transaction.journal_entry.date.strftime(
-                                        "%Y-%m-%d"
-                                    )
-                                ].remove(system_transaction)
-
-                            reconciled_transactions.append(statement_transaction)
-                            unreconciled_statement_transactions.remove(
-                                statement_transaction
-                            )
-                            return True
-            return False
-
-        # Reconcile transactions by sum
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            date_str = statement_transaction["date"]
-            if date_str in system_transactions_by_date:
-                # Filter system transactions by date
-                date_filtered_system_transactions = [
-                    t
-                    for t in unreconciled_system_transactions
-                    if t.journal_entry.date.strftime("%Y-%m-%d") == date_str
-                ]
-                if reconcile_system_combinations(
-                    statement_transaction,
-                    date_filtered_system_transactions,
-                    has_same_date=True,
-                ):
-                    # Clean up empty dates
-                    if not system_transactions_by_date[date_str]:
-                        del system_transactions_by_date[date_str]
-                    continue
-
-        # loop in unreconciled statement transactions and unreconciled system transactions, find combinations in system transaction of the date where debits - credits that match the statement transaction amount
-        for i, statement_transaction in enumerate(
-            unreconciled_statement_transactions[:]
-        ):
-            date_str = statement_transaction["date"]
-
-            # Skip if no transactions for this date
-            if date_str not in system_transactions_by_date:
-                continue
-
-            # Filter system transactions on the same date
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if t.journal_entry.date.strftime("%Y-%m-%d") == date_str
-            ]
-
-            statement_amount = float(statement_transaction.get("cr_amount", 0))
-
-            reconciliation_found = False
-
-            # Try combinations of system transactions
-            for r in range(2, len(date_filtered_system_transactions) + 1):
-                if reconciliation_found:
-                    break
-
-                for combination in combinations(date_filtered_system_transactions, r):
-                    net_difference = sum(
-                        (t.dr_amount or 0) - (t.cr_amount or 0) for t in combination
-                    )
-
-                    if (
-                        abs(round(net_difference, 2) - round(statement_amount, 2))
-                        < settings.BANK_RECONCILIATION_TOLERANCE
-                    ):
-                        # Mark transactions as reconciled
-                        statement_transaction["transactions"] = [
-                            # system_transaction.pk for system_transaction in combination
-                            {
-                                "id": system_transaction.pk,
-                                "updated_at": system_transaction.updated_at,
-                            }
-                            for system_transaction in combination
-                        ]
-                        statement_transaction["status"] = "Reconciled"
-
-                        # Remove reconciled system transactions
-                        for system_transaction in combination:
-                            if system_transaction in unreconciled_system_transactions:
-                                unreconciled_system_transactions.remove(
-                                    system_transaction
-                                )
-
-                            # Remove from system transactions by date
-                            if date_str in system_transactions_by_date:
-                                if (
-                                    system_transaction
-                                    in system_transactions_by_date[date_str]
-                                ):
-                                    system_transactions_by_date[date_str].remove(
-                                        system_transaction
-                                    )
-
-                        # Clean up empty date entries
-                        if (
-                            date_str in system_transactions_by_date
-                            and not system_transactions_by_date[date_str]
-                        ):
-                            del system_transactions_by_date[date_str]
-
-                        # Move to reconciled transactions
-                        reconciled_transactions.append(statement_transaction)
-                        unreconciled_statement_transactions.remove(
-                            statement_transaction
-                        )
-
-                        reconciliation_found = True
-                        break
-
-                if reconciliation_found:
-                    break
-
-        # Iterate over unreconciled statement transactions to find direct matches
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-            date_range_start = statement_date
-            date_range_end = statement_date + timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-            )
-
-            # Filter system transactions within date range
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-            if reconcile_exact_match_single_transactions(
-                statement_transaction, date_filtered_system_transactions
-            ):
-                continue
-
-        # Reconcile system transactions by matching sums with statement transactions
-        for system_transaction in unreconciled_system_transactions[:]:
-            system_date = system_transaction.journal_entry.date
-            date_range_start = system_date - timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-            )
-            date_range_end = system_date
-
-            # Filter statement transactions within date range
-            date_filtered_statement_transactions = [
-                t
-                for t in unreconciled_statement_transactions
-                if date_range_start
-                <= datetime.strptime(t["date"], "%Y-%m-%d").date()
-                <= date_range_end
-            ]
-
-            if merge_description:
-                if reconcile_statement_description_combinations(
-                    system_transaction,
-                    date_filtered_statement_transactions,
-                ):
-                    continue
-
-                # update date_filtered_statement_transactions
-                date_filtered_statement_transactions = [
-                    t
-                    for t in unreconciled_statement_transactions
-                    if date_range_start
-                    <= datetime.strptime(t["date"], "%Y-%m-%d").date()
-                    <= date_range_end
-                ]
-
-            # Check combinations of statement transactions
-            if reconcile_statement_combinations(
-                system_transaction,
-                date_filtered_statement_transactions,
-            ):
-                continue
-
-        # Final reconciliation by sums with a 3-day range for statement transactions
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-            date_range_start = statement_date
-            date_range_end = statement_date + timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-            )
-
-            # Filter system transactions
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-            if reconcile_system_combinations(
-                statement_transaction, date_filtered_system_transactions
-            ):
-                continue
-
-        # Iterate over unreconciled statement transactions to find direct matches
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-            date_range_start = statement_date - timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS
-            )
-            date_range_end = statement_date
-
-            # Filter system transactions within date range
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-            if reconcile_exact_match_single_transactions(
-                statement_transaction, date_filtered_system_transactions
-            ):
-                continue
-
-        # Reconcile system transactions by matching sums with statement transactions
-        for system_transaction in unreconciled_system_transactions[:]:
-            system_date = system_transaction.journal_entry.date
-            date_range_start = system_date - timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-            )
-            date_range_end = system_date
-
-            # Filter statement transactions within date range
-            date_filtered_statement_transactions = [
-                t
-                for t in unreconciled_statement_transactions
-                if date_range_start
-                <= datetime.strptime(t["date"], "%Y-%m-%d").date()
-                <= date_range_end
-            ]
-
-            # Check combinations of statement transactions
-            if reconcile_statement_combinations(
-                system_transaction,
-                date_filtered_statement_transactions,
-            ):
-                continue
-
-        # Final reconciliation by sums with a 3-day range for statement transactions
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-            date_range_start = statement_date - timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS
-            )
-            date_range_end = statement_date
-
-            # Filter system transactions
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-            if reconcile_system_combinations(
-                statement_transaction, date_filtered_system_transactions
-            ):
-                continue
-
-        # now compare the remaining unreconciled statement transactions and unreconciled system transactions, where system_transaction date can be within 3 days of statement_transaction date
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-
-            date_range_start = statement_date
-            date_range_end = statement_date + timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
-            )
-
-            # Filter system transactions within the specified date range
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-
-            # Skip if no system transactions in the date range
-            if not date_filtered_system_transactions:
-                continue
-
-            # Group system transactions by date
-            merged_system_transactions_by_date = {}
-            for system_transaction in date_filtered_system_transactions:
-                date_str = system_transaction.journal_entry.date.strftime("%Y-%m-%d")
-                merged_system_transactions_by_date.setdefault(date_str, []).append(
-                    system_transaction
-                )
-
-            reconciliation_found = False
-
-            # Iterate through dates and transaction combinations
-            for date_str, system_transactions_by_date in list(
-                merged_system_transactions_by_date.items()
-            ):
-                if reconciliation_found:
-                    break
-
-                # Try combinations of 1 to all transactions on the date
-                for r in range(2, len(system_transactions_by_date) + 1):
-                    for combination in combinations(system_transactions_by_date, r):
-                        # Calculate the net difference: debits - credits
-                        net_difference = sum(
-                            (t.dr_amount or 0) - (t.cr_amount or 0) for t in combination
-                        )
-
-                        # Get statement transaction amount safely
-                        statement_amount = float(
-                            statement_transaction.get(
-                                "cr_amount", statement_transaction.get("dr_amount", 0)
-                            )
-                        )
-
-                        # Check if the net difference matches the statement transaction amount
-                        if (
-                            abs(round(net_difference, 2) - round(statement_amount, 2))
-                            < settings.BANK_RECONCILIATION_TOLERANCE
-                        ):
-                            # Mark these transactions as reconciled
-                            statement_transaction.setdefault("transactions", []).extend(
-                                {
-                                    "transaction_id": t.pk,
-                                    "updated_at": t.updated_at,
-                                }
-                                for t in combination
-                                if t.pk
-                                not in {
-                                    transaction["transaction_id"]
-                                    for transaction in statement_transaction.get(
-                                        "transactions", []
-                                    )
-                                }
-                            )
-
-                            # Remove reconciled system transactions
-                            for system_transaction in combination:
-                                if (
-                                    system_transaction
-                                    in unreconciled_system_transactions
-                                ):
-                                    unreconciled_system_transactions.remove(
-                                        system_transaction
-                                    )
-
-                            # Add to reconciled transactions and remove from unreconciled
-                            reconciled_transactions.append(statement_transaction)
-                            unreconciled_statement_transactions.remove(
-                                statement_transaction
-                            )
-
-                            # Update system transactions by date
-                            merged_system_transactions_by_date[date_str] = [
-                                t
-                                for t in merged_system_transactions_by_date[date_str]
-                                if t not in combination
-                            ]
-
-                            # Clean up empty date entries
-                            if not merged_system_transactions_by_date[date_str]:
-                                del merged_system_transactions_by_date[date_str]
-
-                            reconciliation_found = True
-                            break
-
-                    if reconciliation_found:
-                        break
-
-        # now compare the remaining unreconciled statement transactions and unreconciled system transactions, where system_transaction date can be within 3 days of statement_transaction date
-        for statement_transaction in unreconciled_statement_transactions[:]:
-            statement_date = datetime.strptime(
-                statement_transaction["date"], "%Y-%m-%d"
-            ).date()
-
-            date_range_start = statement_date - timedelta(
-                days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS
-            )
-            date_range_end = statement_date
-
-            # Filter system transactions within the specified date range
-            date_filtered_system_transactions = [
-                t
-                for t in unreconciled_system_transactions
-                if date_range_start <= t.journal_entry.date <= date_range_end
-            ]
-
-            # Skip if no system transactions in the date range
-            if not date_filtered_system_transactions:
-                continue
-
-            # Group system transactions by date
-            merged_system_transactions_by_date = {}
-            for system_transaction in date_filtered_system_transactions:
-                date_str = system_transaction.journal_entry.date.strftime("%Y-%m-%d")
-                merged_system_transactions_by_date.setdefault(date_str, []).append(
-                    system_transaction
-                )
-
-            reconciliation_found = False
-
-            # Iterate through dates and transaction combinations
-            for date_str, system_transactions_by_date in list(
-                merged_system_transactions_by_date.items()
-            ):
-                if reconciliation_found:
-                    break
-
-                # Try combinations of 1 to all transactions on the date
-                for r in range(2, len(system_transactions_by_date) + 1):
-                    for combination in combinations(system_transactions_by_date, r):
-                        # Calculate the net difference: debits - credits
-                        net_difference = sum(
-                            (t.dr_amount or 0) - (t.cr_amount or 0) for t in combination
-                        )
-
-                        # Get statement transaction amount safely
-                        statement_amount = float(
-                            statement_transaction.get(
-                                "cr_amount", statement_transaction.get("dr_amount", 0)
-                            )
-                        )
-
-                        # Check if the net difference matches the statement transaction amount
-                        if (
-                            abs(round(net_difference, 2) - round(statement_amount, 2))
-                            < settings.BANK_RECONCILIATION_TOLERANCE
-                        ):
-                            # Mark these transactions as reconciled
-                            statement_transaction.setdefault("transactions", []).extend(
-                                {
-                                    "transaction_id": t.pk,
-                                    "updated_at": t.updated_at,
-                                }
-                                for t in combination
-                                if t.pk
-                                not in {
-                                    transaction["transaction_id"]
-                                    for transaction in statement_transaction.get(
-                                        "transactions", []
-                                    )
-                                }
-                            )
-
-                            # Remove reconciled system transactions
-                            for system_transaction in combination:
-                                if (
-                                    system_transaction
-                                    in unreconciled_system_transactions
-                                ):
-                                    unreconciled_system_transactions.remove(
-                                        system_transaction
-                                    )
-
-                            # Add to reconciled transactions and remove from unreconciled
-                            reconciled_transactions.append(statement_transaction)
-                            unreconciled_statement_transactions.remove(
-                                statement_transaction
-                            )
-
-                            # Update system transactions by date
-                            merged_system_transactions_by_date[date_str] = [
-                                t
-                                for t in merged_system_transactions_by_date[date_str]
-                                if t not in combination
-                            ]
-
-                            # Clean up empty date entries
-                            if not merged_system_transactions_by_date[date_str]:
-                                del merged_system_transactions_by_date[date_str]
-
-                            reconciliation_found = True
-                            break
-
-                    if reconciliation_found:
-                        break
-
-        # Combine reconciled and unreconciled transactions into a single list
-        with transaction.atomic():
-            bank_reconciliation_entries = []
-
-            # add to bank reconciliation
-            bank_reconciliation_statement = ReconciliationStatement.objects.create(
-                company_id=company_id,
-                account_id=account_id,
-                start_date=start_date,
-                end_date=end_date,
-            )
-
-            bank_reconciliation_entries = []
-
-            # Collect transactions to link after bulk creation
-            reconciliation_transactions = []
-
-            # Add reconciled transactions
-            for statement_transaction in reconciled_transactions:
-                reconciliation_row = ReconciliationRow(
-                    date=statement_transaction["date"],
-                    dr_amount=statement_transaction.get("dr_amount") or None,
-                    cr_amount=statement_transaction.get("cr_amount") or None,
-                    status=statement_transaction.get("status", "Matched"),
-                    balance=statement_transaction.get("balance", None),
-                    statement_id=bank_reconciliation_statement.pk,
-                    description=statement_transaction.get("description", None),
-                )
-                bank_reconciliation_entries.append(reconciliation_row)
-                reconciliation_transactions.append(
-                    (reconciliation_row, statement_transaction.get("transactions", []))
-                )
-
-            # Add unreconciled transactions
-            for statement_transaction in unreconciled_statement_transactions:
-                reconciliation_row = ReconciliationRow(
-                    date=statement_transaction["date"],
-                    dr_amount=statement_transaction.get("dr_amount") or None,
-                    cr_amount=statement_transaction.get("cr_amount") or None,
-                    status="Unreconciled",
-                    balance=statement_transaction.get("balance", None),
-                    statement_id=bank_reconciliation_statement.pk,
-                    description=statement_transaction.get("description", None),
-                )
-                bank_reconciliation_entries.append(reconciliation_row)
-
-            # Perform bulk_create
-            ReconciliationRow.objects.bulk_create(
-                bank_reconciliation_entries, batch_size=500
-            )
-
-            # Link transactions in bulk
-            reconciliation_row_mapping = {
-                row: transactions for row, transactions in reconciliation_transactions
-            }
-
-            # Prepare ReconciliationRowTransaction objects
-            bulk_transactions = [
-                ReconciliationRowTransaction(
-                    reconciliation_row=row,
-                    transaction_id=transaction["id"],
-                    transaction_last_updated_at=transaction["updated_at"],
-                )
-                for row, transactions in reconciliation_row_mapping.items()
-                for transaction in transactions
-                if transaction.get("id")
-            ]
-
-            # Perform bulk_create for transactions
-            ReconciliationRowTransaction.objects.bulk_create(
-                bulk_transactions, batch_size=500
-            )
-
-        reconciled_length = 0
-        matched_length = 0
-        for statement_transaction in reconciled_transactions:
-            if statement_transaction.get("status") == "Reconciled":
-                reconciled_length += 1
-            else:
-                matched_length += 1
-        # email the user
-        header = "Bank Reconciliation Statement Import Completed"
-        message = (
-            "Bank Reconciliation Statement Import Completed, with "
-            + str(reconciled_length)
-            + " transactions reconciled, "
-            + str(matched_length)
-            + " transactions matched and "
-            + str(len(unreconciled_statement_transactions))
-            + " transactions unreconciled"
-        )
-        send_mail(header, message, settings.DEFAULT_FROM_EMAIL, [email])
-        return
-    except Exception as e:
-        header = "Bank Reconciliation Statement Import Failed"
-        message = "Something went wrong, please contact support"
-        send_mail(header, message, settings.DEFAULT_FROM_EMAIL, [email])
-        return e
-
-
 class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
     queryset = (
         ReconciliationStatement.objects.all()
@@ -1356,6 +387,13 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
             return ReconciliationStatementListSerializer
         return self.serializer_class
 
+    def get_queryset(self, company_id=None):
+        queryset = super().get_queryset(company_id)
+        if self.action in ("retrieve", "updated_transactions"):
+            # * Rows of these are fetched a page of groups at a time
+            return queryset.prefetch_related(None)
+        return queryset
+
     def filter_queryset(self, queryset):
         if self.action == "retrieve":
             return queryset
@@ -1377,131 +415,57 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
         "end_date",
     ]
 
-    def merge_transactions(self, statement_transactions, system_transactions):
-        # Convert querysets to lists to avoid repeated database queries
-        statements = list(statement_transactions)
-        transactions = list(system_transactions)
-        # 4. Create Mappings Using Dictionaries
-        statement_to_systems_map = defaultdict(list)
-        system_to_statements_map = defaultdict(list)
-
-        transaction_dict = {t.id: t for t in transactions}
-
-        for statement in statements:
-            for transaction_id in statement.transaction_ids:
-                system_transaction = transaction_dict.get(transaction_id)
-                if system_transaction:
-                    statement_to_systems_map[statement].append(system_transaction)
-                    system_to_statements_map[system_transaction].append(statement)
-
-        # 5. Group Transactions Efficiently
-        merged_groups = []
-        processed_statements = set()
-        processed_systems = set()
-
-        for statement, system_transactions in statement_to_systems_map.items():
-            if statement in processed_statements:
-                continue
-
-            group = {"statement_transactions": [], "system_transactions": []}
-
-            # Add current statement and its systems
-            group["statement_transactions"].append(statement)
-            processed_statements.add(statement)
-
-            for system_transaction in system_transactions:
-                if system_transaction not in processed_systems:
-                    group["system_transactions"].append(system_transaction)
-                    processed_systems.add(system_transaction)
-
-                    # Add other statements related to this system
-                    for other_statement in system_to_statements_map[system_transaction]:
-                        if other_statement not in processed_statements:
-                            group["statement_transactions"].append(other_statement)
-                            processed_statements.add(other_statement)
-
-            merged_groups.append(
-                {
-                    "statement_transactions": ReconciliationRowSerializer(
-                        group["statement_transactions"], many=True
-                    ).data,
-                    "system_transactions": TransactionMinSerializer(
-                        group["system_transactions"], many=True
-                    ).data,
-                }
-            )
-
-        # Add unprocessed statements (no matching system transactions)
-        for statement in statements:
-            if statement not in processed_statements:
-                merged_groups.insert(
-                    0,
-                    {
-                        "statement_transactions": ReconciliationRowSerializer(
-                            [statement], many=True
-                        ).data,
-                        "system_transactions": [],
-                    },
-                )
-
-        # Add unprocessed system transactions (no matching statements)
-        for system_transaction in transactions:
-            if system_transaction not in processed_systems:
-                merged_groups.insert(
-                    0,
-                    {
-                        "statement_transactions": [],
-                        "system_transactions": TransactionMinSerializer(
-                            [system_transaction], many=True
-                        ).data,
-                    },
-                )
-
-        return merged_groups
-
-    def get_paginated_merged_transactions(self, bank_statements, company, account_id):
-        page = self.paginate_queryset(bank_statements)
-        page = [json.loads(row[0]) for row in page if isinstance(row[0], str)]
-        all_transaction_ids = set(
-            data
-            for entry in page
-            if entry["transaction_ids"]
-            for data in entry["transaction_ids"]
-        )
-
-        all_statement_ids = set(
-            {data for entry in page for data in entry["grouped_statements"]}
-        )
-
-        # Fetch system transactions based on transaction ids
-        system_transactions = (
+    def get_paginated_groups(self, rows, company, account_id):
+        """
+        Paginates the groups of `rows` and the system transactions matched with them, with
+        the rows and transactions of a page fetched in bulk.
+        """
+        page = self.paginate_queryset(ReconciliationGroups(rows))
+        rows_by_id = ReconciliationRow.objects.filter(
+            id__in=[row_id for row_ids, transaction_ids in page for row_id in row_ids]
+        ).in_bulk()
+        transactions_by_id = (
             Transaction.objects.filter(
                 company=company,
                 account_id=account_id,
-                id__in=all_transaction_ids,
+                id__in=[
+                    transaction_id
+                    for row_ids, transaction_ids in page
+                    for transaction_id in transaction_ids
+                ],
             )
-            .order_by("journal_entry__date")
             .select_related("journal_entry__content_type")
             .prefetch_related(
-                "journal_entry__transactions__account", "journal_entry__source"
+                Prefetch(
+                    "journal_entry__transactions",
+                    queryset=Transaction.objects.select_related("account"),
+                ),
+                "journal_entry__source",
             )
+            .in_bulk()
         )
 
-        # Fetch reconciliation rows for the filtered statement ids
-        statements_queryset = (
-            ReconciliationRow.objects.filter(
-                statement__company=company,
-                statement__account_id=account_id,
-                id__in=all_statement_ids,
+        groups = []
+        for row_ids, transaction_ids in page:
+            system_transactions = sorted(
+                (
+                    transactions_by_id[transaction_id]
+                    for transaction_id in transaction_ids
+                    if transaction_id in transactions_by_id
+                ),
+                key=lambda t: (t.date, t.id),
             )
-            .annotate(transaction_ids=ArrayAgg("transactions__transaction_id"))
-            .select_related("statement")
-        )
-        merged_transactions = self.merge_transactions(
-            statements_queryset, system_transactions
-        )
-
-        return self.get_paginated_response(merged_transactions)
+            groups.append(
+                {
+                    "statement_transactions": ReconciliationRowSerializer(
+                        [rows_by_id[row_id] for row_id in sorted(row_ids)], many=True
+                    ).data,
+                    "system_transactions": TransactionMinSerializer(
+                        system_transactions, many=True
+                    ).data,
+                }
+            )
+        return self.get_paginated_response(groups)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -1532,86 +496,18 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
                 )
             filters &= Q(date__range=[start_date, end_date])
 
-        filtered_rows = instance.rows.filter(filters).distinct()
+        filtered_rows = instance.rows.filter(filters)
 
-        related_statement_ids = (
-            ReconciliationRow.objects.filter(
-                statement__company=request.company,
-                statement__account_id=instance.account_id,
-                transactions__transaction_id__in=Subquery(
-                    filtered_rows.values_list("transactions__transaction_id", flat=True)
-                ),
+        # Rows matched with the same transactions as the filtered rows are shown with them
+        rows = instance.rows.filter(
+            Q(id__in=filtered_rows.values("id"))
+            | Q(
+                transactions__transaction_id__in=filtered_rows.filter(
+                    transactions__transaction__isnull=False
+                ).values("transactions__transaction_id")
             )
-            .values_list("id", flat=True)
-            .distinct()
-        )
-
-        combined_statement_ids = filtered_rows.values_list("id", flat=True).union(
-            related_statement_ids
-        )
-
-        ids_string = ", ".join([str(id) for id in combined_statement_ids])
-
-        query = f"""
-            WITH grouped_data AS (
-                SELECT
-                    brt.transaction_id,
-                    ARRAY_AGG(DISTINCT b.id) AS grouped_statements,
-                    ARRAY_AGG(DISTINCT brt.transaction_id) FILTER (WHERE brt.transaction_id IS NOT NULL) AS transaction_ids
-                FROM bank_reconciliationrow b
-                LEFT OUTER JOIN bank_reconciliationrowtransaction brt
-                    ON b.id = brt.reconciliation_row_id
-                WHERE b.statement_id = {instance.id}
-                AND b.id IN (
-                    {ids_string}
-                )
-                GROUP BY brt.transaction_id
-            ),
-            combined_data AS (
-                SELECT transaction_id, grouped_statements, transaction_ids
-                FROM grouped_data
-                WHERE transaction_id IS NOT NULL
-
-                UNION ALL
-
-                SELECT NULL AS transaction_id,
-                    ARRAY[b.id]::INTEGER[] AS grouped_statements,
-                    ARRAY[NULL]::INTEGER[] AS transaction_ids
-                FROM bank_reconciliationrow b
-                WHERE b.statement_id = {instance.id}
-                AND b.id IN (
-                    {ids_string}
-                )
-                AND NOT EXISTS (
-                    SELECT 1
-                    FROM bank_reconciliationrowtransaction brt
-                    WHERE brt.reconciliation_row_id = b.id
-                )
-            ),
-            flattened_data AS (
-                SELECT
-                    transaction_id,
-                    grouped_statements,
-                    unnest(transaction_ids) AS flattened_transaction_id
-                FROM combined_data
-            )
-            SELECT
-                jsonb_build_object(
-                    'transactions__transaction_id', MAX(transaction_id),
-                    'grouped_statements', grouped_statements,
-                    'transaction_ids', ARRAY_AGG(DISTINCT flattened_transaction_id) FILTER (WHERE flattened_transaction_id IS NOT NULL)
-                ) AS result
-            FROM flattened_data
-            GROUP BY grouped_statements
-            ORDER BY MAX(transaction_id) DESC NULLS LAST
-            """
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            bank_statements = cursor.fetchall()
-        return self.get_paginated_merged_transactions(
-            bank_statements, request.company, instance.account_id
-        )
+        ).distinct()
+        return self.get_paginated_groups(rows, request.company, instance.account_id)
 
     @action(detail=True, url_path="statement-info")
     def get_statement_info(self, request, pk, *args, **kwargs):
@@ -1694,18 +590,47 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
             <= datetime.strptime(transaction["date"], "%Y-%m-%d").date()
             <= end_date
         ]
-        async_task(
-            reconcile,
-            request.company.id,
-            transactions,
-            start_date,
-            end_date,
-            account_id,
-            request.user.email,
-            serializer.validated_data.get("merge_description", False),
+
+        # Rows are saved first and reconciled in the background a chunk of dates at a time
+        with transaction.atomic():
+            statement = ReconciliationStatement.objects.create(
+                company=request.company,
+                account_id=account_id,
+                start_date=start_date
+                - timedelta(days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS),
+                end_date=end_date
+                + timedelta(days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS),
+                merge_description=serializer.validated_data.get(
+                    "merge_description", False
+                ),
+                imported_by=request.user,
+            )
+            create_statement_rows(statement, transactions)
+            statement.queue_reconcile()
+
+        return Response(ReconciliationStatementProgressSerializer(statement).data)
+
+    @action(detail=True, url_path="import-progress")
+    def import_progress(self, request, pk, *args, **kwargs):
+        statement = get_object_or_404(
+            ReconciliationStatement, pk=pk, company=request.company
         )
+        return Response(ReconciliationStatementProgressSerializer(statement).data)
 
-        return Response({})
+    @action(detail=True, methods=["POST"], url_path="resume-import")
+    def resume_import(self, request, pk, *args, **kwargs):
+        with transaction.atomic():
+            statement = get_object_or_404(
+                ReconciliationStatement.objects.select_for_update(),
+                pk=pk,
+                company=request.company,
+            )
+            if statement.import_status != "Failed":
+                raise ValidationError(
+                    {"detail": "Only a failed statement import can be resumed."}
+                )
+            statement.queue_reconcile()
+        return Response(ReconciliationStatementProgressSerializer(statement).data)
 
     @action(detail=False, url_path="matched-transactions")
     def matched_transactions(self, request, *args, **kwargs):
@@ -1718,71 +643,13 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
                 {"detail": "start_date, end_date and account_id are required"}
             )
 
-        query = f"""
-           WITH grouped_data AS (
-                SELECT
-                    brt.transaction_id,
-                    ARRAY_AGG(DISTINCT b.id) AS grouped_statements,
-                    ARRAY_AGG(DISTINCT brt.transaction_id) FILTER (WHERE brt.transaction_id IS NOT NULL) AS transaction_ids
-                FROM bank_reconciliationrow b
-                LEFT OUTER JOIN bank_reconciliationrowtransaction brt
-                    ON b.id = brt.reconciliation_row_id
-                JOIN bank_reconciliationstatement s
-                    ON b.statement_id = s.id
-                WHERE s.account_id = {account_id}
-                AND b.date BETWEEN '{start_date}' AND '{end_date}'
-                AND b.status = 'Matched'
-                AND s.company_id = {request.company.id}
-                GROUP BY brt.transaction_id
-            ),
-            combined_data AS (
-                SELECT transaction_id, grouped_statements, transaction_ids
-                FROM grouped_data
-                WHERE transaction_id IS NOT NULL
-
-                UNION ALL
-
-                SELECT NULL AS transaction_id,
-                    ARRAY[b.id]::INTEGER[] AS grouped_statements,
-                    ARRAY[NULL]::INTEGER[] AS transaction_ids
-                FROM bank_reconciliationrow b
-                JOIN bank_reconciliationstatement s
-                    ON b.statement_id = s.id
-                WHERE s.account_id = {account_id}
-                AND b.date BETWEEN '{start_date}' AND '{end_date}'
-                AND b.status = 'Matched'
-                AND s.company_id = {request.company.id}
-                AND NOT EXISTS (
-                    SELECT 1
-                    FROM bank_reconciliationrowtransaction brt
-                    WHERE brt.reconciliation_row_id = b.id
-                )
-            ),
-            flattened_data AS (
-                SELECT
-                    transaction_id,
-                    grouped_statements,
-                    unnest(transaction_ids) AS flattened_transaction_id
-                FROM combined_data
-            )
-            SELECT
-                jsonb_build_object(
-                    'transactions__transaction_id', MAX(transaction_id),
-                    'grouped_statements', grouped_statements,
-                    'transaction_ids', ARRAY_AGG(DISTINCT flattened_transaction_id) FILTER (WHERE flattened_transaction_id IS NOT NULL)
-                ) AS result
-            FROM flattened_data
-            GROUP BY grouped_statements
-            ORDER BY MAX(transaction_id) DESC NULLS LAST
-            """
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            bank_statements = cursor.fetchall()
-
-        return self.get_paginated_merged_transactions(
-            bank_statements, request.company, account_id
+        rows = ReconciliationRow.objects.filter(
+            statement__company=request.company,
+            statement__account_id=account_id,
+            date__range=[start_date, end_date],
+            status="Matched",
         )
+        return self.get_paginated_groups(rows, request.company, account_id)
 
     @action(detail=False, url_path="unreconciled-bank-transactions")
     def unreconciled_bank_transactions(self, request, *args, **kwargs):
@@ -1840,7 +707,7 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
         sort_dir = request.query_params.get("sort_dir")
 
         if sort_by not in ["dr_amount", "cr_amount"]:
-            sort_by = "journal_entry__date"
+            sort_by = "date"
 
         if sort_dir == "desc":
             sort_by = "-" + sort_by
@@ -1856,7 +723,7 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
 
         filters = Q(
             company=request.company,
-            journal_entry__date__range=[start_date, end_date],
+            date__range=[start_date, end_date],
             account_id=account_id,
         )
         if search:
@@ -2496,74 +1363,8 @@ class ReconciliationViewSet(CRULViewSet, mixins.DestroyModelMixin):
             .distinct()
         )
 
-        ids_string = ", ".join([str(id) for id in updated_deleted_statement_ids])
-        query = f"""
-           WITH grouped_data AS (
-                SELECT
-                    brt.transaction_id,
-                    ARRAY_AGG(DISTINCT b.id) AS grouped_statements,
-                    ARRAY_AGG(DISTINCT brt.transaction_id) FILTER (WHERE brt.transaction_id IS NOT NULL) AS transaction_ids
-                FROM bank_reconciliationrow b
-                LEFT OUTER JOIN bank_reconciliationrowtransaction brt
-                    ON b.id = brt.reconciliation_row_id
-                JOIN bank_reconciliationstatement s
-                    ON b.statement_id = s.id
-                WHERE s.account_id = {data.account_id}
-                AND b.id IN (
-                    {ids_string}
-                )
-                AND s.company_id = {request.company.id}
-                GROUP BY brt.transaction_id
-            ),
-            combined_data AS (
-                SELECT transaction_id, grouped_statements, transaction_ids
-                FROM grouped_data
-                WHERE transaction_id IS NOT NULL
-
-                UNION ALL
-
-                SELECT NULL AS transaction_id,
-                    ARRAY[b.id]::INTEGER[] AS grouped_statements,
-                    ARRAY[NULL]::INTEGER[] AS transaction_ids
-                FROM bank_reconciliationrow b
-                JOIN bank_reconciliationstatement s
-                    ON b.statement_id = s.id
-                WHERE s.account_id = {data.account_id}
-                AND b.id IN (
-                    {ids_string}
-                )
-                AND s.company_id = {request.company.id}
-                AND NOT EXISTS (
-                    SELECT 1
-                    FROM bank_reconciliationrowtransaction brt
-                    WHERE brt.reconciliation_row_id = b.id
-                )
-            ),
-            flattened_data AS (
-                SELECT
-                    transaction_id,
-                    grouped_statements,
-                    unnest(transaction_ids) AS flattened_transaction_id
-                FROM combined_data
-            )
-            SELECT
-                jsonb_build_object(
-                    'transactions__transaction_id', MAX(transaction_id),
-                    'grouped_statements', grouped_statements,
-                    'transaction_ids', ARRAY_AGG(DISTINCT flattened_transaction_id) FILTER (WHERE flattened_transaction_id IS NOT NULL)
-                ) AS result
-            FROM flattened_data
-            GROUP BY grouped_statements
-            ORDER BY MAX(transaction_id) DESC NULLS LAST
-            """
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            bank_statements = cursor.fetchall()
-
-        return self.get_paginated_merged_transactions(
-            bank_statements, request.company, data.account_id
-        )
+        rows = data.rows.filter(id__in=updated_deleted_statement_ids)
+        return self.get_paginated_groups(rows, request.company, data.account_id)
 
     @action(detail=False, methods=["POST"], url_path="update-transactions")
     def update_transactions(self, request, *args, **kwargs):
@@ -0,0 +1,146 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.bank.reconciliation import ReconciliationMatcher
+from apps.ledger.models import JournalEntry, Transaction
+
+
+def synthetic_transactions(count, lines_per_day, seed):
+    """
+    Returns statement lines, unsaved system transactions of a bank account and their
+    references. Each day has card settlements deposited as one system transaction per
+    batch, single receipts and payments, cheques issued that clear days later with their
+    number in the description, and lines without a system transaction.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    start = date(2000, 1, 1)
+    statement_transactions = []
+    system_transactions = []
+    references = {}
+    cleared_cheques = {}
+
+    def amount():
+        return Decimal(rng.randint(100, 5000000)) / 100
+
+    def add_system(day, dr_amount=None, cr_amount=None):
+        pk = len(system_transactions) + 1
+        system_transaction = Transaction(
+            pk=pk,
+            dr_amount=dr_amount,
+            cr_amount=cr_amount,
+            journal_entry=JournalEntry(date=day, source_voucher_id=pk),
+        )
+        system_transaction.updated_at = now
+        system_transactions.append(system_transaction)
+        references[pk] = ["PV-{:05d}".format(pk)]
+        return pk
+
+    day_index = 0
+    while len(statement_transactions) < count:
+        day = start + timedelta(days=day_index)
+        day_str = day.strftime("%Y-%m-%d")
+        lines = []
+        while len(lines) < lines_per_day:
+            kind = rng.random()
+            if kind < 0.5:
+                settlements = [amount() for _ in range(rng.randint(2, 5))]
+                lines += [{"date": day_str, "cr_amount": a} for a in settlements]
+                add_system(day, dr_amount=sum(settlements))
+            elif kind < 0.55:
+                line_amount = amount()
+                pk = add_system(day, cr_amount=line_amount)
+                references[pk].append("{:06d}".format(pk))
+                cleared_cheques.setdefault(day_index + rng.randint(5, 20), []).append(
+                    {"dr_amount": line_amount, "description": "CHQ {:06d}".format(pk)}
+                )
+            elif kind < 0.8:
+                line_amount = amount()
+                if rng.random() < 0.5:
+                    lines.append({"date": day_str, "cr_amount": line_amount})
+                    add_system(day, dr_amount=line_amount)
+                else:
+                    lines.append({"date": day_str, "dr_amount": line_amount})
+                    add_system(day, cr_amount=line_amount)
+            else:
+                lines.append({"date": day_str, "dr_amount": amount()})
+        for line in cleared_cheques.pop(day_index, []):
+            lines.append(dict(line, date=day_str))
+        for line in lines:
+            line.setdefault("dr_amount", Decimal("0"))
+            line.setdefault("cr_amount", Decimal("0"))
+            line.setdefault(
+                "description", "Line {}".format(len(statement_transactions))
+            )
+            statement_transactions.append(line)
+        day_index += 1
+
+    return statement_transactions[:count], system_transactions, references
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile a synthetic bank statement against synthetic system transactions "
+        "and report the time taken and the matches found"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lines",
+            type=int,
+            default=10000,
+            help="Number of synthetic statement lines",
+        )
+        parser.add_argument(
+            "--lines-per-day",
+            type=int,
+            default=30,
+            help="Number of statement lines on each day",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            help="Fail if matching takes longer than this",
+        )
+
+    def handle(self, *args, **options):
+        statement_transactions, system_transactions, references = (
+            synthetic_transactions(
+                options["lines"], options["lines_per_day"], options["seed"]
+            )
+        )
+
+        start = time.perf_counter()
+        reconciled, unreconciled = ReconciliationMatcher(
+            statement_transactions, system_transactions, references=references
+        ).run()
+        elapsed = time.perf_counter() - start
+
+        same_date = sum(1 for t in reconciled if t.get("status") == "Reconciled")
+        self.stdout.write(
+            "{} statement lines, {} system transactions: {} reconciled, {} matched and "
+            "{} unreconciled in {:.2f}s".format(
+                len(statement_transactions),
+                len(system_transactions),
+                same_date,
+                len(reconciled) - same_date,
+                len(unreconciled),
+                elapsed,
+            )
+        )
+        if options["max_seconds"] and elapsed > options["max_seconds"]:
+            raise CommandError(
+                "Matching took {:.2f}s, more than {}s".format(
+                    elapsed, options["max_seconds"]
+                )
+            )
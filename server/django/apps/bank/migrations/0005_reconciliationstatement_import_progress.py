@@ -0,0 +1,51 @@
+# Generated by Django 4.2.20 on 2026-10-18 17:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bank', '0004_alter_bankaccount_transaction_commission_percent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='import_status',
+            field=models.CharField(choices=[('Queued', 'Queued'), ('Importing', 'Importing'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Completed', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='merge_description',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='imported_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='total_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='processed_rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='processed_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reconciliationstatement',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.transaction import on_commit
 from rest_framework.exceptions import ValidationError as RestValidationError
 
 from apps.company.models import Company, CompanyBaseModel
@@ -493,6 +494,14 @@ BANK_RECONCILIATION_STATUS = (
 )
 
 
+STATEMENT_IMPORT_STATUSES = (
+    ("Queued", "Queued"),
+    ("Importing", "Importing"),
+    ("Completed", "Completed"),
+    ("Failed", "Failed"),
+)
+
+
 class ReconciliationStatement(models.Model):
     account = models.ForeignKey(
         Account, on_delete=models.CASCADE, related_name="bank_reconciliation_statements"
@@ -504,9 +513,53 @@ class ReconciliationStatement(models.Model):
     end_date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Rows are imported first and reconciled in chunks of dates, up to `processed_until`
+    import_status = models.CharField(
+        choices=STATEMENT_IMPORT_STATUSES, default="Completed", max_length=20
+    )
+    merge_description = models.BooleanField(default=False)
+    imported_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    processed_until = models.DateField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
     def __str__(self):
         return self.file_name or str(self.start_date)
 
+    @property
+    def progress(self):
+        if self.import_status == "Completed":
+            return 100
+        if not self.total_rows:
+            return 0
+        return int(self.processed_rows * 100 / self.total_rows)
+
+    def queue_reconcile(self):
+        """
+        Queues reconciling the rows of the statement in the background, from the chunk
+        after `processed_until` for a statement whose import has stopped.
+        """
+        self.import_status = "Queued"
+        self.error = None
+        self.save(update_fields=["import_status", "error"])
+        from django_q.tasks import async_task
+
+        statement_id = self.id
+        on_commit(
+            lambda: async_task(
+                "apps.bank.tasks.reconcile_statement",
+                statement_id,
+                task_name="reconciliation-statement-{}".format(statement_id),
+            )
+        )
+
 
 class ReconciliationRow(models.Model):
     status = models.CharField(
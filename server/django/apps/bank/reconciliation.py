@@ -0,0 +1,975 @@
+import math
+import re
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Q
+
+from apps.bank.models import (
+    ChequeDeposit,
+    ChequeIssue,
+    ReconciliationRow,
+    ReconciliationRowTransaction,
+)
+from apps.ledger.models import Transaction
+
+
+def to_cents(amount):
+    return int(
+        (Decimal(str(amount or 0)) * 100).to_integral_value(rounding=ROUND_HALF_UP)
+    )
+
+
+def get_tolerance_cents():
+    # Amounts match when they differ by less than the tolerance, 0.01 being an exact match
+    return max(math.ceil(settings.BANK_RECONCILIATION_TOLERANCE * 100) - 1, 0)
+
+
+# Most subsets of half the amounts enumerated for a meet-in-the-middle search
+MEET_IN_THE_MIDDLE_LIMIT = 1 << 18
+
+
+def count_subsets(count, max_size):
+    return sum(math.comb(count, size) for size in range(min(count, max_size) + 1))
+
+
+def find_subset_meet_in_the_middle(
+    items, target, max_size, tolerance, min_size, bounded
+):
+    """
+    Splits `items`, (index, amount) pairs, in halves and looks up the sums of subsets of
+    one half missing from subsets of the other, for groups of growing size. Returns the
+    first group of the smallest size, earlier indexes breaking ties.
+    """
+    middle = len(items) // 2
+    halves = (items[:middle], items[middle:])
+    # Subsets of each half by size as (last position, sum, indexes), and their sums with
+    # the first subset reaching each
+    levels = ([[(-1, 0, ())]], [[(-1, 0, ())]])
+    sums = ([{0: ()}], [{0: ()}])
+
+    def subsets(half, size):
+        half_items = halves[half]
+        while len(sums[half]) <= size:
+            level = [
+                (
+                    position,
+                    total + half_items[position][1],
+                    indexes + (half_items[position][0],),
+                )
+                for last, total, indexes in levels[half][-1]
+                for position in range(last + 1, len(half_items))
+                if not bounded or total + half_items[position][1] <= target + tolerance
+            ]
+            levels[half].append(level)
+            found = {}
+            for last, total, indexes in level:
+                found.setdefault(total, indexes)
+            sums[half].append(found)
+        return sums[half][size]
+
+    for size in range(min_size, min(max_size, len(items)) + 1):
+        found = None
+        for left_size in range(
+            max(size - len(halves[1]), 0), min(size, len(halves[0])) + 1
+        ):
+            left = subsets(0, left_size)
+            for total, indexes in subsets(1, size - left_size).items():
+                for difference in range(-tolerance, tolerance + 1):
+                    left_indexes = left.get(target - total + difference)
+                    if left_indexes is not None:
+                        group = left_indexes + indexes
+                        if found is None or group < found:
+                            found = group
+        if found is not None:
+            return found
+    return None
+
+
+def find_subset_by_sums(
+    items, target, max_size, tolerance, min_size, bounded, deadline
+):
+    """
+    Keeps the sums reachable with the items seen so far with the fewest indexes reaching
+    them, adding one item at a time, so that the search grows with the distinct sums
+    instead of the combinations of the items. Returns the smallest group completed by the
+    earliest item.
+    """
+    states = {0: ()}
+    for index, amount in items:
+        found = None
+        for count, (total, indexes) in enumerate(list(states.items())):
+            if len(indexes) >= max_size:
+                continue
+            if deadline and not count % 1024 and time.monotonic() > deadline:
+                return None
+            total += amount
+            if bounded and total > target + tolerance:
+                continue
+            indexes += (index,)
+            if abs(total - target) <= tolerance and len(indexes) >= min_size:
+                if found is None or len(indexes) < len(found):
+                    found = indexes
+                continue
+            existing = states.get(total)
+            if existing is None or len(indexes) < len(existing):
+                states[total] = indexes
+        if found is not None:
+            return found
+    return None
+
+
+def find_subset(amounts, target, max_size, tolerance=0, deadline=None, min_size=2):
+    """
+    Returns the indexes of a group of at least `min_size` and at most `max_size` of
+    `amounts`, in cents, adding up to `target` within `tolerance`, or None.
+
+    When the amounts share the sign of the target, amounts and sums going past it are
+    dropped. Few enough amounts are searched meet-in-the-middle, others by their reachable
+    sums until `deadline`, a `time.monotonic()` value.
+    """
+    if target < 0 and all(amount <= 0 for amount in amounts):
+        amounts = [-amount for amount in amounts]
+        target = -target
+    bounded = target >= 0 and all(amount >= 0 for amount in amounts)
+    items = [
+        (index, amount)
+        for index, amount in enumerate(amounts)
+        if not bounded or amount <= target + tolerance
+    ]
+    if bounded and sum(amount for index, amount in items) < target - tolerance:
+        return None
+
+    if (
+        count_subsets(len(items) - len(items) // 2, max_size)
+        <= MEET_IN_THE_MIDDLE_LIMIT
+    ):
+        found = find_subset_meet_in_the_middle(
+            items, target, max_size, tolerance, min_size, bounded
+        )
+    else:
+        found = find_subset_by_sums(
+            items, target, max_size, tolerance, min_size, bounded, deadline
+        )
+    return list(found) if found is not None else None
+
+
+class DateIndex:
+    """
+    Transactions by date, keyed to be removed in constant time, with the dates kept sorted
+    for range lookups. Transactions of a date are returned in the order they were added.
+    """
+
+    def __init__(self):
+        self.dates = []
+        self.by_date = {}
+
+    def add(self, date, key, transaction):
+        if date not in self.by_date:
+            insort(self.dates, date)
+            self.by_date[date] = {}
+        self.by_date[date][key] = transaction
+
+    def remove(self, date, key):
+        del self.by_date[date][key]
+
+    def on(self, date):
+        return list(self.by_date.get(date, {}).values())
+
+    def dates_between(self, start_date, end_date):
+        return self.dates[
+            bisect_left(self.dates, start_date) : bisect_right(self.dates, end_date)
+        ]
+
+    def between(self, start_date, end_date):
+        return [
+            transaction
+            for date in self.dates_between(start_date, end_date)
+            for transaction in self.by_date[date].values()
+        ]
+
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Share of system transactions above which a token of their references is not indexed
+REFERENCE_INDEX_MAX_SHARE = 0.05
+
+
+def tokenize(text):
+    """
+    Returns the words of at least three characters in `text`, lowercased and numbers
+    without leading zeros, along with adjacent words joined, so that references written
+    with separators, as "SI-0012" or "CHQ 004512", are also found whole.
+    """
+    words = WORD_PATTERN.findall(str(text or "").lower())
+    tokens = set()
+    for index, word in enumerate(words):
+        if word.isdigit():
+            word = word.lstrip("0")
+        if len(word) >= 3:
+            tokens.add(word)
+        if index:
+            tokens.add(words[index - 1] + words[index])
+    return tokens
+
+
+class ReferenceIndex:
+    """
+    Inverted index of tokens of the references of system transactions, their voucher
+    numbers, cheque numbers and party names, to the transactions they refer to. Tokens
+    shared by many transactions, as common words of party names, are weighed less, and
+    those shared by more than `REFERENCE_INDEX_MAX_SHARE` of the transactions not at all.
+    """
+
+    def __init__(self, references):
+        postings = defaultdict(set)
+        for pk, texts in references.items():
+            for text in texts:
+                # References are also indexed whole, without separators
+                whole = "".join(WORD_PATTERN.findall(str(text or "").lower()))
+                for token in tokenize(text) | {whole}:
+                    if len(token) >= 3:
+                        postings[token].add(pk)
+
+        count = len(references)
+        max_postings = max(10, int(count * REFERENCE_INDEX_MAX_SHARE))
+        self.postings = {}
+        self.weights = {}
+        for token, pks in postings.items():
+            if len(pks) <= max_postings:
+                self.postings[token] = pks
+                self.weights[token] = math.log(1 + count / len(pks))
+
+    def scores(self, text):
+        """
+        Scores the transactions whose references share tokens with `text`, by the weights
+        of the shared tokens, and returns them by primary key.
+        """
+        scores = defaultdict(float)
+        for token in tokenize(text):
+            pks = self.postings.get(token)
+            if pks:
+                weight = self.weights[token]
+                for pk in pks:
+                    scores[pk] += weight
+        return scores
+
+
+class ReconciliationMatcher:
+    """
+    Matches statement transactions, parsed rows of a bank statement, with system
+    transactions of the bank account. Single transactions are matched on amount first, and
+    then groups of transactions adding up to a single one, within the same date and then
+    within the lookahead and lookback days.
+
+    Unreconciled transactions are kept by date, and system transactions also by amount in
+    cents and side, so that each lookup only visits the transactions it can match.
+    Matched statement transactions get the system transactions they match in
+    `transactions`, and the status "Reconciled" when matched on the same date.
+
+    With `references`, texts identifying system transactions by primary key, statement
+    descriptions are scored against them through a `ReferenceIndex`. Scores break ties
+    between single transactions of the same amount, and at last match the rest with
+    transactions of the same amount they refer to within the reference days.
+    """
+
+    def __init__(
+        self,
+        statement_transactions,
+        system_transactions,
+        merge_description=False,
+        references=None,
+    ):
+        self.statement_transactions = statement_transactions
+        self.merge_description = merge_description
+        self.reconciled_transactions = []
+        self.reference_index = ReferenceIndex(references) if references else None
+        self.reference_scores = {}
+
+        # Statement transactions are keyed by id() as they are plain dicts
+        self.unreconciled_statement_transactions = {}
+        self.statement_dates = {}
+        self.statements_by_date = DateIndex()
+        for statement_transaction in statement_transactions:
+            key = id(statement_transaction)
+            date = datetime.strptime(statement_transaction["date"], "%Y-%m-%d").date()
+            self.unreconciled_statement_transactions[key] = statement_transaction
+            self.statement_dates[key] = date
+            self.statements_by_date.add(date, key, statement_transaction)
+
+        self.unreconciled_system_transactions = {}
+        self.system_positions = {}
+        self.system_by_date = DateIndex()
+        self.system_by_amount = {}
+        for position, system_transaction in enumerate(system_transactions):
+            pk = system_transaction.pk
+            self.unreconciled_system_transactions[pk] = system_transaction
+            self.system_positions[pk] = position
+            self.system_by_date.add(
+                system_transaction.journal_entry.date, pk, system_transaction
+            )
+            for key in self.system_amount_keys(system_transaction):
+                self.system_by_amount.setdefault(key, {})[pk] = system_transaction
+
+        self.tolerance = get_tolerance_cents()
+        self.max_group_size = settings.BANK_RECONCILIATION_MAX_GROUP_SIZE
+        self.deadline = time.monotonic() + settings.BANK_RECONCILIATION_MATCH_SECONDS
+
+    @staticmethod
+    def system_amount_keys(system_transaction):
+        keys = []
+        if system_transaction.dr_amount:
+            keys.append(("dr", to_cents(system_transaction.dr_amount)))
+        if system_transaction.cr_amount:
+            keys.append(("cr", to_cents(system_transaction.cr_amount)))
+        return keys
+
+    def find_group(self, amounts, target):
+        now = time.monotonic()
+        if now > self.deadline:
+            return None
+        return find_subset(
+            amounts,
+            target,
+            self.max_group_size,
+            tolerance=self.tolerance,
+            deadline=min(
+                self.deadline, now + settings.BANK_RECONCILIATION_GROUP_SEARCH_SECONDS
+            ),
+        )
+
+    def find_sided_group(self, sides, target_dr, target_cr):
+        """
+        Finds a group of (dr, cr) amounts in cents whose debits add up to `target_dr` and
+        credits to `target_cr`. Against a one sided target, only amounts on that side are
+        grouped, otherwise the group is matched on the net amount.
+        """
+        if target_dr and target_cr:
+            return self.find_group([dr - cr for dr, cr in sides], target_dr - target_cr)
+        if not target_dr and not target_cr:
+            return None
+        side = 0 if target_dr else 1
+        candidates = [
+            index for index, amounts in enumerate(sides) if not amounts[1 - side]
+        ]
+        found = self.find_group(
+            [sides[index][side] for index in candidates], target_dr or target_cr
+        )
+        if found is None:
+            return None
+        return [candidates[index] for index in found]
+
+    def link(self, statement_transaction, system_transaction, has_same_date=False):
+        statement_transaction.setdefault("transactions", []).append(
+            {
+                "id": system_transaction.pk,
+                "updated_at": system_transaction.updated_at,
+            }
+        )
+        if has_same_date:
+            statement_transaction["status"] = "Reconciled"
+
+    def remove_system_transaction(self, system_transaction):
+        pk = system_transaction.pk
+        del self.unreconciled_system_transactions[pk]
+        self.system_by_date.remove(system_transaction.journal_entry.date, pk)
+        for key in self.system_amount_keys(system_transaction):
+            del self.system_by_amount[key][pk]
+
+    def reconcile_statement_transaction(self, statement_transaction):
+        key = id(statement_transaction)
+        self.reconciled_transactions.append(statement_transaction)
+        del self.unreconciled_statement_transactions[key]
+        self.statements_by_date.remove(self.statement_dates[key], key)
+
+    def statement_date(self, statement_transaction):
+        return self.statement_dates[id(statement_transaction)]
+
+    def get_reference_scores(self, statement_transaction):
+        if self.reference_index is None:
+            return {}
+        key = id(statement_transaction)
+        if key not in self.reference_scores:
+            self.reference_scores[key] = self.reference_index.scores(
+                statement_transaction.get("description")
+            )
+        return self.reference_scores[key]
+
+    def find_amount_candidates(self, statement_transaction, start_date, end_date):
+        """
+        Returns the system transactions between the dates on the opposite side having the
+        same amount as a statement transaction.
+        """
+        candidates = []
+        for statement_side, system_side in (("dr_amount", "cr"), ("cr_amount", "dr")):
+            cents = to_cents(statement_transaction.get(statement_side))
+            if not cents:
+                continue
+            for amount in range(cents - self.tolerance, cents + self.tolerance + 1):
+                candidates += [
+                    system_transaction
+                    for system_transaction in self.system_by_amount.get(
+                        (system_side, amount), {}
+                    ).values()
+                    if start_date <= system_transaction.journal_entry.date <= end_date
+                ]
+        return candidates
+
+    def match_single(self, statement_transaction, start_date, end_date):
+        """
+        Reconciles a statement transaction with the first system transaction between the
+        dates on the opposite side having the same amount, preferring those its
+        description refers to.
+        """
+        candidates = self.find_amount_candidates(
+            statement_transaction, start_date, end_date
+        )
+        if not candidates:
+            return False
+
+        if len(candidates) > 1:
+            scores = self.get_reference_scores(statement_transaction)
+            system_transaction = min(
+                candidates,
+                key=lambda t: (-scores.get(t.pk, 0), self.system_positions[t.pk]),
+            )
+        else:
+            system_transaction = candidates[0]
+        statement_transaction["transactions"] = [
+            {
+                "id": system_transaction.pk,
+                "updated_at": system_transaction.updated_at,
+            }
+        ]
+        statement_transaction["status"] = "Reconciled"
+        self.reconcile_statement_transaction(statement_transaction)
+        self.remove_system_transaction(system_transaction)
+        return True
+
+    def match_reference(self, statement_transaction):
+        """
+        Matches a statement transaction with the system transaction of the same amount its
+        description refers to best, within the reference days, the closest by date
+        breaking ties.
+        """
+        scores = self.get_reference_scores(statement_transaction)
+        if not scores:
+            return False
+        statement_date = self.statement_date(statement_transaction)
+        reference_days = timedelta(days=settings.BANK_RECONCILIATION_REFERENCE_DAYS)
+        candidates = [
+            system_transaction
+            for system_transaction in self.find_amount_candidates(
+                statement_transaction,
+                statement_date - reference_days,
+                statement_date + reference_days,
+            )
+            if system_transaction.pk in scores
+        ]
+        if not candidates:
+            return False
+
+        system_transaction = min(
+            candidates,
+            key=lambda t: (
+                -scores[t.pk],
+                abs((t.journal_entry.date - statement_date).days),
+                self.system_positions[t.pk],
+            ),
+        )
+        self.link(statement_transaction, system_transaction)
+        self.reconcile_statement_transaction(statement_transaction)
+        self.remove_system_transaction(system_transaction)
+        return True
+
+    def match_statement_description_group(
+        self, system_transaction, statement_transactions, has_same_date=False
+    ):
+        """
+        Reconciles a system transaction with statement transactions having the same
+        description, together adding up to it.
+        """
+        tolerance = settings.BANK_RECONCILIATION_TOLERANCE
+        groups = {}
+        for statement_transaction in statement_transactions:
+            groups.setdefault(statement_transaction.get("description"), []).append(
+                statement_transaction
+            )
+
+        for group in groups.values():
+            total_dr = sum(t.get("dr_amount", 0) for t in group)
+            total_cr = sum(t.get("cr_amount", 0) for t in group)
+            if (
+                abs(total_dr - (system_transaction.cr_amount or 0)) < tolerance
+                and abs(total_cr - (system_transaction.dr_amount or 0)) < tolerance
+            ):
+                for statement_transaction in group:
+                    self.link(statement_transaction, system_transaction, has_same_date)
+                    self.reconcile_statement_transaction(statement_transaction)
+                self.remove_system_transaction(system_transaction)
+                return True
+        return False
+
+    def match_statement_group(
+        self, system_transaction, statement_transactions, has_same_date=False
+    ):
+        """
+        Reconciles a system transaction with a group of statement transactions adding up
+        to it.
+        """
+        found = self.find_sided_group(
+            [
+                (to_cents(t.get("dr_amount")), to_cents(t.get("cr_amount")))
+                for t in statement_transactions
+            ],
+            to_cents(system_transaction.cr_amount),
+            to_cents(system_transaction.dr_amount),
+        )
+        if found is None:
+            return False
+        for index in found:
+            statement_transaction = statement_transactions[index]
+            self.link(statement_transaction, system_transaction, has_same_date)
+            self.reconcile_statement_transaction(statement_transaction)
+        self.remove_system_transaction(system_transaction)
+        return True
+
+    def match_system_group(
+        self, statement_transaction, system_transactions, has_same_date=False
+    ):
+        """
+        Reconciles a statement transaction with a group of system transactions of the same
+        voucher adding up to it, or whose debits less credits add up to its credit.
+        """
+        by_source = {}
+        for system_transaction in system_transactions:
+            by_source.setdefault(
+                system_transaction.journal_entry.source_voucher_id, []
+            ).append(system_transaction)
+
+        target_dr = to_cents(statement_transaction.get("cr_amount"))
+        target_cr = to_cents(statement_transaction.get("dr_amount"))
+        for group in by_source.values():
+            sides = [(to_cents(t.dr_amount), to_cents(t.cr_amount)) for t in group]
+            found = self.find_sided_group(sides, target_dr, target_cr)
+            if found is None and target_dr:
+                found = self.find_group([dr - cr for dr, cr in sides], target_dr)
+            if found is None:
+                continue
+            for index in found:
+                self.link(statement_transaction, group[index], has_same_date)
+                self.remove_system_transaction(group[index])
+            self.reconcile_statement_transaction(statement_transaction)
+            return True
+        return False
+
+    def match_net_group(
+        self, statement_transaction, system_transactions, has_same_date=False
+    ):
+        """
+        Reconciles a statement transaction with a group of system transactions whose
+        debits less credits add up to its credit.
+        """
+        target = to_cents(statement_transaction.get("cr_amount"))
+        if not target:
+            return False
+        found = self.find_group(
+            [
+                to_cents(t.dr_amount) - to_cents(t.cr_amount)
+                for t in system_transactions
+            ],
+            target,
+        )
+        if found is None:
+            return False
+        for index in found:
+            self.link(statement_transaction, system_transactions[index], has_same_date)
+            self.remove_system_transaction(system_transactions[index])
+        self.reconcile_statement_transaction(statement_transaction)
+        return True
+
+    def run(self):
+        lookback = timedelta(days=settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS)
+        lookahead = timedelta(
+            days=settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS
+        )
+
+        def unreconciled_statement_transactions():
+            return list(self.unreconciled_statement_transactions.values())
+
+        def unreconciled_system_transactions():
+            return list(self.unreconciled_system_transactions.values())
+
+        def window(date, ahead):
+            if ahead:
+                return date, date + lookahead
+            return date - lookback, date
+
+        # Single transactions on the same date
+        for statement_transaction in unreconciled_statement_transactions():
+            statement_date = self.statement_date(statement_transaction)
+            self.match_single(statement_transaction, statement_date, statement_date)
+
+        # Groups on the same date
+        if self.merge_description:
+            for system_transaction in unreconciled_system_transactions():
+                self.match_statement_description_group(
+                    system_transaction,
+                    self.statements_by_date.on(system_transaction.journal_entry.date),
+                    has_same_date=True,
+                )
+
+        for system_transaction in unreconciled_system_transactions():
+            self.match_statement_group(
+                system_transaction,
+                self.statements_by_date.on(system_transaction.journal_entry.date),
+                has_same_date=True,
+            )
+
+        for statement_transaction in unreconciled_statement_transactions():
+            system_transactions = self.system_by_date.on(
+                self.statement_date(statement_transaction)
+            )
+            if system_transactions:
+                self.match_system_group(
+                    statement_transaction, system_transactions, has_same_date=True
+                )
+
+        for statement_transaction in unreconciled_statement_transactions():
+            system_transactions = self.system_by_date.on(
+                self.statement_date(statement_transaction)
+            )
+            if system_transactions:
+                self.match_net_group(
+                    statement_transaction, system_transactions, has_same_date=True
+                )
+
+        # Within the lookahead and then the lookback days
+        for ahead in (True, False):
+            for statement_transaction in unreconciled_statement_transactions():
+                self.match_single(
+                    statement_transaction,
+                    *window(self.statement_date(statement_transaction), ahead),
+                )
+
+            for system_transaction in unreconciled_system_transactions():
+                system_date = system_transaction.journal_entry.date
+                if ahead and self.merge_description:
+                    if self.match_statement_description_group(
+                        system_transaction,
+                        self.statements_by_date.between(
+                            system_date - lookahead, system_date
+                        ),
+                    ):
+                        continue
+                self.match_statement_group(
+                    system_transaction,
+                    self.statements_by_date.between(
+                        system_date - lookahead, system_date
+                    ),
+                )
+
+            for statement_transaction in unreconciled_statement_transactions():
+                self.match_system_group(
+                    statement_transaction,
+                    self.system_by_date.between(
+                        *window(self.statement_date(statement_transaction), ahead)
+                    ),
+                )
+
+        # Groups of system transactions of a single date
+        for ahead in (True, False):
+            for statement_transaction in unreconciled_statement_transactions():
+                for date in self.system_by_date.dates_between(
+                    *window(self.statement_date(statement_transaction), ahead)
+                ):
+                    system_transactions = self.system_by_date.on(date)
+                    if system_transactions and self.match_net_group(
+                        statement_transaction, system_transactions
+                    ):
+                        break
+
+        # Single transactions referred to by descriptions, beyond the lookahead and lookback
+        if self.reference_index is not None:
+            for statement_transaction in unreconciled_statement_transactions():
+                self.match_reference(statement_transaction)
+
+        return self.reconciled_transactions, list(
+            self.unreconciled_statement_transactions.values()
+        )
+
+
+def parse_amount(amount):
+    if amount and isinstance(amount, str):
+        return Decimal(amount.replace(",", ""))
+    return amount or Decimal("0")
+
+
+def create_statement_rows(statement, statement_transactions):
+    """
+    Saves the parsed rows of an imported statement as unreconciled rows, to be reconciled
+    by `reconcile_statement_chunk`.
+    """
+    rows = []
+    for statement_transaction in statement_transactions:
+        rows.append(
+            ReconciliationRow(
+                statement=statement,
+                date=statement_transaction["date"],
+                dr_amount=parse_amount(statement_transaction.get("dr_amount")) or None,
+                cr_amount=parse_amount(statement_transaction.get("cr_amount")) or None,
+                balance=parse_amount(statement_transaction.get("balance")) or None,
+                description=statement_transaction.get("description", None),
+                status="Unreconciled",
+            )
+        )
+    ReconciliationRow.objects.bulk_create(rows, batch_size=1000)
+    statement.total_rows = len(rows)
+    statement.save(update_fields=["total_rows"])
+
+
+def get_transaction_references(system_transactions):
+    """
+    Returns the texts identifying system transactions, by primary key: the voucher
+    numbers of their journal entries, the names and aliases of parties of the other side
+    of the entries, and the numbers and payees of the cheques issued or deposited. Fetched
+    in a query per kind of reference for all the transactions.
+    """
+    references = defaultdict(list)
+    by_journal_entry = defaultdict(list)
+    for system_transaction in system_transactions:
+        journal_entry = system_transaction.journal_entry
+        by_journal_entry[journal_entry.pk].append(system_transaction.pk)
+        if journal_entry.source_voucher_no:
+            references[system_transaction.pk].append(journal_entry.source_voucher_no)
+    if not by_journal_entry:
+        return references
+
+    counterparts = (
+        Transaction.objects.filter(journal_entry_id__in=by_journal_entry)
+        .exclude(account_id__in={t.account_id for t in system_transactions})
+        .filter(
+            Q(account__customer_detail__isnull=False)
+            | Q(account__supplier_detail__isnull=False)
+        )
+        .values_list(
+            "journal_entry_id",
+            "account__customer_detail__name",
+            "account__customer_detail__aliases",
+            "account__supplier_detail__name",
+            "account__supplier_detail__aliases",
+        )
+    )
+    for (
+        journal_entry_id,
+        customer_name,
+        customer_aliases,
+        supplier_name,
+        supplier_aliases,
+    ) in counterparts:
+        texts = [
+            customer_name,
+            supplier_name,
+            *(customer_aliases or []),
+            *(supplier_aliases or []),
+        ]
+        for pk in by_journal_entry[journal_entry_id]:
+            references[pk] += [text for text in texts if text]
+
+    content_types = ContentType.objects.get_for_models(ChequeIssue, ChequeDeposit)
+    for model, fields in (
+        (ChequeIssue, ("cheque_no", "issued_to", "party__name")),
+        (ChequeDeposit, ("cheque_number", "deposited_by")),
+    ):
+        by_object = defaultdict(list)
+        for system_transaction in system_transactions:
+            journal_entry = system_transaction.journal_entry
+            if journal_entry.content_type_id == content_types[model].id:
+                by_object[journal_entry.object_id].append(system_transaction.pk)
+        if not by_object:
+            continue
+        for object_id, *texts in model.objects.filter(id__in=by_object).values_list(
+            "id", *fields
+        ):
+            for pk in by_object[object_id]:
+                references[pk] += [text for text in texts if text]
+    return references
+
+
+def reconcile_statement_chunk(statement):
+    """
+    Reconciles the rows of the next dates of a statement, after `processed_until`, and
+    records them as processed. Returns False when there are no rows left. Run in a
+    transaction, so that a chunk is either reconciled and recorded or not at all.
+    """
+    rows = statement.rows.all()
+    if statement.processed_until:
+        rows = rows.filter(date__gt=statement.processed_until)
+    start_date = rows.order_by("date").values_list("date", flat=True).first()
+    if start_date is None:
+        return False
+    end_date = start_date + timedelta(
+        days=settings.BANK_RECONCILIATION_IMPORT_CHUNK_DAYS - 1
+    )
+    rows = list(rows.filter(date__lte=end_date).order_by("id"))
+
+    # Transactions dated after the chunk are left to the rows of their own dates, which
+    # match them exactly first, by the window and reference stages too. Rows of previous
+    # chunks left unreconciled within the lookahead or the reference days are matched
+    # again with the transactions of this chunk.
+    reference_days = settings.BANK_RECONCILIATION_REFERENCE_DAYS
+    ahead_days = max(
+        settings.BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS, reference_days
+    )
+    carried_rows = []
+    if statement.processed_until:
+        carried_rows = list(
+            statement.rows.filter(
+                status="Unreconciled",
+                date__gte=start_date - timedelta(days=ahead_days),
+                date__lt=start_date,
+            ).order_by("id")
+        )
+
+    # Transactions reconciled with rows of previous chunks are not matched again
+    reconciled_transaction_ids = ReconciliationRowTransaction.objects.filter(
+        reconciliation_row__statement=statement, transaction__isnull=False
+    ).values("transaction_id")
+    last_date = end_date
+    if not statement.rows.filter(date__gt=end_date).exists():
+        last_date += timedelta(days=ahead_days)
+    system_transactions = list(
+        Transaction.objects.filter(
+            company_id=statement.company_id,
+            account_id=statement.account_id,
+            date__range=[
+                start_date
+                - timedelta(
+                    days=max(
+                        settings.BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS,
+                        reference_days,
+                    )
+                ),
+                last_date,
+            ],
+        )
+        .exclude(id__in=reconciled_transaction_ids)
+        .order_by("date", "id")
+        .select_related("journal_entry")
+    )
+    statement_transactions = [
+        {
+            "row": row,
+            "date": row.date.strftime("%Y-%m-%d"),
+            "dr_amount": row.dr_amount or Decimal("0"),
+            "cr_amount": row.cr_amount or Decimal("0"),
+            "description": row.description,
+        }
+        for row in carried_rows + rows
+    ]
+    reconciled_transactions, _ = ReconciliationMatcher(
+        statement_transactions,
+        system_transactions,
+        statement.merge_description,
+        references=get_transaction_references(system_transactions),
+    ).run()
+
+    reconciled_rows = []
+    row_transactions = []
+    for statement_transaction in reconciled_transactions:
+        row = statement_transaction["row"]
+        row.status = statement_transaction.get("status", "Matched")
+        reconciled_rows.append(row)
+        row_transactions += [
+            ReconciliationRowTransaction(
+                reconciliation_row=row,
+                transaction_id=transaction["id"],
+                transaction_last_updated_at=transaction["updated_at"],
+            )
+            for transaction in statement_transaction.get("transactions", [])
+        ]
+    ReconciliationRow.objects.bulk_update(reconciled_rows, ["status"], batch_size=500)
+    ReconciliationRowTransaction.objects.bulk_create(row_transactions, batch_size=500)
+
+    statement.processed_until = end_date
+    statement.processed_rows += len(rows)
+    statement.import_status = "Importing"
+    statement.save(update_fields=["processed_until", "processed_rows", "import_status"])
+    return True
+
+
+RECONCILIATION_GROUPS_SQL = """
+    WITH RECURSIVE scope AS ({scope}),
+    edges AS (
+        SELECT reconciliation_row_id AS row_id, transaction_id
+        FROM bank_reconciliationrowtransaction
+        WHERE reconciliation_row_id IN (SELECT id FROM scope)
+            AND transaction_id IS NOT NULL
+    ),
+    links AS (
+        SELECT DISTINCT a.row_id, b.row_id AS other_id
+        FROM edges a
+        JOIN edges b ON b.transaction_id = a.transaction_id AND b.row_id <> a.row_id
+    ),
+    reach (row_id, other_id) AS (
+        SELECT id, id FROM scope
+        UNION
+        SELECT reach.row_id, links.other_id
+        FROM reach
+        JOIN links ON links.row_id = reach.other_id
+    ),
+    components AS (
+        SELECT row_id, MIN(other_id) AS group_id
+        FROM reach
+        GROUP BY row_id
+    ),
+    groups AS (
+        SELECT
+            c.group_id,
+            ARRAY_AGG(DISTINCT c.row_id) AS row_ids,
+            ARRAY_AGG(DISTINCT e.transaction_id)
+                FILTER (WHERE e.transaction_id IS NOT NULL) AS transaction_ids,
+            MAX(e.transaction_id) AS last_transaction_id
+        FROM components c
+        LEFT JOIN edges e ON e.row_id = c.row_id
+        GROUP BY c.group_id
+    )
+"""
+
+
+class ReconciliationGroups:
+    """
+    Groups of statement rows and the system transactions matched with them, rows sharing
+    a transaction being in the same group. Computed in SQL over the rows of the `rows`
+    queryset, and fetched a page at a time when sliced by a paginator, as lists of
+    (row ids, transaction ids), latest matched transactions first and unmatched rows last.
+    """
+
+    def __init__(self, rows):
+        scope, self.params = rows.values("id").query.sql_with_params()
+        self.sql = RECONCILIATION_GROUPS_SQL.format(scope=scope)
+
+    def count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql + "SELECT COUNT(*) FROM groups", self.params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, index):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.sql
+                + """
+                SELECT row_ids, COALESCE(transaction_ids, '{}')
+                FROM groups
+                ORDER BY last_transaction_id DESC NULLS LAST, group_id
+                LIMIT %s OFFSET %s
+                """,
+                (*self.params, index.stop - index.start, index.start),
+            )
+            return cursor.fetchall()
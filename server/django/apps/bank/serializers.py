@@ -252,6 +252,22 @@ class ReconciliationStatementImportSerializer(serializers.Serializer):
         )
 
 
+class ReconciliationStatementProgressSerializer(BaseModelSerializer):
+    progress = serializers.ReadOnlyField()
+
+    class Meta:
+        model = ReconciliationStatement
+        fields = (
+            "id",
+            "import_status",
+            "total_rows",
+            "processed_rows",
+            "processed_until",
+            "progress",
+            "error",
+        )
+
+
 class ReconciliationStatementListSerializer(BaseModelSerializer):
     account = AccountMinSerializer()
     total_rows = serializers.SerializerMethodField()
@@ -289,6 +305,7 @@ class ReconciliationStatementListSerializer(BaseModelSerializer):
             "total_rows",
             "reconciled_rows",
             "has_updated_rows",
+            "import_status",
         )
 
 
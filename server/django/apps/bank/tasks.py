@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Count
+from django_q.tasks import async_task
+
+from apps.bank.models import ReconciliationStatement
+from apps.bank.reconciliation import reconcile_statement_chunk
+
+
+def notify_import(statement, header, message):
+    if statement.imported_by and statement.imported_by.email:
+        send_mail(
+            header, message, settings.DEFAULT_FROM_EMAIL, [statement.imported_by.email]
+        )
+
+
+def reconcile_statement(statement_id):
+    """
+    Reconciles the rows of an imported statement a chunk of dates at a time, each chunk in
+    a transaction recording how far the statement has been reconciled, so that an import
+    which stopped resumes from the chunk it was on. Queues itself again for the remaining
+    chunks once its time is up, to stay within the timeout of the cluster.
+    """
+    deadline = time.monotonic() + settings.BANK_RECONCILIATION_IMPORT_TASK_SECONDS
+    while True:
+        try:
+            with transaction.atomic():
+                # * The lock keeps a task retried by the cluster from running a chunk twice
+                statement = (
+                    ReconciliationStatement.objects.select_for_update()
+                    .filter(id=statement_id, import_status__in=["Queued", "Importing"])
+                    .first()
+                )
+                if not statement:
+                    return
+                if not reconcile_statement_chunk(statement):
+                    statement.import_status = "Completed"
+                    statement.save(update_fields=["import_status"])
+                    break
+        except Exception as e:
+            ReconciliationStatement.objects.filter(id=statement_id).update(
+                import_status="Failed", error=str(e)
+            )
+            statement = ReconciliationStatement.objects.get(id=statement_id)
+            notify_import(
+                statement,
+                "Bank Reconciliation Statement Import Failed",
+                "Something went wrong, please contact support",
+            )
+            return
+        if time.monotonic() > deadline:
+            async_task(
+                "apps.bank.tasks.reconcile_statement",
+                statement_id,
+                task_name="reconciliation-statement-{}".format(statement_id),
+            )
+            return
+
+    counts = dict(
+        statement.rows.order_by()
+        .values("status")
+        .annotate(count=Count("id"))
+        .values_list("status", "count")
+    )
+    notify_import(
+        statement,
+        "Bank Reconciliation Statement Import Completed",
+        "Bank Reconciliation Statement Import Completed, with "
+        + str(counts.get("Reconciled", 0))
+        + " transactions reconciled, "
+        + str(counts.get("Matched", 0))
+        + " transactions matched and "
+        + str(counts.get("Unreconciled", 0))
+        + " transactions unreconciled",
+    )
@@ -0,0 +1,107 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from apps.company.models import VoucherSequence
+from apps.product.models import InventoryAdjustmentVoucher, InventoryConversionVoucher
+from apps.quotation.models import Quotation
+from apps.voucher.models import (
+    Challan,
+    CreditNote,
+    DebitNote,
+    PurchaseOrder,
+    SalesVoucher,
+)
+from apps.voucher.models.journal_vouchers import JournalVoucher
+from awecount.libs import is_numbered_by_fiscal_year
+
+NUMBERED_MODELS = [
+    (SalesVoucher, "voucher_no"),
+    (Challan, "voucher_no"),
+    (PurchaseOrder, "voucher_no"),
+    (CreditNote, "voucher_no"),
+    (DebitNote, "voucher_no"),
+    (JournalVoucher, "voucher_no"),
+    (InventoryAdjustmentVoucher, "voucher_no"),
+    (InventoryConversionVoucher, "voucher_no"),
+    (Quotation, "number"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed voucher number sequences from the highest numbers of existing vouchers. "
+        "Sequences already ahead of the vouchers are kept unless --reset is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID, defaults to all companies",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Set sequences to the highest existing numbers even if they are ahead",
+        )
+
+    def seed(self, model, attr, company_id, reset):
+        content_type = ContentType.objects.get_for_model(model)
+        fields = ["company_id"]
+        if is_numbered_by_fiscal_year(model, attr):
+            fields.append("fiscal_year_id")
+
+        qs = model.objects.filter(**{attr + "__isnull": False})
+        if company_id:
+            qs = qs.filter(company_id=company_id)
+        rows = qs.order_by().values(*fields).annotate(number=Max(attr))
+
+        existing = {
+            (sequence.company_id, sequence.fiscal_year_id): sequence
+            for sequence in VoucherSequence.objects.filter(
+                content_type=content_type,
+                **({"company_id": company_id} if company_id else {}),
+            )
+        }
+        to_create = []
+        to_update = []
+        for row in rows:
+            number = int(row["number"] or 0)
+            key = (row["company_id"], row.get("fiscal_year_id"))
+            sequence = existing.get(key)
+            if sequence is None:
+                to_create.append(
+                    VoucherSequence(
+                        company_id=key[0],
+                        fiscal_year_id=key[1],
+                        content_type=content_type,
+                        last_number=number,
+                    )
+                )
+            elif reset or sequence.last_number < number:
+                sequence.last_number = number
+                to_update.append(sequence)
+
+        VoucherSequence.objects.bulk_create(to_create, batch_size=1000)
+        VoucherSequence.objects.bulk_update(to_update, ["last_number"], batch_size=1000)
+        return len(to_create), len(to_update)
+
+    def handle(self, *args, **options):
+        for model, attr in NUMBERED_MODELS:
+            # * Locks the sequences of the model so that no number is reserved meanwhile
+            with transaction.atomic():
+                list(
+                    VoucherSequence.objects.select_for_update()
+                    .filter(content_type=ContentType.objects.get_for_model(model))
+                    .values_list("id", flat=True)
+                )
+                created, updated = self.seed(
+                    model, attr, options["company"], options["reset"]
+                )
+            self.stdout.write(
+                "{}: {} sequences created, {} updated".format(
+                    model._meta.verbose_name.title(), created, updated
+                )
+            )
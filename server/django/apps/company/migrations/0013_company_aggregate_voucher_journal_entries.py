@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0012_merge_20250602_1335'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='aggregate_voucher_journal_entries',
+            field=models.BooleanField(default=False),
+        ),
+    ]
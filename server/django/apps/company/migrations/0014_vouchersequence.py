@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('company', '0013_company_aggregate_voucher_journal_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoucherSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_number', models.PositiveIntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='voucher_sequences', to='company.company')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('fiscal_year', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='company.fiscalyear')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vouchersequence',
+            constraint=models.UniqueConstraint(fields=('company', 'fiscal_year', 'content_type'), name='unique_voucher_sequence'),
+        ),
+        migrations.AddConstraint(
+            model_name='vouchersequence',
+            constraint=models.UniqueConstraint(condition=models.Q(('fiscal_year__isnull', True)), fields=('company', 'content_type'), name='unique_voucher_sequence_without_fiscal_year'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0014_vouchersequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='async_voucher_posting',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -9,6 +9,7 @@ from django.db.models import Q
 
 from django.apps import apps
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import SuspiciousOperation, ValidationError
 from django.db import models
 from django.utils.encoding import force_bytes
@@ -250,6 +251,10 @@ class Company(BaseModel):
     enable_sales_agents = models.BooleanField(default=False)
     synchronize_cbms_nepal_test = models.BooleanField(default=False)
     synchronize_cbms_nepal_live = models.BooleanField(default=False)
+    # Post invoice rows netted per account into a single journal entry per voucher
+    aggregate_voucher_journal_entries = models.BooleanField(default=False)
+    # Post sales and purchase invoices from the task cluster instead of the request
+    async_voucher_posting = models.BooleanField(default=False)
     config_template = models.CharField(max_length=255, default="np")
     invoice_template = models.IntegerField(choices=INVOICE_TEMPLATE_CHOICES, default=1)
     corporate_tax_rate = models.DecimalField(
@@ -619,6 +624,42 @@ class Company(BaseModel):
         InventorySetting.objects.get_or_create(company=self)
 
 
+class VoucherSequence(models.Model):
+    """
+    Last issued number of a voucher type per company, and per fiscal year for vouchers
+    numbered within a fiscal year. Numbers are reserved by locking this row instead of
+    scanning the voucher table for its maximum.
+    """
+
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="voucher_sequences"
+    )
+    fiscal_year = models.ForeignKey(
+        FiscalYear, on_delete=models.CASCADE, blank=True, null=True
+    )
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    last_number = models.PositiveIntegerField(default=0)
+
+    class PermissionsMeta:
+        exclude = True
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company", "fiscal_year", "content_type"],
+                name="unique_voucher_sequence",
+            ),
+            models.UniqueConstraint(
+                fields=["company", "content_type"],
+                condition=Q(fiscal_year__isnull=True),
+                name="unique_voucher_sequence_without_fiscal_year",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} {} [{}]".format(self.company, self.content_type, self.fiscal_year)
+
+
 class CompanyBaseModel(BaseModel):
     # TODO: uncomment this for DRY
     # company = models.ForeignKey(
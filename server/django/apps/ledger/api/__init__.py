@@ -3,14 +3,25 @@ from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.db import connection
-from django.db.models import Case, F, Max, OuterRef, Q, Subquery, Sum, When, Count
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Sum,
+    Value,
+    When,
+)
 from django.db.models.functions import Coalesce
 from django_filters import rest_framework as filters
 from django_filters.rest_framework import DjangoFilterBackend
-from mptt.utils import get_cached_trees
 from rest_framework import filters as rf_filters
+from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, ListModelMixin
@@ -20,18 +31,46 @@ from rest_framework.viewsets import GenericViewSet
 
 from apps.aggregator.views import qs_to_xls
 from apps.company.models import FiscalYear
-from apps.ledger.filters import AccountFilterSet, CategoryFilterSet
-from apps.ledger.models.base import AccountClosing, Transaction
+from apps.ledger.filters import (
+    AccountFilterSet,
+    CategoryFilterSet,
+    PartyBalanceFilterSet,
+)
+from apps.ledger.models.base import (
+    TRANSACTION_TYPES,
+    AccountClosing,
+    AccountDailyMovement,
+    Transaction,
+    get_account_total_annotations,
+    get_category_tree,
+    prune_category_tree,
+)
 from apps.ledger.resources import TransactionGroupResource, TransactionResource
+from apps.ledger.statements import (
+    BALANCE_SHEET_ROOTS,
+    INCOME_STATEMENT_ROOTS,
+    find_root_category,
+    get_closing_amounts,
+    get_periods,
+    get_profit_loss,
+    get_statement_balances,
+    get_statement_lines,
+    get_statement_rows,
+    get_stock_values,
+    get_trial_balance,
+    statement_pdf_response,
+)
 from apps.tax.models import TaxScheme
-from apps.voucher.models import PurchaseVoucher, SalesVoucher
+from apps.voucher.models import PurchaseVoucher, SalesVoucher, get_posting_lag
 from apps.voucher.serializers import SaleVoucherOptionsSerializer
+from awecount.libs import zero_for_none
 from awecount.libs.CustomViewSet import (
     CollectionViewSet,
     CompanyViewSetMixin,
     CRULViewSet,
     GenericSerializer,
 )
+from awecount.libs.exports import streaming_export_response
 from awecount.libs.mixins import InputChoiceMixin, TransactionsViewMixin
 
 from ..models import Account, AccountOpeningBalance, Category, JournalEntry
@@ -46,8 +85,6 @@ from ..serializers import (
     AggregatorSerializer,
     CategoryDetailSerializer,
     CategorySerializer,
-    CategoryTreeSerializer,
-    CategoryTreeSerializerWithSystemCode,
     ContentTypeListSerializer,
     JournalEntrySerializer,
     PartyAccountSerializer,
@@ -76,6 +113,14 @@ class PartyViewSet(
         "contact_no",
         "address",
     )
+    filterset_class = PartyBalanceFilterSet
+
+    @property
+    def ordering_fields(self):
+        if self.action in ("customers", "suppliers"):
+            return ("id", "name", "dr", "cr", "balance")
+        # Fields of the serializer, as without ordering_fields
+        return None
 
     def get_account_ids(self, obj):
         return [obj.supplier_account_id, obj.customer_account_id]
@@ -91,31 +136,23 @@ class PartyViewSet(
         qs = super().get_queryset().order_by("-pk")
         if self.action == "transactions":
             qs = qs.select_related("supplier_account", "customer_account")
-        if self.action == "customers":
-            qs = (
-                qs.filter(customer_account__transactions__isnull=False)
-                .annotate(
-                    dr=Coalesce(
-                        Sum("customer_account__transactions__dr_amount"), Decimal("0.0")
-                    ),
-                    cr=Coalesce(
-                        Sum("customer_account__transactions__cr_amount"), Decimal("0.0")
-                    ),
-                )
-                .annotate(balance=F("dr") - F("cr"))
+        if self.action in ("customers", "suppliers"):
+            account = (
+                "customer_account" if self.action == "customers" else "supplier_account"
             )
-        if self.action == "suppliers":
-            qs = (
-                qs.filter(supplier_account__transactions__isnull=False)
-                .annotate(
-                    dr=Coalesce(
-                        Sum("supplier_account__transactions__dr_amount"), Decimal("0.0")
-                    ),
-                    cr=Coalesce(
-                        Sum("supplier_account__transactions__cr_amount"), Decimal("0.0")
-                    ),
-                )
-                .annotate(balance=F("dr") - F("cr"))
+            # Read off the balances maintained on accounts instead of summing
+            # transactions
+            qs = qs.filter(
+                Q(**{"{}__current_dr__isnull".format(account): False})
+                | Q(**{"{}__current_cr__isnull".format(account): False})
+            ).annotate(
+                dr=Coalesce(
+                    F("{}__current_dr".format(account)), Value(Decimal("0"))
+                ),
+                cr=Coalesce(
+                    F("{}__current_cr".format(account)), Value(Decimal("0"))
+                ),
+                balance=F("dr") - F("cr"),
             )
         return qs
 
@@ -200,7 +237,15 @@ class AccountViewSet(InputChoiceMixin, TransactionsViewMixin, CRULViewSet):
         entries = (
             JournalEntry.objects.filter(transactions__account_id=obj.pk)
             .order_by("pk", "date")
-            .prefetch_related("transactions", "content_type", "transactions__account")
+            .prefetch_related(
+                Prefetch(
+                    "transactions",
+                    queryset=Transaction.objects.filter(account_id=obj.pk)
+                    .select_related("account")
+                    .with_running_balance(),
+                ),
+                "content_type",
+            )
             .select_related()
         )
 
@@ -216,34 +261,49 @@ class AccountViewSet(InputChoiceMixin, TransactionsViewMixin, CRULViewSet):
         return Response(data)
 
 
+CATEGORY_TREE_RESPONSE_FIELDS = (
+    "id",
+    "name",
+    "children",
+    "code",
+    "system_code",
+    "tree_id",
+    "lft",
+    "rght",
+    "default",
+    "dr",
+    "cr",
+)
+
+
 class CategoryTreeView(APIView):
     action = "list"
 
     def get_queryset(self):
-        if self.request.GET.get("include-empty"):
-            return Category.objects.all()
-        return Category.objects.exclude(
-            Q(accounts__isnull=True) & Q(children__isnull=True)
-        )
+        return Category.objects.none()
 
     def get(self, request, format=None, *args, **kwargs):
-        queryset = self.get_queryset().filter(company=request.company)
-        category_tree = get_cached_trees(queryset)
-        serializer = CategoryTreeSerializer(category_tree, many=True)
-        return Response(serializer.data)
+        return Response(
+            prune_category_tree(
+                get_category_tree(request.company.id),
+                fields=CATEGORY_TREE_RESPONSE_FIELDS,
+                include_empty=bool(request.GET.get("include-empty")),
+            )
+        )
 
 
 class FullCategoryTreeView(APIView):
     action = "list"
 
     def get_queryset(self):
-        return Category.objects.all()
+        return Category.objects.none()
 
     def get(self, request, format=None, *args, **kwargs):
-        queryset = self.get_queryset().filter(company=request.company)
-        category_tree = get_cached_trees(queryset)
-        serializer = CategoryTreeSerializer(category_tree, many=True)
-        return Response(serializer.data)
+        return Response(
+            prune_category_tree(
+                get_category_tree(request.company.id), fields=CATEGORY_TREE_RESPONSE_FIELDS
+            )
+        )
 
 
 class TrialBalanceView(APIView):
@@ -253,43 +313,38 @@ class TrialBalanceView(APIView):
         return Account.objects.none()
 
     def get(self, request, format=None, *args, **kwargs):
-        start_date = request.GET.get("start_date")
-        end_date = request.GET.get("end_date")
-        if start_date and end_date:
-            # TODO Only use Transactions whose journal_entry.type=='Regular'
-            qq = (
-                Account.objects.filter(company=request.company)
-                .annotate(
-                    od=Sum(
-                        "transactions__dr_amount",
-                        filter=Q(transactions__journal_entry__date__lt=start_date),
-                    ),
-                    oc=Sum(
-                        "transactions__cr_amount",
-                        filter=Q(transactions__journal_entry__date__lt=start_date),
-                    ),
-                    cd=Sum(
-                        "transactions__dr_amount",
-                        filter=Q(transactions__journal_entry__date__lt=end_date)
-                        | Q(
-                            transactions__journal_entry__date=end_date,
-                            transactions__type="Regular",
-                        ),
-                    ),
-                    cc=Sum(
-                        "transactions__cr_amount",
-                        filter=Q(transactions__journal_entry__date__lt=end_date)
-                        | Q(
-                            transactions__journal_entry__date=end_date,
-                            transactions__type="Regular",
-                        ),
-                    ),
-                )
-                .values("id", "name", "category_id", "od", "oc", "cd", "cc")
-                .exclude(od=None, oc=None, cd=None, cc=None)
-            )
-            return Response(list(qq))
-        return Response({})
+        periods = get_periods(request)
+        if not periods:
+            return Response({})
+        qq = []
+        for account in get_trial_balance(request.company.id, periods):
+            columns = account.pop("columns")
+            row = {
+                **account,
+                "od": columns[0]["od"],
+                "oc": columns[0]["oc"],
+                "cd": columns[0]["cd"],
+                "cc": columns[0]["cc"],
+            }
+            if len(periods) > 1:
+                row["columns"] = columns
+            qq.append(row)
+        return Response(qq)
+
+
+class PostingLagView(APIView):
+    """
+    Vouchers waiting to be posted by companies with asynchronous posting, for reports to
+    show when they may not include the latest vouchers.
+    """
+
+    action = "list"
+
+    def get_queryset(self):
+        return SalesVoucher.objects.none()
+
+    def get(self, request, format=None, *args, **kwargs):
+        return Response(get_posting_lag(request.company.id))
 
 
 class ChartOfAccountsView(APIView):
@@ -433,33 +488,34 @@ class CustomerClosingView(APIView):
         return Account.objects.filter(customer_detail__isnull=False)
 
     def get(self, request, format=None, *args, **kwargs):
-        customers = (
-            self.get_queryset()
-            .filter(company_id=self.request.user.company_id)
-            .exclude(transactions__isnull=True)
+        customers = self.get_queryset().filter(company=request.company)
+
+        balances = (
+            customers.filter(Q(current_dr__isnull=False) | Q(current_cr__isnull=False))
+            .annotate(dr=F("current_dr"), cr=F("current_cr"))
+            .values("dr", "cr", "customer_detail__tax_identification_number", "id")
         )
 
-        balances = customers.annotate(
-            dr=Sum("transactions__dr_amount"),
-            cr=Sum("transactions__cr_amount"),
-        ).values("dr", "cr", "customer_detail__tax_identification_number", "id")
-
-        last_invoice_dates = customers.annotate(
-            last_invoice_date=Max(
-                Case(
-                    When(
-                        customer_detail__sales_invoices__status__in=[
-                            "Issued",
-                            "Paid",
-                            "Partially Paid",
-                        ],
-                        then="customer_detail__sales_invoices__date",
-                    )
-                )
+        last_dates = dict(
+            SalesVoucher.objects.filter(
+                company=request.company,
+                status__in=["Issued", "Paid", "Partially Paid"],
+                party__customer_account__isnull=False,
             )
-        ).values(
-            "customer_detail__tax_identification_number", "id", "last_invoice_date"
+            .order_by()
+            .values_list("party__customer_account_id")
+            .annotate(last_invoice_date=Max("date"))
         )
+        last_invoice_dates = [
+            {
+                "customer_detail__tax_identification_number": customer[
+                    "customer_detail__tax_identification_number"
+                ],
+                "id": customer["id"],
+                "last_invoice_date": last_dates.get(customer["id"]),
+            }
+            for customer in balances
+        ]
         return Response(
             {"balances": balances, "last_invoice_dates": last_invoice_dates}
         )
@@ -511,7 +567,7 @@ class TransactionViewSet(
         qs = (
             Transaction.objects.filter(company_id=self.request.company.id)
             .prefetch_related("account", "journal_entry__content_type")
-            .order_by("-journal_entry__date")
+            .order_by("-date")
         )
         start_date = self.request.GET.get("start_date")
         end_date = self.request.GET.get("end_date")
@@ -522,7 +578,7 @@ class TransactionViewSet(
 
         # TODO Optimize this query
         if start_date and end_date:
-            qs = qs.filter(journal_entry__date__range=[start_date, end_date])
+            qs = qs.filter(date__range=[start_date, end_date])
         if accounts:
             qs = qs.filter(account_id__in=accounts)
         if categories:
@@ -540,7 +596,7 @@ class TransactionViewSet(
         if group_by == "acc":
             qs = (
                 qs.annotate(
-                    year=ExtractYear("journal_entry__date"), label=F("account__name")
+                    year=ExtractYear("date"), label=F("account__name")
                 )
                 .values("year", "label")
                 .annotate(
@@ -552,7 +608,7 @@ class TransactionViewSet(
         if group_by == "cat":
             qs = (
                 qs.annotate(
-                    year=ExtractYear("journal_entry__date"),
+                    year=ExtractYear("date"),
                     label=F("account__category__name"),
                 )
                 .values("year", "label")
@@ -565,7 +621,7 @@ class TransactionViewSet(
         if group_by == "type":
             qs = (
                 qs.annotate(
-                    year=ExtractYear("journal_entry__date"),
+                    year=ExtractYear("date"),
                     label=F("journal_entry__content_type__model"),
                 )
                 .values("year", "label")
@@ -579,7 +635,7 @@ class TransactionViewSet(
 
     @action(detail=False)
     def export(self, request, *args, **kwargs):
-        queryset = self.get_queryset().order_by("-journal_entry__date")
+        queryset = self.get_queryset().order_by("-date")
         if not request.GET.get("group"):
             params = [("Transactions", queryset, TransactionResource)]
             return qs_to_xls(params)
@@ -589,113 +645,84 @@ class TransactionViewSet(
 
     @action(detail=False, url_path="day-book")
     def day_book(self, request, *args, **kwargs):
+        """
+        Opening and closing balances of cash and bank accounts and of accounts with
+        transactions on `date`, or from `start_date` to `end_date` with the movements of
+        each day, read from daily movements.
+        """
         date_str = self.request.GET.get("date") or datetime.now().date().isoformat()
+        start_str = self.request.GET.get("start_date") or date_str
+        end_str = self.request.GET.get("end_date") or start_str
         try:
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+            start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_str, "%Y-%m-%d").date()
         except ValueError:
             raise ValidationError("Invalid date format. Use YYYY-MM-DD.")
+        if start_date > end_date:
+            raise ValidationError("Start date must not be after end date.")
+        is_range = start_date != end_date
 
         acc_cat_system_codes = settings.ACCOUNT_CATEGORY_SYSTEM_CODES
 
+        transaction_types = [type for type, _ in TRANSACTION_TYPES]
         combined_accounts = (
             Account.objects.filter(company=request.company)
             .annotate(
-                today_dr=Coalesce(
-                    Sum(
-                        Case(
-                            When(
-                                transactions__journal_entry__date=target_date,
-                                then="transactions__dr_amount",
-                            ),
-                            default=Decimal("0.000000"),
-                            output_field=models.DecimalField(
-                                max_digits=24,
-                                decimal_places=6,
-                            ),
-                        )
-                    ),
-                    Decimal("0.000000"),
-                ),
-                today_cr=Coalesce(
-                    Sum(
-                        Case(
-                            When(
-                                transactions__journal_entry__date=target_date,
-                                then="transactions__cr_amount",
-                            ),
-                            default=Decimal("0.000000"),
-                            output_field=models.DecimalField(
-                                max_digits=24,
-                                decimal_places=6,
-                            ),
-                        )
-                    ),
-                    Decimal("0.000000"),
+                has_transactions=Exists(
+                    AccountDailyMovement.objects.filter(
+                        account_id=OuterRef("id"),
+                        date__range=(start_date, end_date),
+                    ).exclude(dr_amount=0, cr_amount=0)
                 ),
-                total_dr=Coalesce(
-                    Sum(
-                        Case(
-                            When(
-                                transactions__journal_entry__date__lte=target_date,
-                                then="transactions__dr_amount",
-                            ),
-                            default=Decimal("0.000000"),
-                            output_field=models.DecimalField(
-                                max_digits=24,
-                                decimal_places=6,
-                            ),
-                        )
-                    ),
-                    Decimal("0.000000"),
+                **get_account_total_annotations(
+                    start_date, "opening_dr", "opening_cr"
                 ),
-                total_cr=Coalesce(
-                    Sum(
-                        Case(
-                            When(
-                                transactions__journal_entry__date__lte=target_date,
-                                then="transactions__cr_amount",
-                            ),
-                            default=Decimal("0.000000"),
-                            output_field=models.DecimalField(
-                                max_digits=24,
-                                decimal_places=6,
-                            ),
-                        )
-                    ),
-                    Decimal("0.000000"),
+                **get_account_total_annotations(
+                    end_date, "total_dr", "total_cr", date_types=transaction_types
                 ),
             )
             .filter(
-                Case(
-                    When(
-                        category__system_code__in=[
-                            acc_cat_system_codes["Cash Accounts"],
-                            acc_cat_system_codes["Bank Accounts"],
-                        ],
-                        then=True,
-                    ),
-                    When(transactions__journal_entry__date=target_date, then=True),
-                    default=False,
+                Q(
+                    category__system_code__in=[
+                        acc_cat_system_codes["Cash Accounts"],
+                        acc_cat_system_codes["Bank Accounts"],
+                    ]
                 )
+                | Q(has_transactions=True)
             )
-            .distinct()
         )
 
-        account_transactions = [
-            {
+        days = {}
+        if is_range:
+            for account_id, date, dr, cr in (
+                AccountDailyMovement.objects.filter(
+                    company=request.company, date__range=(start_date, end_date)
+                )
+                .order_by("date")
+                .values_list("account_id", "date")
+                .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
+            ):
+                days.setdefault(account_id, []).append(
+                    {"date": date, "dr": dr, "cr": cr}
+                )
+
+        account_transactions = []
+        for account in combined_accounts:
+            row = {
                 "account": {
                     "id": account.id,
                     "name": account.name,
                     "code": account.code,
                 },
-                "has_transactions": account.today_dr or account.today_cr,
-                "opening_balance": account.total_dr
-                - account.total_cr
-                - (account.today_dr - account.today_cr),
-                "closing_balance": account.total_dr - account.total_cr,
+                "has_transactions": account.has_transactions,
+                "opening_balance": zero_for_none(account.opening_dr)
+                - zero_for_none(account.opening_cr),
+                "closing_balance": zero_for_none(account.total_dr)
+                - zero_for_none(account.total_cr),
             }
-            for account in combined_accounts
-        ]
+            if is_range:
+                row["days"] = days.get(account.id, [])
+            account_transactions.append(row)
 
         return Response(account_transactions)
 
@@ -719,19 +746,84 @@ class AccountClosingViewSet(
     def create(self, request, *args, **kwargs):
         company = request.company
         fiscal_year_id = request.data.get("fiscal_year")
-        account_closing = AccountClosing.objects.get_or_create(
-            company=company, fiscal_period_id=fiscal_year_id
-        )[0]
-        if account_closing.status == "Closed":
-            return Response(
-                {"detail": "Your accounts for this year have already been closed."},
-                status=400,
+        with transaction.atomic():
+            account_closing = AccountClosing.objects.get_or_create(
+                company=company, fiscal_period_id=fiscal_year_id
+            )[0]
+            account_closing = AccountClosing.objects.select_for_update().get(
+                id=account_closing.id
             )
-        account_closing.close()
+            if account_closing.status == "Closed":
+                return Response(
+                    {"detail": "Your accounts for this year have already been closed."},
+                    status=400,
+                )
+            if account_closing.status == "Queued":
+                return Response(
+                    {"detail": "Your accounts for this year are already being closed."},
+                    status=400,
+                )
+            account_closing.queue_close()
         return Response(
-            "Successfully closed accounts for selected fiscal year.", status=200
+            AccountClosingSerializer(account_closing).data,
+            status=status.HTTP_202_ACCEPTED,
         )
 
+    @action(detail=True, methods=["post"])
+    def reopen(self, request, pk=None, *args, **kwargs):
+        account_closing = self.get_object()
+        if account_closing.status != "Closed":
+            raise ValidationError({"detail": "Only closed fiscal years can be reopened."})
+        account_closing.reopen()
+        return Response(AccountClosingSerializer(account_closing).data)
+
+    @action(detail=True, methods=["post"])
+    def reclose(self, request, pk=None, *args, **kwargs):
+        """
+        Closes a closed fiscal year again, replacing its closing entry, for changes made
+        to the year after it was closed.
+        """
+        account_closing = self.get_object()
+        if account_closing.status == "Queued":
+            raise ValidationError(
+                {"detail": "Your accounts for this year are already being closed."}
+            )
+        with transaction.atomic():
+            account_closing.queue_close()
+        return Response(
+            AccountClosingSerializer(account_closing).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+def _get_statement_account_rows(accounts, root_codes, comparative, category_ids=None):
+    rows = []
+    for account in accounts:
+        if account["root_code"] not in root_codes:
+            continue
+        if category_ids is not None and account["category_id"] not in category_ids:
+            continue
+        amounts = get_closing_amounts(account["columns"])
+        if not any(amount["cd"] or amount["cc"] for amount in amounts):
+            continue
+        row = {
+            "id": account["id"],
+            "name": account["name"],
+            "category_id": account["category_id"],
+            **amounts[0],
+        }
+        if comparative:
+            row["columns"] = amounts
+        rows.append(row)
+    return rows
+
+
+def _get_profit_loss_amounts(profit_loss):
+    return {
+        "cd": abs(profit_loss) if profit_loss < 0 else 0,
+        "cc": profit_loss if profit_loss > 0 else 0,
+    }
+
 
 class BalanceSheetView(APIView):
     action = "list"
@@ -740,108 +832,32 @@ class BalanceSheetView(APIView):
         return Account.objects.none()
 
     def get(self, request, format=None, *args, **kwargs):
-        start_date = request.GET.get("start_date")
-        end_date = request.GET.get("end_date")
-        if not start_date or not end_date:
+        periods = get_periods(request)
+        if not periods:
             return Response({})
 
         company = request.company
-        category_codes = ["A", "L", "Q"]
-
-        # Get all relevant categories and their descendants in a single query
-        categories = Category.objects.filter(company=company, code__in=category_codes)
-        category_ids = categories.values("tree_id", "lft", "rght")
-
-        all_ids = Category.objects.filter(
-            Q(tree_id__in=[category["tree_id"] for category in category_ids])
-            & Q(
-                lft__gte=Subquery(
-                    categories.filter(tree_id=OuterRef("tree_id")).values("lft")[:1]
-                )
-            )
-            & Q(
-                rght__lte=Subquery(
-                    categories.filter(tree_id=OuterRef("tree_id")).values("rght")[:1]
-                )
-            )
-        ).values_list("id", flat=True)
-
-        # Get income and expense categories and their descendants in a single query
-        income_category = Category.objects.filter(company=company, code="I").first()
-        expense_category = Category.objects.filter(company=company, code="E").first()
-
-        income_ids = Category.objects.filter(
-            Q(tree_id=income_category.tree_id)
-            & Q(lft__gte=income_category.lft)
-            & Q(rght__lte=income_category.rght)
-        ).values_list("id", flat=True)
-
-        expense_ids = Category.objects.filter(
-            Q(tree_id=expense_category.tree_id)
-            & Q(lft__gte=expense_category.lft)
-            & Q(rght__lte=expense_category.rght)
-        ).values_list("id", flat=True)
-
-        # Annotate accounts with their debit and credit sums in a single query
-        accounts = (
-            Account.objects.filter(company=company)
-            .annotate(
-                cd=Sum(
-                    "transactions__dr_amount",
-                    filter=Q(transactions__journal_entry__date__lt=end_date)
-                    | Q(
-                        transactions__journal_entry__date=end_date,
-                        transactions__type="Regular",
-                    ),
-                ),
-                cc=Sum(
-                    "transactions__cr_amount",
-                    filter=Q(transactions__journal_entry__date__lt=end_date)
-                    | Q(
-                        transactions__journal_entry__date=end_date,
-                        transactions__type="Regular",
-                    ),
-                ),
-            )
-            .exclude(cd=None, cc=None)
-        )
-
-        # Filter accounts by category IDs and prepare the result
-        qq = accounts.filter(category_id__in=all_ids).values(
-            "id", "name", "category_id", "cd", "cc"
-        )
-
-        # Calculate total income and expense using the same annotated accounts
-        total_income = (
-            accounts.filter(category_id__in=income_ids).aggregate(
-                total_income=Sum(F("cc")) - Sum(F("cd"))
-            )["total_income"]
-            or 0
-        )
-
-        total_expense = (
-            accounts.filter(category_id__in=expense_ids).aggregate(
-                total_expense=Sum(F("cd")) - Sum(F("cc"))
-            )["total_expense"]
-            or 0
+        comparative = len(periods) > 1
+        # Income and expenses are included for the profit/loss in the same query
+        accounts, categories = get_statement_balances(
+            company.id, periods, BALANCE_SHEET_ROOTS + INCOME_STATEMENT_ROOTS
         )
+        qq = _get_statement_account_rows(accounts, BALANCE_SHEET_ROOTS, comparative)
 
-        # Calculate profit/loss
-        profit_loss = total_income - total_expense
-
-        # Append profit/loss to the result
-        qq = list(qq)
-        qq.append(
-            {
-                "name": "Profit/Loss",
-                "id": 0,
-                "cd": abs(profit_loss) if profit_loss < 0 else 0,
-                "cc": profit_loss if profit_loss > 0 else 0,
-                "category_id": Category.objects.filter(company=company, code="L")
-                .values_list("id", flat=True)
-                .first(),
-            }
-        )
+        profit_loss = [
+            _get_profit_loss_amounts(amount)
+            for amount in get_profit_loss(categories, periods)
+        ]
+        liabilities = find_root_category(get_category_tree(company.id), "L")
+        row = {
+            "name": "Profit/Loss",
+            "id": 0,
+            **profit_loss[0],
+            "category_id": liabilities and liabilities["id"],
+        }
+        if comparative:
+            row["columns"] = profit_loss
+        qq.append(row)
 
         return Response(qq)
 
@@ -853,29 +869,17 @@ class IncomeStatementView(APIView):
         return Account.objects.none()
 
     def get(self, request, format=None, *args, **kwargs):
-        start_date = request.GET.get("start_date")
-        end_date = request.GET.get("end_date")
-
-        if not start_date or not end_date:
+        periods = get_periods(request)
+        if not periods:
             return Response({})
 
         company = request.company
-        category_system_codes = ["INCOME", "EXPENSES"]
+        comparative = len(periods) > 1
 
-        # Get all relevant categories and their descendants in a single query
-        categories = Category.objects.filter(
-            company=company, system_code__in=category_system_codes
+        category_tree = prune_category_tree(
+            get_category_tree(company.id), fields=("id", "system_code", "children")
         )
 
-        # Compute net
-        categories = Category.objects.filter(company=request.company)
-
-        # Get all categories with their descendants
-        category_tree = get_cached_trees(categories)
-
-        # Serialize the tree structure
-        serializer = CategoryTreeSerializerWithSystemCode(category_tree, many=True)
-
         def get_all_ids(category):
             all_ids = [category["id"]]
             for child in category.get("children", []):
@@ -893,7 +897,7 @@ class IncomeStatementView(APIView):
         interest_income_category = []
         interest_expense_category = []
 
-        for category in serializer.data:
+        for category in category_tree:
             if category.get("system_code") == acc_cat_system_codes["Income"]:
                 # income_categories.append(category)
                 # accounts_ids.extend(get_all_ids(category))
@@ -939,171 +943,71 @@ class IncomeStatementView(APIView):
                         purchase_category.append(child)
                         accounts_ids.extend(get_all_ids(child))
 
-        accounts = (
-            Account.objects.filter(company=company)
-            .annotate(
-                cd=Sum(
-                    "transactions__dr_amount",
-                    filter=Q(transactions__journal_entry__date__lt=end_date)
-                    | Q(
-                        transactions__journal_entry__date=end_date,
-                        transactions__type="Regular",
-                    ),
-                ),
-                cc=Sum(
-                    "transactions__cr_amount",
-                    filter=Q(transactions__journal_entry__date__lt=end_date)
-                    | Q(
-                        transactions__journal_entry__date=end_date,
-                        transactions__type="Regular",
-                    ),
-                ),
-            )
-            .exclude(cd=None, cc=None)
-            .values("id", "name", "category_id", "cd", "cc")
-            .filter(category_id__in=accounts_ids)
+        accounts, _ = get_statement_balances(
+            company.id, periods, INCOME_STATEMENT_ROOTS
         )
+        accounts = _get_statement_account_rows(
+            accounts, INCOME_STATEMENT_ROOTS, comparative, set(accounts_ids)
+        )
+        stock_values = get_stock_values(company.id, periods)
+        opening_stock, closing_stock = stock_values[0]
+        data = {
+            "accounts": accounts,
+            "opening_stock": opening_stock,
+            "closing_stock": closing_stock,
+            "category_tree": {
+                "revenue": direct_income_category,
+                "direct_expense": direct_expense_category,
+                "net_sales": income_categories,
+                "other_income": indirect_income_category,
+                "purchase": purchase_category,
+                "operating_expense": indirect_expense_category,
+                "interest_income": interest_income_category,
+                "interest_expense": interest_expense_category,
+            },
+            "corporate_tax_rate": company.corporate_tax_rate,
+            "country_iso": company.country_iso,
+        }
+        if comparative:
+            data["periods"] = [
+                {
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "opening_stock": opening,
+                    "closing_stock": closing,
+                }
+                for (start_date, end_date), (opening, closing) in zip(
+                    periods, stock_values
+                )
+            ]
+        return Response(data)
 
-        # raw sql to get opening and closing stock
-        query = f"""
-            WITH RECURSIVE weight_calc AS (
-                SELECT
-                    ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY product_journalentry.date, product_transaction.id) AS rn,
-                    product_transaction.id AS id,
-                    dr_amount,
-                    cr_amount,
-                    account_id,
-                    django_content_type.model AS content_type,
-                    CASE
-                        WHEN dr_amount IS NOT NULL THEN rate
-                    END AS entered_rate,
-                    COALESCE(dr_amount, cr_amount * -1) AS weight,
-                    CASE
-                        WHEN product_journalentry.date < '{start_date}' THEN 'opening'
-                        ELSE 'closing'
-                    END AS period
-                FROM product_transaction
-                JOIN product_journalentry
-                    ON product_transaction.journal_entry_id = product_journalentry.id
-                JOIN django_content_type
-                    ON product_journalentry.content_type_id = django_content_type.id
-                WHERE
-                    product_journalentry.date <= '{end_date}'
-            ),
-            running_calcs AS (
-                SELECT
-                    *,
-                    SUM(weight) OVER (PARTITION BY account_id ORDER BY rn) AS current_balance
-                FROM weight_calc
-            ),
-            final_calc AS (
-                SELECT
-                    rn,
-                    id,
-                    account_id,
-                    dr_amount,
-                    cr_amount,
-                    entered_rate,
-                    weight,
-                    current_balance,
-                    CASE
-                        WHEN content_type = 'debitnoterow' THEN entered_rate
-                        WHEN content_type = 'creditnoterow' THEN 0
-                        WHEN dr_amount IS NOT NULL THEN entered_rate
-                        ELSE 0
-                    END AS supposed_rate,
-                    CASE
-                        WHEN content_type = 'debitnoterow' THEN entered_rate
-                        WHEN content_type = 'creditnoterow' THEN 0
-                        WHEN dr_amount IS NOT NULL THEN entered_rate
-                        ELSE 0
-                    END AS calculated_rate,
-                    period
-                FROM running_calcs
-                WHERE rn = 1
-                UNION ALL
-                SELECT
-                    rc.rn,
-                    rc.id,
-                    rc.account_id,
-                    rc.dr_amount,
-                    rc.cr_amount,
-                    rc.entered_rate,
-                    rc.weight,
-                    rc.current_balance,
-                    CASE
-                        WHEN rc.content_type = 'debitnoterow' THEN rc.entered_rate
-                        WHEN rc.content_type = 'creditnoterow' THEN fc.calculated_rate
-                        WHEN rc.dr_amount IS NOT NULL THEN rc.entered_rate
-                        ELSE fc.calculated_rate
-                    END AS supposed_rate,
-                    CASE
-                        WHEN rc.current_balance <> 0 THEN
-                            (
-                                (fc.calculated_rate * fc.current_balance) +
-                                (
-                                    rc.weight *
-                                    CASE
-                                        WHEN rc.content_type = 'debitnoterow' THEN rc.entered_rate
-                                        WHEN rc.content_type = 'creditnoterow' THEN fc.calculated_rate
-                                        WHEN rc.dr_amount IS NOT NULL THEN rc.entered_rate
-                                        ELSE fc.calculated_rate
-                                    END
-                                )
-                            ) / rc.current_balance
-                        ELSE 0
-                    END AS calculated_rate,
-                    rc.period
-                FROM running_calcs rc
-                JOIN final_calc fc
-                    ON rc.rn = fc.rn + 1 AND rc.account_id = fc.account_id
-            ),
-            ranked_rows AS (
-                SELECT
-                    *,
-                    ROW_NUMBER() OVER (PARTITION BY account_id, period ORDER BY rn DESC) AS row_num
-                FROM final_calc
-            ),
-            aggregated_results AS (
-                SELECT
-                    account_id,
-                    MAX(CASE WHEN period = 'opening' THEN calculated_rate ELSE NULL END) AS opening_rate,
-                    MAX(CASE WHEN period = 'closing' THEN calculated_rate ELSE NULL END) AS closing_rate,
-                    MAX(CASE WHEN period = 'opening' THEN current_balance ELSE NULL END) AS opening_qty,
-                    MAX(CASE WHEN period = 'closing' THEN current_balance ELSE NULL END) AS closing_qty,
-                    MAX(CASE WHEN period = 'opening' THEN current_balance * calculated_rate ELSE NULL END) AS opening_value,
-                    MAX(CASE WHEN period = 'closing' THEN current_balance * calculated_rate ELSE NULL END) AS closing_value
-                FROM ranked_rows
-                WHERE row_num = 1
-                GROUP BY account_id
+
+class FinancialStatementExportView(APIView):
+    """
+    Exports the balance sheet, income statement or trial balance, with comparative
+    periods, as `file_format` XLSX, CSV or PDF.
+    """
+
+    action = "list"
+    statement = None
+
+    def get_queryset(self):
+        return Account.objects.none()
+
+    def get(self, request, format=None, *args, **kwargs):
+        periods = get_periods(request)
+        if not periods:
+            raise ValidationError({"detail": "start_date and end_date are required."})
+        title, headers, lines = get_statement_lines(
+            request.company.id, self.statement, periods
+        )
+        filename = "{}_{}".format(self.statement, periods[0][1])
+        file_format = request.GET.get("file_format", "xlsx")
+        if file_format == "pdf":
+            return statement_pdf_response(
+                filename, request.company, periods, title, headers, lines
             )
-            SELECT 
-                SUM(opening_value) AS total_opening_value,
-                SUM(closing_value) AS total_closing_value
-            FROM aggregated_results
-        """
-        # get opening and closing stock
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            row = cursor.fetchone()
-            opening_stock = row[0] or 0
-            closing_stock = row[1] or 0
-        return Response(
-            {
-                "accounts": accounts,
-                "opening_stock": opening_stock,
-                "closing_stock": closing_stock,
-                "category_tree": {
-                    "revenue": direct_income_category,
-                    "direct_expense": direct_expense_category,
-                    "net_sales": income_categories,
-                    "other_income": indirect_income_category,
-                    "purchase": purchase_category,
-                    "operating_expense": indirect_expense_category,
-                    "interest_income": interest_income_category,
-                    "interest_expense": interest_expense_category,
-                },
-                "corporate_tax_rate": company.corporate_tax_rate,
-                "country_iso": company.country_iso,
-            }
+        return streaming_export_response(
+            filename, file_format, title, headers, get_statement_rows(lines)
         )
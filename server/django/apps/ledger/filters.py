@@ -3,7 +3,7 @@ from functools import reduce
 from django.db.models import Q
 from django_filters import rest_framework as filters
 
-from apps.ledger.models import Account, Category
+from apps.ledger.models import Account, Category, Party
 from apps.ledger.models.base import Transaction
 
 
@@ -30,6 +30,25 @@ class AccountFilterSet(filters.FilterSet):
         fields = ("default",)
 
 
+class PartyBalanceFilterSet(filters.FilterSet):
+    """
+    Filters customer and supplier listings, which annotate balances, by balance.
+    """
+
+    min_balance = filters.NumberFilter(method="filter_balance")
+    max_balance = filters.NumberFilter(method="filter_balance")
+
+    def filter_balance(self, qs, name, value):
+        if value is None or "balance" not in qs.query.annotations:
+            return qs
+        lookup = "balance__gte" if name == "min_balance" else "balance__lte"
+        return qs.filter(**{lookup: value})
+
+    class Meta:
+        model = Party
+        fields = ()
+
+
 class CategoryFilterSet(filters.FilterSet):
     class Meta:
         model = Category
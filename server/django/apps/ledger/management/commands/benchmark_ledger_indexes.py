@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from apps.ledger.models import Account, JournalEntry, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Print EXPLAIN plans of ledger report queries filtering on the journal entry date "
+        "against the denormalized transaction date"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID",
+            required=True,
+        )
+        parser.add_argument(
+            "--account",
+            type=int,
+            help="Account ID, defaults to the account with most transactions",
+        )
+        parser.add_argument("--start-date", type=str, help="YYYY-MM-DD")
+        parser.add_argument("--end-date", type=str, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run the queries with EXPLAIN ANALYZE",
+        )
+
+    def explain(self, title, queryset, analyze):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(queryset.explain(analyze=analyze))
+        self.stdout.write("")
+
+    def handle(self, *args, **options):
+        company_id = options["company"]
+        analyze = options["analyze"]
+        transactions = Transaction.objects.filter(company_id=company_id)
+
+        account_id = options["account"]
+        if not account_id:
+            busiest = (
+                transactions.values("account_id")
+                .annotate(count=Count("id"))
+                .order_by("-count")
+                .first()
+            )
+            if not busiest:
+                raise CommandError("Company has no transactions")
+            account_id = busiest["account_id"]
+        account = Account.objects.get(id=account_id, company_id=company_id)
+
+        dates = transactions.filter(account=account).order_by("date")
+        start_date = options["start_date"] or dates.values_list("date", flat=True)[0]
+        end_date = (
+            options["end_date"] or dates.reverse().values_list("date", flat=True)[0]
+        )
+        self.stdout.write(f"Account: {account} ({start_date} - {end_date})\n")
+
+        self.explain(
+            "Account ledger, before: filtered through journal entry date",
+            transactions.filter(
+                account=account, journal_entry__date__range=[start_date, end_date]
+            ).order_by("journal_entry__date", "id"),
+            analyze,
+        )
+        self.explain(
+            "Account ledger, after: filtered on transaction date",
+            transactions.filter(
+                account=account, date__range=[start_date, end_date]
+            ).order_by("date", "id"),
+            analyze,
+        )
+        self.explain(
+            "Company totals, before: filtered through journal entry date",
+            transactions.filter(journal_entry__date__range=[start_date, end_date])
+            .values("account_id")
+            .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount")),
+            analyze,
+        )
+        self.explain(
+            "Company totals, after: filtered on transaction date",
+            transactions.filter(date__range=[start_date, end_date])
+            .values("account_id")
+            .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount")),
+            analyze,
+        )
+
+        journal_entry = (
+            JournalEntry.objects.filter(transactions__account=account)
+            .order_by("-id")
+            .first()
+        )
+        self.explain(
+            "Journal entry lookup by source",
+            JournalEntry.objects.filter(
+                content_type_id=journal_entry.content_type_id,
+                object_id=journal_entry.object_id,
+            ),
+            analyze,
+        )
@@ -0,0 +1,145 @@
+import time
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.ledger.models import JournalEntry, Transaction, set_bulk_transactions
+from apps.ledger.models.base import _add_movement, _record_movements, _to_date
+from apps.voucher.models import SalesVoucher
+from awecount.libs import decimalize
+
+
+def post_per_entry(submodel, date, *entries):
+    """
+    Posts `entries` the way set_transactions did before the batched engine: the journal
+    entry is fetched or saved on its own, and every entry looks up its transaction,
+    reads the account's balance up to the date, saves the transaction and moves the
+    balances by itself.
+    """
+    date = _to_date(date)
+    content_type = ContentType.objects.get_for_model(submodel)
+    journal_entry = JournalEntry.objects.filter(
+        content_type=content_type, object_id=submodel.id
+    ).first()
+    if journal_entry is None:
+        if hasattr(submodel, "voucher_id"):
+            voucher_id = submodel.voucher_id
+            voucher_no = submodel.voucher.voucher_no
+        else:
+            voucher_id = submodel.id
+            voucher_no = submodel.voucher_no
+        journal_entry = JournalEntry.objects.create(
+            content_type=content_type,
+            object_id=submodel.id,
+            date=date,
+            source_voucher_id=voucher_id,
+            source_voucher_no=voucher_no,
+        )
+
+    transaction_ids = []
+    for entry_type, account, amount in entries:
+        val = decimalize(str(amount))
+        movements = {}
+        ledger_transaction = journal_entry.transactions.filter(account=account).first()
+        if ledger_transaction:
+            _add_movement(
+                movements,
+                (
+                    account.id,
+                    account.company_id,
+                    ledger_transaction.date,
+                    ledger_transaction.type,
+                ),
+                decimalize(ledger_transaction.dr_amount) * -1,
+                decimalize(ledger_transaction.cr_amount) * -1,
+            )
+        else:
+            ledger_transaction = Transaction(
+                account=account,
+                company_id=account.company_id,
+                journal_entry=journal_entry,
+            )
+            # The running balance of a new transaction was read from the account
+            account.get_dr_amount(date + timedelta(days=1))
+            account.get_cr_amount(date + timedelta(days=1))
+        ledger_transaction.date = date
+        if entry_type == "dr":
+            ledger_transaction.dr_amount = val
+            ledger_transaction.cr_amount = None
+        else:
+            ledger_transaction.cr_amount = val
+            ledger_transaction.dr_amount = None
+        ledger_transaction.save()
+        _add_movement(
+            movements,
+            (account.id, account.company_id, date, ledger_transaction.type),
+            decimalize(ledger_transaction.dr_amount),
+            decimalize(ledger_transaction.cr_amount),
+        )
+        _record_movements(movements)
+        transaction_ids.append(ledger_transaction.id)
+
+    if journal_entry.date != date:
+        journal_entry.date = date
+        journal_entry.save()
+    journal_entry.transactions.exclude(id__in=transaction_ids).delete()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare query counts of posting a sales voucher entry by entry against the batched posting engine. "
+        "All changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--voucher",
+            type=int,
+            help="Sales voucher ID",
+            required=True,
+        )
+
+    def measure(self, func):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return len(context.captured_queries), elapsed
+
+    def handle(self, *args, **options):
+        try:
+            voucher = SalesVoucher.objects.get(id=options["voucher"])
+        except SalesVoucher.DoesNotExist:
+            raise CommandError("Sales voucher not found")
+
+        if voucher.payment_mode_id:
+            dr_acc = voucher.payment_mode.account
+        elif voucher.party_id:
+            dr_acc = voucher.party.customer_account
+        else:
+            raise CommandError("Sales voucher has neither payment mode nor party")
+
+        postings = voucher.get_row_ledger_postings(dr_acc)
+
+        def post_entry_by_entry():
+            for row, date, entries in postings:
+                post_per_entry(row, date, *entries)
+
+        def post_in_bulk():
+            set_bulk_transactions(postings, clear=True)
+
+        entry_queries, entry_time = self.measure(post_entry_by_entry)
+        bulk_queries, bulk_time = self.measure(post_in_bulk)
+
+        self.stdout.write(f"Rows: {len(postings)}")
+        self.stdout.write(
+            f"Entry by entry: {entry_queries} queries in {entry_time * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"Batched: {bulk_queries} queries in {bulk_time * 1000:.1f} ms"
+        )
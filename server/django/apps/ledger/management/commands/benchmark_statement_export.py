@@ -0,0 +1,104 @@
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ledger.models import Account
+from awecount.libs.exports import stream_csv, stream_xlsx
+from awecount.libs.mixins import STATEMENT_HEADERS, TransactionsViewMixin
+
+
+def synthetic_rows(count):
+    start = date(2000, 1, 1)
+    balance = Decimal(0)
+    for index in range(count):
+        dr = Decimal(index % 1000) + Decimal("0.25")
+        cr = Decimal(index % 700)
+        balance += dr - cr
+        yield [
+            start + timedelta(days=index // 500),
+            "Sales Voucher",
+            index,
+            "Sales Account, VAT Payable",
+            dr,
+            cr,
+            balance,
+        ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a ledger statement export and report its size, time and peak memory, "
+        "for a synthetic statement or an account"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=2000000,
+            help="Number of synthetic statement lines",
+        )
+        parser.add_argument(
+            "--account",
+            type=int,
+            help="Export the statement of this account instead of synthetic lines",
+        )
+        parser.add_argument(
+            "--file-format",
+            choices=["csv", "xlsx"],
+            default="csv",
+        )
+        parser.add_argument(
+            "--max-memory",
+            type=float,
+            help="Fail if the peak memory in MB exceeds this",
+        )
+
+    def handle(self, *args, **options):
+        if options["account"]:
+            try:
+                account = Account.objects.get(id=options["account"])
+            except Account.DoesNotExist:
+                raise CommandError("Account not found")
+            rows = TransactionsViewMixin().get_statement_rows(
+                account.company_id, [account.id], None, None
+            )
+        else:
+            rows = synthetic_rows(options["rows"])
+
+        if options["file_format"] == "xlsx":
+            chunks = stream_xlsx("Statement", STATEMENT_HEADERS, rows)
+        else:
+            chunks = stream_csv(STATEMENT_HEADERS, rows)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_chunk = None
+        size = 0
+        for chunk in chunks:
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        peak_mb = peak / (1024 * 1024)
+        self.stdout.write(
+            "{}: {:.1f} MB in {:.2f}s, first bytes after {:.3f}s, peak memory {:.1f} MB".format(
+                options["file_format"].upper(),
+                size / (1024 * 1024),
+                elapsed,
+                first_chunk or 0,
+                peak_mb,
+            )
+        )
+        if options["max_memory"] and peak_mb > options["max_memory"]:
+            raise CommandError(
+                "Peak memory {:.1f} MB exceeds {} MB".format(
+                    peak_mb, options["max_memory"]
+                )
+            )
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from apps.company.models import Company
+from apps.ledger.models import AccountDailyMovement, rebuild_period_balances
+from apps.ledger.models import Transaction as LedgerTransaction
+from apps.product.models import InventoryDailyMovement
+from apps.product.models import Transaction as InventoryTransaction
+from awecount.libs import zero_for_none
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild daily movements of ledger and inventory accounts from their transactions, "
+        "and the period balances derived from them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID, defaults to all companies",
+        )
+
+    def rebuild(self, company):
+        AccountDailyMovement.objects.filter(company=company).delete()
+        rows = (
+            LedgerTransaction.objects.filter(account__company=company)
+            .order_by()
+            .values("account_id", "date", "type")
+            .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
+        )
+        ledger_movements = AccountDailyMovement.objects.bulk_create(
+            [
+                AccountDailyMovement(
+                    account_id=row["account_id"],
+                    company=company,
+                    date=row["date"],
+                    type=row["type"],
+                    dr_amount=zero_for_none(row["dr"]),
+                    cr_amount=zero_for_none(row["cr"]),
+                )
+                for row in rows.iterator()
+            ],
+            batch_size=5000,
+        )
+        rebuild_period_balances(company.id)
+
+        InventoryDailyMovement.objects.filter(account__company=company).delete()
+        rows = (
+            InventoryTransaction.objects.filter(account__company=company)
+            .order_by()
+            .values("account_id", "journal_entry__date")
+            .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
+        )
+        inventory_movements = InventoryDailyMovement.objects.bulk_create(
+            [
+                InventoryDailyMovement(
+                    account_id=row["account_id"],
+                    date=row["journal_entry__date"],
+                    dr_amount=zero_for_none(row["dr"]),
+                    cr_amount=zero_for_none(row["cr"]),
+                )
+                for row in rows.iterator()
+            ],
+            batch_size=5000,
+        )
+        return len(ledger_movements), len(inventory_movements)
+
+    def handle(self, *args, **options):
+        companies = Company.objects.all()
+        if options["company"]:
+            companies = companies.filter(id=options["company"])
+
+        for company in companies:
+            with transaction.atomic():
+                ledger_count, inventory_count = self.rebuild(company)
+            self.stdout.write(
+                "{}: {} ledger and {} inventory daily movements".format(
+                    company, ledger_count, inventory_count
+                )
+            )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.ledger.models import (
+    AccountPeriodBalance,
+    AccountYearOpening,
+    rebuild_period_balances,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild monthly account balances and fiscal year openings from daily movements"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID, defaults to all companies",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_period_balances(options["company"])
+        balances = AccountPeriodBalance.objects.all()
+        openings = AccountYearOpening.objects.all()
+        if options["company"]:
+            balances = balances.filter(company_id=options["company"])
+            openings = openings.filter(company_id=options["company"])
+        self.stdout.write(
+            "{} period balances and {} fiscal year openings rebuilt".format(
+                balances.count(), openings.count()
+            )
+        )
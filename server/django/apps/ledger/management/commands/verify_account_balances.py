@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.company.models import Company
+from apps.ledger.models import fix_account_balances, get_account_balance_drift
+from awecount.libs import zero_for_none
+
+
+def verify(company_id, fix=False):
+    """
+    Returns the accounts of a company whose balances have drifted, fixing them if asked.
+    """
+    drift = get_account_balance_drift(company_id)
+    if fix and drift:
+        fix_account_balances([row[0] for row in drift])
+    return drift
+
+
+def _verify(company_id, fix):
+    # Runs in a worker process, each worker opens a connection of its own on first query
+    return company_id, verify(company_id, fix)
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute balances of accounts from their transactions and report the ones "
+        "whose maintained current_dr and current_cr have drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID, defaults to all companies",
+        )
+
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes, defaults to the number of CPUs",
+        )
+
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Set the drifted balances to the totals of the transactions",
+        )
+
+    def report(self, drift, fix):
+        for account_id, company_id, name, current_dr, current_cr, dr, cr in drift:
+            self.stdout.write(
+                "{} [{}] of company {}: current {} / {}, transactions {} / {}{}".format(
+                    name,
+                    account_id,
+                    company_id,
+                    zero_for_none(current_dr),
+                    zero_for_none(current_cr),
+                    zero_for_none(dr),
+                    zero_for_none(cr),
+                    ", fixed" if fix else "",
+                )
+            )
+
+    def handle(self, *args, **options):
+        fix = options["fix"]
+        if options["company"]:
+            company_ids = [options["company"]]
+        else:
+            company_ids = list(Company.objects.values_list("id", flat=True))
+
+        count = 0
+        workers = max(min(options["workers"] or 1, len(company_ids)), 1)
+        if workers == 1:
+            for company_id in company_ids:
+                drift = verify(company_id, fix)
+                self.report(drift, fix)
+                count += len(drift)
+        else:
+            # * Forked workers must not share the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                futures = [
+                    executor.submit(_verify, company_id, fix)
+                    for company_id in company_ids
+                ]
+                for future in as_completed(futures):
+                    company_id, drift = future.result()
+                    self.report(drift, fix)
+                    count += len(drift)
+
+        self.stdout.write(
+            "{} accounts with drifted balances{}".format(
+                count, ", fixed" if fix else ""
+            )
+        )
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:20
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0013_company_aggregate_voucher_journal_entries'),
+        ('ledger', '0006_auto_20250509_1441'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDailyMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('type', models.CharField(choices=[('Regular', 'Regular'), ('Opening', 'Opening'), ('Closing', 'Closing')], default='Regular', max_length=25)),
+                ('dr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('cr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_movements', to='ledger.account')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_daily_movements', to='company.company')),
+            ],
+            options={
+                'unique_together': {('account', 'date', 'type')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO ledger_accountdailymovement (account_id, company_id, date, type, dr_amount, cr_amount)
+                SELECT t.account_id, a.company_id, je.date, t.type,
+                    COALESCE(SUM(t.dr_amount), 0), COALESCE(SUM(t.cr_amount), 0)
+                FROM ledger_transaction t
+                JOIN ledger_journalentry je ON je.id = t.journal_entry_id
+                JOIN ledger_account a ON a.id = t.account_id
+                GROUP BY t.account_id, a.company_id, je.date, t.type
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='current_cr',
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='current_dr',
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:05
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0013_company_aggregate_voucher_journal_entries'),
+        ('ledger', '0007_accountdailymovement_remove_transaction_current_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountPeriodBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('type', models.CharField(choices=[('Regular', 'Regular'), ('Opening', 'Opening'), ('Closing', 'Closing')], default='Regular', max_length=25)),
+                ('dr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('cr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_balances', to='ledger.account')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_period_balances', to='company.company')),
+                ('fiscal_year', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='account_period_balances', to='company.fiscalyear')),
+            ],
+            options={
+                'unique_together': {('account', 'period_start', 'type')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO ledger_accountperiodbalance
+                    (account_id, company_id, fiscal_year_id, period_start, type, dr_amount, cr_amount)
+                SELECT m.account_id, m.company_id, fy.id,
+                    CASE WHEN fy.id IS NULL THEN m.date
+                        ELSE GREATEST(DATE_TRUNC('month', m.date)::date, fy.start_date) END,
+                    m.type, SUM(m.dr_amount), SUM(m.cr_amount)
+                FROM ledger_accountdailymovement m
+                LEFT JOIN LATERAL (
+                    SELECT id, start_date FROM company_fiscalyear
+                    WHERE m.date BETWEEN start_date AND end_date
+                    ORDER BY start_date DESC LIMIT 1
+                ) fy ON TRUE
+                GROUP BY 1, 2, 3, 4, 5
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('company', '0013_company_aggregate_voucher_journal_entries'),
+        ('ledger', '0008_accountperiodbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE ledger_transaction t
+                SET date = je.date
+                FROM ledger_journalentry je
+                WHERE je.id = t.journal_entry_id;
+
+                UPDATE ledger_transaction t
+                SET company_id = a.company_id
+                FROM ledger_account a
+                WHERE a.id = t.account_id AND t.company_id IS NULL;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='date',
+            field=models.DateField(),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['company', 'account', 'date', 'id'], name='ledger_txn_company_acc_date'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['company', 'date'], name='ledger_txn_company_date'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['content_type', 'object_id'], name='ledger_je_source'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0009_transaction_date_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountclosing',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='accountclosing',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Closed', 'Closed'), ('Queued', 'Queued'), ('Failed', 'Failed')], default='Pending', max_length=50),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:45
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0015_company_async_voucher_posting'),
+        ('ledger', '0010_accountclosing_error'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountYearOpening',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('cr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='year_openings', to='ledger.account')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_year_openings', to='company.company')),
+                ('fiscal_year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_openings', to='company.fiscalyear')),
+            ],
+            options={
+                'unique_together': {('account', 'fiscal_year')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO ledger_accountyearopening
+                    (account_id, company_id, fiscal_year_id, dr_amount, cr_amount)
+                SELECT p.account_id, p.company_id, fy.id, SUM(p.dr_amount), SUM(p.cr_amount)
+                FROM ledger_accountperiodbalance p
+                JOIN company_fiscalyear fy ON p.period_start < fy.start_date
+                GROUP BY 1, 2, 3
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
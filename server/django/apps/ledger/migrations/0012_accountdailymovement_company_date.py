@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0011_accountyearopening'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accountdailymovement',
+            index=models.Index(fields=['company', 'date'], name='ledger_movement_company_date'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.20 on 2026-10-18 15:25
+
+from decimal import Decimal
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0012_accountdailymovement_company_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(models.F('company'), models.expressions.CombinedExpression(django.db.models.functions.comparison.Coalesce('current_dr', models.Value(Decimal('0'))), '-', django.db.models.functions.comparison.Coalesce('current_cr', models.Value(Decimal('0')))), name='ledger_account_balance'),
+        ),
+    ]
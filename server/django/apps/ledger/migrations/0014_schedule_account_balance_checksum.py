@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2026-10-18 16:10
+
+from django.db import migrations
+
+SCHEDULE_NAME = 'ledger-account-balance-checksum'
+
+
+def create_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.update_or_create(
+        name=SCHEDULE_NAME,
+        defaults={
+            'func': 'apps.ledger.tasks.checksum_account_balances',
+            'schedule_type': 'D',
+            'repeats': -1,
+        },
+    )
+
+
+def delete_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.filter(name=SCHEDULE_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_q', '__latest__'),
+        ('ledger', '0013_account_balance_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_schedule, delete_schedule),
+    ]
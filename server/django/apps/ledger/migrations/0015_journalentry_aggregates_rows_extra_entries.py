@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0014_schedule_account_balance_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='aggregates_rows',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='journalentry',
+            name='extra_entries',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0015_journalentry_aggregates_rows_extra_entries'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='account',
+            name='ledger_account_balance',
+        ),
+    ]
@@ -1,22 +1,42 @@
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 from decimal import Decimal
 
+from dateutil.relativedelta import relativedelta
 from dateutil.utils import today
 from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Case, F, ProtectedError, Q, Sum, Value, When
+from django.db import connection, models
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    OuterRef,
+    ProtectedError,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, NullIf
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db.transaction import atomic, on_commit
+from django.dispatch import receiver
+from django.utils import timezone
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel
 from rest_framework.exceptions import ValidationError as RestValidationError
 
 from apps.company.models import Company, CompanyBaseModel, FiscalYear
-from awecount.libs import decimalize, none_for_zero, zero_for_none
+from awecount.libs import decimalize, zero_for_none
+from awecount.libs.db import increment_or_create
 from awecount.libs.exception import BadOperation
 
 acc_system_codes = settings.ACCOUNT_SYSTEM_CODES
@@ -79,8 +99,7 @@ class Category(MPTTModel, CompanyBaseModel):
         return cls.objects.get(default=True, company=company, name=name)
 
     def get_data(self):
-        node = Node(self)
-        return node.get_data()
+        return find_category_node(get_category_tree(self.company_id), self.id)
 
     def get_descendant_accounts(self):
         ledgers = self.accounts.all()
@@ -100,7 +119,8 @@ class Account(CompanyBaseModel):
     code = models.CharField(max_length=50, blank=True, null=True)
     system_code = models.CharField(max_length=20, null=True, blank=True)
     name = models.CharField(max_length=255)
-    # current_dr and current_cr may not always be exact
+    # current_dr and current_cr are the totals of the transactions of the account, kept
+    # by the posting path with atomic increments, see `_record_movements`
     current_dr = models.DecimalField(
         max_digits=24,
         decimal_places=6,
@@ -168,21 +188,27 @@ class Account(CompanyBaseModel):
     def get_balance(self):
         return zero_for_none(self.current_dr) - zero_for_none(self.current_cr)
 
+    def get_balance_until(self, date):
+        """
+        Balance of the transactions up to and including `date`.
+        """
+        totals = (
+            Account.objects.filter(id=self.id)
+            .annotate(
+                **get_account_total_annotations(
+                    date, "dr", "cr", date_types=[type for type, _ in TRANSACTION_TYPES]
+                )
+            )
+            .values("dr", "cr")
+            .first()
+        )
+        return zero_for_none(totals["dr"]) - zero_for_none(totals["cr"])
+
     def get_day_opening(self, before_date=None):
-        if not before_date:
-            before_date = today()
-        tr = Transaction.objects.filter(
-            account=self, journal_entry__date__lte=before_date
-        ).aggregate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
-        return (tr.get("dr") or 0) - (tr.get("cr") or 0)
+        return self.get_balance_until(before_date or today())
 
     def get_day_closing(self, until_date=None):
-        if not until_date:
-            until_date = today()
-        tr = Transaction.objects.filter(
-            account=self, journal_entry__date__lte=until_date
-        ).aggregate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
-        return (tr.get("dr") or 0) - (tr.get("cr") or 0)
+        return self.get_balance_until(until_date or today())
 
     def add_category(self, category):
         category_instance = Category.objects.get(
@@ -196,20 +222,18 @@ class Account(CompanyBaseModel):
     categories = property(get_all_categories)
 
     def get_cr_amount(self, day):
-        transactions = Transaction.objects.filter(
-            journal_entry__date__lt=day, account=self
-        ).order_by("-journal_entry__id", "-journal_entry__date")[:1]
-        if len(transactions) > 0:
-            return transactions[0].current_cr
-        return 0
+        return zero_for_none(
+            self.daily_movements.filter(date__lt=day).aggregate(
+                cr=Sum("cr_amount")
+            )["cr"]
+        )
 
     def get_dr_amount(self, day):
-        transactions = Transaction.objects.filter(
-            journal_entry__date__lt=day, account=self
-        ).order_by("-journal_entry__id", "-journal_entry__date")[:1]
-        if len(transactions) > 0:
-            return transactions[0].current_dr
-        return 0
+        return zero_for_none(
+            self.daily_movements.filter(date__lt=day).aggregate(
+                dr=Sum("dr_amount")
+            )["dr"]
+        )
 
     def save(self, *args, **kwargs):
         self.validate_unique()
@@ -375,47 +399,133 @@ class PartyRepresentative(models.Model):
         return self.name or "-"
 
 
-class Node(object):
-    def __init__(self, model, parent=None, depth=0):
-        self.children = []
-        self.model = model
-        self.name = self.model.name
-        self.type = self.model.__class__.__name__
-        self.dr = 0
-        self.cr = 0
-        self.url = None
-        self.depth = depth
-        self.parent = parent
-        if self.type == "Category":
-            for child in self.model.children.all():
-                self.add_child(Node(child, parent=self, depth=self.depth + 1))
-            for account in self.model.accounts.all():
-                self.add_child(Node(account, parent=self, depth=self.depth + 1))
-        if self.type == "Account":
-            self.dr = self.model.current, "company_dr or 0"
-            self.cr = self.model.current_cr or 0
-            self.url = self.model.get_absolute_url()
-        if self.parent:
-            self.parent.dr += self.dr
-            self.parent.cr += self.cr
-
-    def add_child(self, obj):
-        self.children.append(obj.get_data())
+CATEGORY_TREE_TIMEOUT = 24 * 60 * 60
+CATEGORY_TREE_FIELDS = (
+    "id",
+    "name",
+    "code",
+    "system_code",
+    "tree_id",
+    "lft",
+    "rght",
+    "level",
+    "default",
+    "parent_id",
+)
 
-    def get_data(self):
-        data = {
-            "name": self.name,
-            "type": self.type,
-            "dr": self.dr,
-            "cr": self.cr,
-            "nodes": self.children,
-            "depth": self.depth,
-            "url": self.url,
-        }
-        return data
 
-    def __str__(self):
-        return self.name
+def _category_tree_version_key(company_id):
+    return "category-tree-version-{}".format(company_id)
+
+
+def get_category_tree_version(company_id):
+    # * Versions start from the current time so that a version lost from the cache is
+    # never reused by a tree cached before it was lost
+    return cache.get_or_set(
+        _category_tree_version_key(company_id), time.time_ns(), timeout=None
+    )
+
+
+def invalidate_category_tree(*company_ids):
+    """
+    Bumps the category tree versions of companies, leaving trees cached under older
+    versions to expire.
+    """
+    for company_id in set(company_ids):
+        try:
+            cache.incr(_category_tree_version_key(company_id))
+        except ValueError:
+            cache.set(
+                _category_tree_version_key(company_id), time.time_ns(), timeout=None
+            )
+
+
+def _build_category_tree(company_id):
+    categories = {}
+    roots = []
+    for category in (
+        Category.objects.filter(company_id=company_id)
+        .order_by("tree_id", "lft")
+        .values(*CATEGORY_TREE_FIELDS)
+    ):
+        category.update(
+            dr=Decimal("0"), cr=Decimal("0"), account_count=0, children=[]
+        )
+        categories[category["id"]] = category
+    for category in categories.values():
+        parent = categories.get(category["parent_id"])
+        (parent["children"] if parent else roots).append(category)
+
+    for row in (
+        Account.objects.filter(company_id=company_id)
+        .order_by()
+        .values("category_id")
+        .annotate(dr=Sum("current_dr"), cr=Sum("current_cr"), count=Count("id"))
+    ):
+        category = categories[row["category_id"]]
+        category["dr"] = zero_for_none(row["dr"])
+        category["cr"] = zero_for_none(row["cr"])
+        category["account_count"] = row["count"]
+
+    # * Deepest categories first, so that children are rolled up before their parents
+    for category in sorted(categories.values(), key=lambda c: -c["level"]):
+        parent = categories.get(category["parent_id"])
+        if parent:
+            parent["dr"] += category["dr"]
+            parent["cr"] += category["cr"]
+    return roots
+
+
+def get_category_tree(company_id):
+    """
+    Returns the category tree of a company, as nested dicts with the debit and credit
+    balances of the accounts of each category and its descendants, from the cache.
+    """
+    key = "category-tree-{}-{}".format(
+        company_id, get_category_tree_version(company_id)
+    )
+    tree = cache.get(key)
+    if tree is None:
+        tree = _build_category_tree(company_id)
+        cache.set(key, tree, timeout=CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def find_category_node(tree, category_id):
+    for node in tree:
+        if node["id"] == category_id:
+            return node
+        found = find_category_node(node["children"], category_id)
+        if found:
+            return found
+
+
+def prune_category_tree(tree, fields=None, include_empty=True):
+    """
+    Copies `tree` keeping only `fields` of its nodes and, unless `include_empty`,
+    leaving out categories without accounts or children.
+    """
+    nodes = []
+    for node in tree:
+        if not include_empty and not node["account_count"] and not node["children"]:
+            continue
+        node = dict(
+            node,
+            children=prune_category_tree(node["children"], fields, include_empty),
+        )
+        if fields:
+            node = {field: node[field] for field in fields}
+        nodes.append(node)
+    return nodes
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def _category_tree_change(sender, instance, **kwargs):
+    company_id = instance.company_id
+    on_commit(lambda: invalidate_category_tree(company_id))
 
 
 TRANSACTION_TYPES = (
@@ -425,6 +535,17 @@ TRANSACTION_TYPES = (
 )
 
 
+class JournalEntryQuerySet(models.QuerySet):
+    def delete(self):
+        with atomic():
+            _record_movements(
+                _transaction_movements(
+                    Transaction.objects.filter(journal_entry__in=self), sign=-1
+                )
+            )
+            return super().delete()
+
+
 class JournalEntry(models.Model):
     date = models.DateField()
     content_type = models.ForeignKey(
@@ -437,6 +558,12 @@ class JournalEntry(models.Model):
     )
     source_voucher_no = models.CharField(max_length=50, blank=True, null=True)
     source_voucher_id = models.PositiveIntegerField(blank=True, null=True)
+    # Set on the journal entry of a voucher when the entries of its rows are netted into it
+    aggregates_rows = models.BooleanField(default=False)
+    # Extra entries of a voucher, as [type, account_id, amount], posted again with its rows
+    extra_entries = models.JSONField(blank=True, null=True)
+
+    objects = JournalEntryQuerySet.as_manager()
 
     def __str__(self):
         return (
@@ -448,6 +575,31 @@ class JournalEntry(models.Model):
             + "]"
         )
 
+    def delete(self, *args, **kwargs):
+        with atomic():
+            _record_movements(
+                _transaction_movements(self.transactions.all(), sign=-1)
+            )
+            return super().delete(*args, **kwargs)
+
+    def get_extra_entries(self):
+        if not self.extra_entries:
+            return []
+        accounts = Account.objects.in_bulk(
+            [account_id for _, account_id, _ in self.extra_entries]
+        )
+        return [
+            [type, accounts.get(account_id), Decimal(amount)]
+            for type, account_id, amount in self.extra_entries
+        ]
+
+    @staticmethod
+    def dump_entries(entries):
+        return [
+            [type, account.id, str(decimalize(str(amount)))]
+            for type, account, amount in entries
+        ] or None
+
     @staticmethod
     def get_for(source):
         try:
@@ -460,6 +612,79 @@ class JournalEntry(models.Model):
 
     class Meta:
         verbose_name_plural = "Journal Entries"
+        indexes = [
+            models.Index(
+                fields=["content_type", "object_id"], name="ledger_je_source"
+            ),
+        ]
+
+
+class TransactionQuerySet(models.QuerySet):
+    def with_running_balance(self):
+        """
+        Annotates `current_dr` and `current_cr`, the running totals of the account up to and
+        including each transaction, from the daily movements before the transaction's date
+        and the transactions of the same date.
+        """
+        zero = Value(
+            Decimal("0"), output_field=models.DecimalField(max_digits=24, decimal_places=6)
+        )
+        earlier_days = (
+            AccountDailyMovement.objects.filter(
+                account_id=OuterRef("account_id"),
+                date__lt=OuterRef("date"),
+            )
+            .order_by()
+            .values("account_id")
+        )
+        same_day = (
+            Transaction.objects.filter(
+                account_id=OuterRef("account_id"),
+                date=OuterRef("date"),
+                id__lte=OuterRef("id"),
+            )
+            .order_by()
+            .values("account_id")
+        )
+        return self.annotate(
+            **{
+                balance: Coalesce(
+                    Subquery(earlier_days.annotate(total=Sum(field)).values("total")),
+                    zero,
+                )
+                + Coalesce(
+                    Subquery(same_day.annotate(total=Sum(field)).values("total")),
+                    zero,
+                )
+                for balance, field in (
+                    ("current_dr", "dr_amount"),
+                    ("current_cr", "cr_amount"),
+                )
+            }
+        )
+
+    def delete(self):
+        with atomic():
+            _record_movements(_transaction_movements(self, sign=-1))
+            return super().delete()
+
+    def update(self, **kwargs):
+        account = kwargs.get("account", kwargs.get("account_id"))
+        if account is None or hasattr(account, "resolve_expression"):
+            return super().update(**kwargs)
+
+        # Transactions moved to another account take their movements along
+        account_id = getattr(account, "id", account)
+        company_id = Account.objects.values_list("company_id", flat=True).get(
+            id=account_id
+        )
+        with atomic():
+            movements = _transaction_movements(self, sign=-1)
+            for (_, _, date, type), (dr, cr) in list(movements.items()):
+                _add_movement(movements, (account_id, company_id, date, type), -dr, -cr)
+            rows = super().update(**kwargs)
+            _record_movements(movements)
+        return rows
 
 
 class Transaction(CompanyBaseModel):
@@ -480,23 +705,11 @@ class Transaction(CompanyBaseModel):
         blank=True,
         validators=[MinValueValidator(Decimal("0.000000"))],
     )
-    current_dr = models.DecimalField(
-        max_digits=24,
-        decimal_places=6,
-        null=True,
-        blank=True,
-        validators=[MinValueValidator(Decimal("0.000000"))],
-    )
-    current_cr = models.DecimalField(
-        max_digits=24,
-        decimal_places=6,
-        null=True,
-        blank=True,
-        validators=[MinValueValidator(Decimal("0.000000"))],
-    )
     journal_entry = models.ForeignKey(
         JournalEntry, related_name="transactions", on_delete=models.CASCADE
     )
+    # Denormalized from journal_entry, kept in sync by the posting path
+    date = models.DateField()
     company = models.ForeignKey(
         Company, on_delete=models.CASCADE, related_name="transactions", null=True
     )
@@ -505,11 +718,25 @@ class Transaction(CompanyBaseModel):
     )
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionQuerySet.as_manager()
+
     def get_amount(self):
         return self.dr_amount - self.cr_amount
 
     def get_balance(self):
-        return zero_for_none(self.current_dr) - zero_for_none(self.current_cr)
+        # current_dr and current_cr are annotated by TransactionQuerySet.with_running_balance
+        return zero_for_none(getattr(self, "current_dr", None)) - zero_for_none(
+            getattr(self, "current_cr", None)
+        )
+
+    def delete(self, *args, **kwargs):
+        with atomic():
+            _record_movements(
+                _transaction_movements(
+                    Transaction.objects.filter(pk=self.pk), sign=-1
+                )
+            )
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return (
@@ -521,191 +748,806 @@ class Transaction(CompanyBaseModel):
             + "]"
         )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["company", "account", "date", "id"],
+                name="ledger_txn_company_acc_date",
+            ),
+            models.Index(fields=["company", "date"], name="ledger_txn_company_date"),
+        ]
 
-def alter(account, date, dr_difference, cr_difference):
-    Transaction.objects.filter(journal_entry__date__gt=date, account=account).update(
-        current_dr=Case(
-            When(current_dr__isnull=True, then=Value(zero_for_none(dr_difference))),
-            default=F("current_dr") + Value(zero_for_none(dr_difference)),
-        ),
-        current_cr=Case(
-            When(current_cr__isnull=True, then=Value(zero_for_none(cr_difference))),
-            default=F("current_cr") + Value(zero_for_none(cr_difference)),
-        ),
+
+class AccountDailyMovement(models.Model):
+    """
+    Debit and credit totals of an account per date and transaction type, maintained by
+    the posting path. Running balances are derived from these instead of being stored
+    on every transaction.
+    """
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="daily_movements"
+    )
+    date = models.DateField()
+    type = models.CharField(
+        choices=TRANSACTION_TYPES, max_length=25, default=TRANSACTION_TYPES[0][0]
+    )
+    dr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    cr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
     )
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="account_daily_movements"
+    )
+
+    def __str__(self):
+        return "{} [{}]".format(self.account, self.date)
 
+    class Meta:
+        unique_together = ("account", "date", "type")
+        indexes = [
+            models.Index(
+                fields=["company", "date"], name="ledger_movement_company_date"
+            ),
+        ]
 
-def set_transactions(submodel, date, *entries, check=True, clear=True):
+
+class AccountPeriodBalance(models.Model):
+    """
+    Debit and credit totals of an account per month and transaction type, split where a
+    fiscal year starts mid-month. Dates outside any fiscal year are kept per day.
+    Totals as of a date are the periods before it plus the daily movements of its period.
     """
 
-    :param date: datetime object
-    :param submodel: source model
-    :param check: boolean - checks for debit/credit mismatch
-    :type clear: object
-    Clears all transactions not accounted here
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="period_balances"
+    )
+    fiscal_year = models.ForeignKey(
+        FiscalYear,
+        on_delete=models.SET_NULL,
+        related_name="account_period_balances",
+        blank=True,
+        null=True,
+    )
+    period_start = models.DateField()
+    type = models.CharField(
+        choices=TRANSACTION_TYPES, max_length=25, default=TRANSACTION_TYPES[0][0]
+    )
+    dr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    cr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="account_period_balances"
+    )
+
+    def __str__(self):
+        return "{} [{}]".format(self.account, self.period_start)
+
+    class Meta:
+        unique_together = ("account", "period_start", "type")
+
+
+class AccountYearOpening(models.Model):
     """
-    # TODO: Security: Validate company. At least make sure all accounts are from the same company. Also validate against the source or submodel company.
+    Debit and credit totals of an account before the start of a fiscal year, so that
+    totals as of a date only add up the periods of its fiscal year. Maintained by the
+    posting path for back-dated changes and rebuilt along with period balances.
+    """
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="year_openings"
+    )
+    fiscal_year = models.ForeignKey(
+        FiscalYear, on_delete=models.CASCADE, related_name="account_openings"
+    )
+    dr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    cr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="account_year_openings"
+    )
+
+    class PermissionsMeta:
+        exclude = True
+
+    def __str__(self):
+        return "{} [{}]".format(self.account, self.fiscal_year)
+
+    class Meta:
+        unique_together = ("account", "fiscal_year")
+
+
+def get_period(date, fiscal_years):
+    """
+    Returns the fiscal year and the start of the period `date` falls in.
+    """
+    for fiscal_year in fiscal_years:
+        if fiscal_year.contains_date(date):
+            return fiscal_year, max(date.replace(day=1), fiscal_year.start_date)
+    return None, date
+
+
+def _get_fiscal_years(dates):
+    return list(
+        FiscalYear.objects.filter(
+            start_date__lte=max(dates), end_date__gte=min(dates)
+        ).order_by("-start_date")
+    )
+
+
+def get_account_total_annotations(date, dr_name, cr_name, date_types=()):
+    """
+    Annotations for Account querysets with the debit and credit totals of transactions
+    before `date` and of transactions of `date_types` on `date`, read from the opening of
+    its fiscal year, the period balances of the year before its period and its daily
+    movements. Totals are None for accounts without any.
+    """
+    date = _to_date(date)
+    fiscal_year, period_start = get_period(date, _get_fiscal_years([date]))
+    zero = Value(
+        Decimal("0"), output_field=models.DecimalField(max_digits=24, decimal_places=6)
+    )
+    periods = AccountPeriodBalance.objects.filter(
+        account_id=OuterRef("id"), period_start__lt=period_start
+    )
+    if fiscal_year:
+        periods = periods.filter(period_start__gte=fiscal_year.start_date)
+    periods = periods.order_by().values("account_id")
+    days = (
+        AccountDailyMovement.objects.filter(account_id=OuterRef("id"))
+        .filter(
+            Q(date__gte=period_start, date__lt=date) | Q(date=date, type__in=date_types)
+        )
+        .order_by()
+        .values("account_id")
+    )
+    annotations = {}
+    for name, field in ((dr_name, "dr_amount"), (cr_name, "cr_amount")):
+        total = Coalesce(
+            Subquery(periods.annotate(total=Sum(field)).values("total")), zero
+        ) + Coalesce(Subquery(days.annotate(total=Sum(field)).values("total")), zero)
+        if fiscal_year:
+            opening = AccountYearOpening.objects.filter(
+                account_id=OuterRef("id"), fiscal_year=fiscal_year
+            ).values(field)[:1]
+            total = total + Coalesce(Subquery(opening), zero)
+        annotations[name] = NullIf(total, zero)
+    return annotations
+
+
+def rebuild_period_balances(company_id=None, start_date=None, end_date=None):
+    """
+    Rebuilds period balances from daily movements, of a company or of all companies.
+    With `start_date` and `end_date`, only the periods of the months between them are
+    rebuilt, along with the openings of fiscal years starting within those months.
+    """
+    conditions = []
+    params = []
+    if company_id:
+        conditions.append("m.company_id = %s")
+        params.append(company_id)
+    if start_date and end_date:
+        # * Periods never span months, so whole months are rebuilt
+        start_date = start_date.replace(day=1)
+        end_date = end_date.replace(day=1) + relativedelta(months=1, days=-1)
+        conditions.append("{} BETWEEN %s AND %s")
+        params += [start_date, end_date]
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM ledger_accountperiodbalance m {}".format(
+                where.format("m.period_start")
+            ),
+            params,
+        )
+        cursor.execute(
+            """
+            INSERT INTO ledger_accountperiodbalance
+                (account_id, company_id, fiscal_year_id, period_start, type, dr_amount, cr_amount)
+            SELECT m.account_id, m.company_id, fy.id,
+                CASE WHEN fy.id IS NULL THEN m.date
+                    ELSE GREATEST(DATE_TRUNC('month', m.date)::date, fy.start_date) END,
+                m.type, SUM(m.dr_amount), SUM(m.cr_amount)
+            FROM ledger_accountdailymovement m
+            LEFT JOIN LATERAL (
+                SELECT id, start_date FROM company_fiscalyear
+                WHERE m.date BETWEEN start_date AND end_date
+                ORDER BY start_date DESC LIMIT 1
+            ) fy ON TRUE
+            {}
+            GROUP BY 1, 2, 3, 4, 5
+            """.format(where.format("m.date")),
+            params,
+        )
+    if start_date and end_date:
+        rebuild_year_openings(
+            company_id,
+            FiscalYear.objects.filter(
+                start_date__range=[start_date, end_date]
+            ).values_list("id", flat=True),
+        )
+    else:
+        rebuild_year_openings(company_id)
+
+
+def rebuild_year_openings(company_id=None, fiscal_year_ids=None):
+    """
+    Rebuilds the openings of every fiscal year, or of `fiscal_year_ids`, from period
+    balances, of a company or of all companies.
+    """
+    conditions = ""
+    params = []
+    if company_id:
+        conditions += " AND p.company_id = %s"
+        params.append(company_id)
+    if fiscal_year_ids is not None:
+        fiscal_year_ids = list(fiscal_year_ids)
+        if not fiscal_year_ids:
+            return
+        conditions += " AND fy.id = ANY(%s)"
+        params.append(fiscal_year_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM ledger_accountyearopening p
+            USING company_fiscalyear fy
+            WHERE fy.id = p.fiscal_year_id {}
+            """.format(conditions),
+            params,
+        )
+        cursor.execute(
+            """
+            INSERT INTO ledger_accountyearopening
+                (account_id, company_id, fiscal_year_id, dr_amount, cr_amount)
+            SELECT p.account_id, p.company_id, fy.id, SUM(p.dr_amount), SUM(p.cr_amount)
+            FROM ledger_accountperiodbalance p
+            JOIN company_fiscalyear fy ON p.period_start < fy.start_date
+            WHERE TRUE {}
+            GROUP BY 1, 2, 3
+            """.format(conditions),
+            params,
+        )
+
+
+def get_account_balance_drift(company_id=None):
+    """
+    Returns the accounts, of a company or of all companies, whose current_dr and
+    current_cr differ from the totals of their transactions, as (account id, company id,
+    name, current_dr, current_cr, transaction dr, transaction cr) tuples.
+    """
+    where = "WHERE a.company_id = %s" if company_id else ""
+    params = [company_id, company_id] if company_id else []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT a.id, a.company_id, a.name, a.current_dr, a.current_cr, t.dr, t.cr
+            FROM ledger_account a
+            LEFT JOIN (
+                SELECT account_id, SUM(dr_amount) AS dr, SUM(cr_amount) AS cr
+                FROM ledger_transaction
+                {}
+                GROUP BY account_id
+            ) t ON t.account_id = a.id
+            {}
+                {} (
+                    COALESCE(a.current_dr, 0) <> COALESCE(t.dr, 0)
+                    OR COALESCE(a.current_cr, 0) <> COALESCE(t.cr, 0)
+                )
+            ORDER BY a.id
+            """.format(
+                "WHERE company_id = %s" if company_id else "",
+                where,
+                "AND" if company_id else "WHERE",
+            ),
+            params,
+        )
+        return cursor.fetchall()
+
+
+def fix_account_balances(account_ids):
+    """
+    Sets current_dr and current_cr of accounts to the totals of their transactions. The
+    accounts are locked first so that postings running alongside are applied after.
+    """
+    with atomic():
+        list(
+            Account.objects.filter(id__in=account_ids)
+            .order_by("id")
+            .select_for_update()
+            .values_list("id", flat=True)
+        )
+        totals = (
+            Transaction.objects.filter(account_id=OuterRef("id"))
+            .order_by()
+            .values("account_id")
+        )
+        zero = Value(
+            Decimal("0"),
+            output_field=models.DecimalField(max_digits=24, decimal_places=6),
+        )
+        return Account.objects.filter(id__in=account_ids).update(
+            **{
+                name: NullIf(
+                    Coalesce(
+                        Subquery(totals.annotate(total=Sum(field)).values("total")),
+                        zero,
+                    ),
+                    zero,
+                )
+                for name, field in (
+                    ("current_dr", "dr_amount"),
+                    ("current_cr", "cr_amount"),
+                )
+            }
+        )
+
+
+def get_balance_checksum_mismatches():
+    """
+    Returns the ids of companies whose account balances do not add up to the totals of
+    their daily movements, a cheap check for balances that drifted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT COALESCE(a.company_id, m.company_id)
+            FROM (
+                SELECT company_id, SUM(current_dr) AS dr, SUM(current_cr) AS cr
+                FROM ledger_account
+                GROUP BY company_id
+            ) a
+            FULL JOIN (
+                SELECT company_id, SUM(dr_amount) AS dr, SUM(cr_amount) AS cr
+                FROM ledger_accountdailymovement
+                GROUP BY company_id
+            ) m ON m.company_id = a.company_id
+            WHERE COALESCE(a.dr, 0) <> COALESCE(m.dr, 0)
+                OR COALESCE(a.cr, 0) <> COALESCE(m.cr, 0)
+            """
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@receiver(pre_save, sender=FiscalYear)
+def _fiscal_year_pre_save(sender, instance, **kwargs):
+    instance._previous_dates = (
+        FiscalYear.objects.filter(pk=instance.pk)
+        .values_list("start_date", "end_date")
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=FiscalYear)
+@receiver(post_delete, sender=FiscalYear)
+def _fiscal_year_change(sender, instance, created=False, **kwargs):
+    # Periods are split at fiscal year boundaries, and openings are kept per fiscal year,
+    # so only the months of the year, before and after the change, are rebuilt
+    dates = [(_to_date(instance.start_date), _to_date(instance.end_date))]
+    previous_dates = getattr(instance, "_previous_dates", None)
+    if kwargs.get("signal") is post_save and not created:
+        if previous_dates == dates[0]:
+            return
+        if previous_dates:
+            dates.append(previous_dates)
+    start_date = min(start for start, _ in dates)
+    end_date = max(end for _, end in dates)
+    task_name = "fiscal-year-balances-{}".format(instance.pk)
+    from django_q.tasks import async_task
+
+    on_commit(
+        lambda: async_task(
+            "apps.ledger.tasks.rebuild_fiscal_year_balances",
+            start_date,
+            end_date,
+            task_name=task_name,
+        )
+    )
+
+
+def _add_movement(movements, key, dr_difference, cr_difference):
+    dr, cr = movements.get(key, (Decimal("0"), Decimal("0")))
+    movements[key] = (dr + dr_difference, cr + cr_difference)
+
+
+def _transaction_movements(transactions, sign=1):
+    """
+    Aggregates `transactions` into movements keyed by (account_id, company_id, date, type).
+    """
+    movements = {}
+    rows = (
+        transactions.order_by()
+        .values("account_id", "account__company_id", "date", "type")
+        .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
+    )
+    for row in rows:
+        _add_movement(
+            movements,
+            (
+                row["account_id"],
+                row["account__company_id"],
+                row["date"],
+                row["type"],
+            ),
+            decimalize(row["dr"]) * sign,
+            decimalize(row["cr"]) * sign,
+        )
+    return movements
+
+
+def _record_movements(movements):
+    """
+    Applies debit/credit differences to the daily movements, period balances, fiscal year
+    openings and balances of accounts with upserts and one UPDATE, however many
+    transactions follow them.
+    Cached category trees of the companies are invalidated once the changes commit.
+
+    :param movements: {(account_id, company_id, date, type): (dr_difference, cr_difference)}
+    """
+    movements = {
+        key: amounts for key, amounts in movements.items() if amounts[0] or amounts[1]
+    }
+    if not movements:
+        return
+    increment_or_create(
+        AccountDailyMovement,
+        ("account", "company", "date", "type"),
+        ("dr_amount", "cr_amount"),
+        movements,
+        conflict_fields=("account", "date", "type"),
+    )
+
+    fiscal_years = _get_fiscal_years([date for _, _, date, _ in movements])
+    period_deltas = {}
+    for (account_id, company_id, date, type), (dr, cr) in movements.items():
+        fiscal_year, period_start = get_period(date, fiscal_years)
+        _add_movement(
+            period_deltas,
+            (
+                account_id,
+                company_id,
+                fiscal_year and fiscal_year.id,
+                period_start,
+                type,
+            ),
+            dr,
+            cr,
+        )
+    increment_or_create(
+        AccountPeriodBalance,
+        ("account", "company", "fiscal_year", "period_start", "type"),
+        ("dr_amount", "cr_amount"),
+        period_deltas,
+        conflict_fields=("account", "period_start", "type"),
+    )
+
+    # * Only back-dated changes move the openings of fiscal years after them
+    later_fiscal_years = list(
+        FiscalYear.objects.filter(
+            start_date__gt=min(date for _, _, date, _ in movements)
+        ).values_list("id", "start_date")
+    )
+    opening_deltas = {}
+    for (account_id, company_id, date, _), (dr, cr) in movements.items():
+        for fiscal_year_id, start_date in later_fiscal_years:
+            if date < start_date:
+                _add_movement(
+                    opening_deltas, (account_id, company_id, fiscal_year_id), dr, cr
+                )
+    increment_or_create(
+        AccountYearOpening,
+        ("account", "company", "fiscal_year"),
+        ("dr_amount", "cr_amount"),
+        opening_deltas,
+        conflict_fields=("account", "fiscal_year"),
+    )
+
+    account_deltas = {}
+    for (account_id, _, _, _), (dr, cr) in movements.items():
+        _add_movement(account_deltas, account_id, dr, cr)
+    Account.objects.filter(id__in=account_deltas.keys()).update(
+        current_dr=NullIf(
+            Coalesce(F("current_dr"), Value(Decimal("0")))
+            + _amount_case(account_deltas, 0, lookup="id"),
+            Value(Decimal("0")),
+        ),
+        current_cr=NullIf(
+            Coalesce(F("current_cr"), Value(Decimal("0")))
+            + _amount_case(account_deltas, 1, lookup="id"),
+            Value(Decimal("0")),
+        ),
+    )
+    company_ids = {company_id for _, company_id, _, _ in movements}
+    on_commit(lambda: invalidate_category_tree(*company_ids))
+
+
+def _to_date(date):
     if isinstance(date, str):
         date = datetime.strptime(date, "%Y-%m-%d")
+    if isinstance(date, datetime):
+        date = date.date()
+    return date
 
-    content_type = ContentType.objects.get_for_model(submodel)
 
-    created = False
-    try:
-        journal_entry = JournalEntry.objects.get(
-            content_type=content_type, object_id=submodel.id
-        )
-    except JournalEntry.DoesNotExist:
+def _amount_case(deltas, index, lookup="account_id"):
+    """
+    Builds a CASE expression picking the `index`th delta for each key of `deltas`,
+    so that per-account differences can be applied with a single UPDATE statement.
+    """
+    return Case(
+        *[
+            When(**{lookup: key}, then=Value(delta[index]))
+            for key, delta in deltas.items()
+        ],
+        default=Value(Decimal("0")),
+        output_field=models.DecimalField(max_digits=24, decimal_places=6),
+    )
+
+
+def _get_or_create_journal_entries(postings):
+    """
+    Resolves journal entries for all sources of `postings` with one query per content type
+    and bulk creates the missing ones.
+    Returns the journal entries in the order of `postings` and the set of
+    (content_type_id, object_id) keys that were created.
+    """
+    keys = []
+    object_ids = {}
+    for submodel, _, _ in postings:
+        content_type = ContentType.objects.get_for_model(submodel)
+        key = (content_type.id, submodel.id)
+        if submodel.id in object_ids.get(content_type.id, ()):
+            raise ValueError(
+                "{} ID: {} appears more than once in the same posting.".format(
+                    str(submodel), submodel.id
+                )
+            )
+        keys.append(key)
+        object_ids.setdefault(content_type.id, []).append(submodel.id)
+
+    journal_entries = {}
+    for content_type_id, ids in object_ids.items():
+        for journal_entry in JournalEntry.objects.filter(
+            content_type_id=content_type_id, object_id__in=ids
+        ):
+            journal_entries[(content_type_id, journal_entry.object_id)] = journal_entry
+
+    new_journal_entries = []
+    created = set()
+    for key, (submodel, date, _) in zip(keys, postings):
+        if key in journal_entries:
+            continue
         if hasattr(submodel, "voucher_id"):
             voucher_id = submodel.voucher_id
             voucher_no = submodel.voucher.voucher_no
         else:
             voucher_id = submodel.id
             voucher_no = submodel.voucher_no
-
         journal_entry = JournalEntry(
-            content_type=content_type,
+            content_type_id=key[0],
             object_id=submodel.id,
             date=date,
             source_voucher_id=voucher_id,
             source_voucher_no=voucher_no,
         )
-        journal_entry.save()
-        created = True
-
-    dr_total = 0
-    cr_total = 0
-    all_accounts = []
-    all_transaction_ids = []
-    for arg in entries:
-        # transaction = Transaction(account=arg[1], dr_amount=arg[2])
-        matches = (
-            journal_entry.transactions.filter(account=arg[1]) if not created else []
-        )
-        # with localcontext() as ctx:
-        #     ctx.rounding = ROUND_HALF_UP
-        #     val = round(decimalize(arg[2]), 2)
-        val = decimalize(str(arg[2]))
-        # val = arg[2]
-        all_accounts.append(arg[1])
-        if not matches:
+        journal_entries[key] = journal_entry
+        new_journal_entries.append(journal_entry)
+        created.add(key)
+
+    JournalEntry.objects.bulk_create(new_journal_entries)
+    return [journal_entries[key] for key in keys], created
+
+
+def set_bulk_transactions(postings, check=True, clear=True):
+    """
+    Set based counterpart of `set_transactions` for posting many sources at once,
+    e.g. all rows of a voucher.
+
+    :param postings: iterable of (submodel, date, entries) where entries are
+        ["dr"/"cr", account, amount] lists as accepted by `set_transactions`
+    :param check: boolean - checks for debit/credit mismatch per submodel
+    :param clear: boolean - clears all transactions of the journal entries not accounted here
+
+    Existing transactions are resolved with a single query, new ones are bulk created and
+    daily movements and account balances are updated with one upsert and one UPDATE.
+    Later transactions are never rewritten as running balances are computed on read.
+    """
+    # TODO: Security: Validate company. At least make sure all accounts are from the same company. Also validate against the source or submodel company.
+    postings = [
+        (submodel, _to_date(date), entries) for submodel, date, entries in postings
+    ]
+    if not postings:
+        return []
+
+    journal_entries, created = _get_or_create_journal_entries(postings)
+
+    existing = {}
+    existing_je_ids = [
+        je.id
+        for je in journal_entries
+        if (je.content_type_id, je.object_id) not in created
+    ]
+    if existing_je_ids:
+        for transaction in (
+            Transaction.objects.filter(journal_entry_id__in=existing_je_ids)
+            .annotate(account_company_id=F("account__company_id"))
+            .order_by("id")
+        ):
+            existing.setdefault(
+                (transaction.journal_entry_id, transaction.account_id), []
+            ).append(transaction)
+
+    new_transactions = []
+    updated_transactions = []
+    # {(account_id, company_id, date, type): (dr_difference, cr_difference)}
+    movements = {}
+
+    for (submodel, date, entries), journal_entry in zip(postings, journal_entries):
+        dr_total = 0
+        cr_total = 0
+        for arg in entries:
             if arg[1] is None:
                 raise ValidationError(
                     "Cannot create {} transaction {} when account does not exist!".format(
                         arg[0], arg[2]
                     )
                 )
-            transaction = Transaction(account=arg[1], company=arg[1].company)
+            val = decimalize(str(arg[2]))
+            account = arg[1]
+            matches = existing.get((journal_entry.id, account.id))
+            if matches:
+                transaction = matches.pop(0)
+                _add_movement(
+                    movements,
+                    (account.id, account.company_id, transaction.date, transaction.type),
+                    decimalize(transaction.dr_amount) * -1,
+                    decimalize(transaction.cr_amount) * -1,
+                )
+                updated_transactions.append(transaction)
+            else:
+                transaction = Transaction(
+                    account=account,
+                    company_id=account.company_id,
+                    journal_entry=journal_entry,
+                )
+                new_transactions.append(transaction)
+            transaction.date = date
             if arg[0] == "dr":
                 transaction.dr_amount = val
                 transaction.cr_amount = None
-                transaction.account.current_dr = none_for_zero(
-                    decimalize(transaction.account.current_dr)
-                    + decimalize(transaction.dr_amount)
-                )
-                alter(arg[1], date, val, 0)
                 dr_total += val
-            if arg[0] == "cr":
+            else:
                 transaction.cr_amount = val
                 transaction.dr_amount = None
-                transaction.account.current_cr = none_for_zero(
-                    decimalize(transaction.account.current_cr)
-                    + decimalize(transaction.cr_amount)
-                )
-                alter(arg[1], date, 0, val)
                 cr_total += val
-
-            transaction.current_dr = none_for_zero(
-                round(
-                    decimalize(
-                        transaction.account.get_dr_amount(date + timedelta(days=1))
-                    )
-                    + decimalize(transaction.dr_amount),
-                    2,
-                )
-            )
-            transaction.current_cr = none_for_zero(
-                round(
-                    decimalize(
-                        transaction.account.get_cr_amount(date + timedelta(days=1))
-                    )
-                    + decimalize(transaction.cr_amount),
-                    2,
-                )
+            _add_movement(
+                movements,
+                (account.id, account.company_id, date, transaction.type),
+                decimalize(transaction.dr_amount),
+                decimalize(transaction.cr_amount),
             )
-        else:
-            transaction = matches[0]
-            transaction.account = arg[1]
 
-            # cancel out existing dr_amount and cr_amount from current_dr and current_cr
-            # if transaction.dr_amount:
-            #     transaction.current_dr -= transaction.dr_amount
-            #     transaction.account.current_dr -= transaction.dr_amount
-            #
-            # if transaction.cr_amount:
-            #     transaction.current_cr -= transaction.cr_amount
-            #     transaction.account.current_cr -= transaction.cr_amount
-
-            # save new dr_amount and add it to current_dr/cr
+        if check and round(dr_total, 2) != round(cr_total, 2):
+            error_msg = "Dr/Cr mismatch from {0}, ID: {1}, Dr: {2}, Cr: {3}".format(
+                str(submodel), submodel.id, dr_total, cr_total
+            )
+            # mail_admins('Dr/Cr mismatch!', error_msg)
+            print(entries)
+            raise RuntimeError(error_msg)
 
-            if arg[0] == "dr":
-                dr_difference = val - decimalize(transaction.dr_amount)
-                cr_difference = decimalize(transaction.cr_amount) * -1
-                alter(
-                    arg[1], transaction.journal_entry.date, dr_difference, cr_difference
+    # if date is updated on source calling set_transactions, update date on JE
+    redated = []
+    for (_, date, _), journal_entry in zip(postings, journal_entries):
+        if journal_entry.date != date:
+            redated.append((journal_entry, date))
+
+    # Transactions of redated journal entries that are kept without being posted again
+    # move to the new date
+    if redated and not clear:
+        new_dates = {journal_entry.id: date for journal_entry, date in redated}
+        for (je_id, account_id), transactions in existing.items():
+            if je_id not in new_dates:
+                continue
+            for transaction in transactions:
+                dr = decimalize(transaction.dr_amount)
+                cr = decimalize(transaction.cr_amount)
+                company_id = transaction.account_company_id
+                _add_movement(
+                    movements,
+                    (account_id, company_id, transaction.date, transaction.type),
+                    dr * -1,
+                    cr * -1,
                 )
-                transaction.dr_amount = val
-                transaction.cr_amount = None
-                dr_total += transaction.dr_amount
-            else:
-                cr_difference = val - decimalize(transaction.cr_amount)
-                dr_difference = decimalize(transaction.dr_amount) * -1
-                alter(
-                    arg[1], transaction.journal_entry.date, dr_difference, cr_difference
+                _add_movement(
+                    movements,
+                    (account_id, company_id, new_dates[je_id], transaction.type),
+                    dr,
+                    cr,
                 )
-                transaction.cr_amount = val
-                transaction.dr_amount = None
-                cr_total += transaction.cr_amount
 
-            transaction.current_dr = none_for_zero(
-                decimalize(transaction.current_dr) + dr_difference
-            )
-            transaction.current_cr = none_for_zero(
-                decimalize(transaction.current_cr) + cr_difference
-            )
-            transaction.account.current_dr = none_for_zero(
-                decimalize(transaction.account.current_dr) + dr_difference
+    with atomic():
+        if updated_transactions:
+            now = timezone.now()
+            for transaction in updated_transactions:
+                transaction.updated_at = now
+            Transaction.objects.bulk_update(
+                updated_transactions, ["dr_amount", "cr_amount", "date", "updated_at"]
             )
-            transaction.account.current_cr = none_for_zero(
-                decimalize(transaction.account.current_cr) + cr_difference
+        Transaction.objects.bulk_create(new_transactions)
+        _record_movements(movements)
+
+        # Obsolete transactions are reverted on the date they were posted on,
+        # hence cleared before journal entries are redated
+        if clear and existing_je_ids:
+            kept_ids = [transaction.id for transaction in updated_transactions]
+            Transaction.objects.filter(journal_entry_id__in=existing_je_ids).exclude(
+                id__in=kept_ids
+            ).delete()
+
+        for journal_entry, date in redated:
+            journal_entry.date = date
+        JournalEntry.objects.bulk_update(
+            [journal_entry for journal_entry, _ in redated], ["date"]
+        )
+        if redated and not clear:
+            Transaction.objects.filter(
+                journal_entry_id__in=[journal_entry.id for journal_entry, _ in redated]
+            ).update(
+                date=Subquery(
+                    JournalEntry.objects.filter(id=OuterRef("journal_entry_id")).values(
+                        "date"
+                    )[:1]
+                )
             )
 
-        # the following code lies outside if,else block, inside for loop
-        transaction.account.save()
-        # new transactions if any are saved into db by following code
-        try:
-            journal_entry.transactions.add(transaction, bulk=False)
-        except TypeError:  # for Django <1.9
-            journal_entry.transactions.add(transaction)
-        all_transaction_ids.append(transaction.id)
+    return journal_entries
 
-    # if date is updated on source calling set_transactions, update date on JE
-    if journal_entry.date != date:
-        journal_entry.date = date
-        journal_entry.save()
 
-    if clear:
-        obsolete_transactions = journal_entry.transactions.exclude(
-            id__in=all_transaction_ids
-        )
-        obsolete_transactions.delete()
-    if check and round(dr_total, 2) != round(cr_total, 2):
-        error_msg = "Dr/Cr mismatch from {0}, ID: {1}, Dr: {2}, Cr: {3}".format(
-            str(submodel), submodel.id, dr_total, cr_total
-        )
-        # mail_admins('Dr/Cr mismatch!', error_msg)
-        print(entries)
-        raise RuntimeError(error_msg)
+def set_transactions(submodel, date, *entries, check=True, clear=True):
+    """
+
+    :param date: datetime object
+    :param submodel: source model
+    :param check: boolean - checks for debit/credit mismatch
+    :type clear: object
+    Clears all transactions not accounted here
+    """
+    set_bulk_transactions([(submodel, date, entries)], check=check, clear=clear)
+
+
+def net_entries(*entry_lists):
+    """
+    Nets ["dr"/"cr", account, amount] entries per account, dropping accounts that cancel out.
+    """
+    nets = {}
+    accounts = {}
+    for entries in entry_lists:
+        for arg in entries:
+            if arg[1] is None:
+                raise ValidationError(
+                    "Cannot create {} transaction {} when account does not exist!".format(
+                        arg[0], arg[2]
+                    )
+                )
+            val = decimalize(str(arg[2]))
+            accounts[arg[1].id] = arg[1]
+            nets[arg[1].id] = nets.get(arg[1].id, Decimal("0")) + (
+                val if arg[0] == "dr" else -val
+            )
+    return [
+        ["dr" if net > 0 else "cr", accounts[account_id], abs(net)]
+        for account_id, net in nets.items()
+        if round(net, 6)
+    ]
 
 
 # @receiver(pre_delete, sender=Transaction)
@@ -781,6 +1623,59 @@ class TransactionModel(models.Model):
             qs = qs.filter(content_type__model=model, object_id=self.id)
         return qs
 
+    def set_voucher_transactions(
+        self, row_postings, extra_entries=None, commission_entries=None
+    ):
+        """
+        Posts the rows of a voucher with a journal entry per row, or netted per account into a
+        single journal entry of the voucher when the company aggregates voucher journal entries.
+        Extra entries are kept on the voucher's journal entry and posted again when the voucher
+        is posted without them.
+        """
+        voucher_journal_entry = JournalEntry.get_for(self)
+        if extra_entries is None:
+            extra_entries = (
+                voucher_journal_entry.get_extra_entries()
+                if voucher_journal_entry
+                else []
+            )
+        row_ids = [row.id for row, _, _ in row_postings]
+        row_journal_entries = (
+            JournalEntry.objects.filter(
+                content_type=ContentType.objects.get_for_model(row_postings[0][0]),
+                object_id__in=row_ids,
+            )
+            if row_postings
+            else JournalEntry.objects.none()
+        )
+
+        aggregates_rows = self.company.aggregate_voucher_journal_entries
+        if aggregates_rows:
+            entries = net_entries(
+                *[entries for _, _, entries in row_postings],
+                extra_entries,
+                commission_entries or [],
+            )
+            row_journal_entries.delete()
+            set_transactions(self, self.date, *entries, clear=True)
+        else:
+            # Voucher posted in the aggregated layout before aggregation was turned off
+            if voucher_journal_entry and voucher_journal_entry.aggregates_rows:
+                voucher_journal_entry.delete()
+            set_bulk_transactions(row_postings, clear=True)
+            entries = [*extra_entries, *(commission_entries or [])]
+            if entries:
+                set_transactions(self, self.date, *entries, clear=True)
+            elif voucher_journal_entry and not voucher_journal_entry.aggregates_rows:
+                voucher_journal_entry.delete()
+
+        JournalEntry.objects.filter(
+            content_type=ContentType.objects.get_for_model(self), object_id=self.id
+        ).update(
+            aggregates_rows=aggregates_rows,
+            extra_entries=JournalEntry.dump_entries(extra_entries),
+        )
+
     def transactions(self):
         app_label = self._meta.app_label
         model = self.__class__.__name__.lower()
@@ -811,6 +1706,7 @@ class TransactionModel(models.Model):
 
 
 set_ledger_transactions = set_transactions
+set_bulk_ledger_transactions = set_bulk_transactions
 
 
 class TransactionCharge(CompanyBaseModel):
@@ -916,8 +1812,12 @@ class AccountOpeningBalance(CompanyBaseModel):
 CLOSING_STATUSES = (
     ("Pending", "Pending"),
     ("Closed", "Closed"),
+    ("Queued", "Queued"),
+    ("Failed", "Failed"),
 )
 
+CLOSING_BATCH_SIZE = 2000
+
 
 class AccountClosing(CompanyBaseModel):
     company = models.ForeignKey(
@@ -934,6 +1834,7 @@ class AccountClosing(CompanyBaseModel):
         blank=True,
         null=True,
     )
+    error = models.TextField(blank=True, null=True)
 
     key = "AccountClosing"
 
@@ -943,97 +1844,142 @@ class AccountClosing(CompanyBaseModel):
     def __str__(self):
         return "{}-{}".format(str(self.company), str(self.fiscal_period))
 
-    def close(self):
-        company = self.company
-        date = self.fiscal_period.end_date
-        pl_account = Account.objects.get(
-            company=company, system_code=acc_system_codes["Profit and Loss Account"]
+    @property
+    def progress_key(self):
+        return "account-closing-progress-{}".format(self.id)
+
+    def get_progress(self):
+        if self.status == "Closed":
+            return 100
+        return cache.get(self.progress_key, 0)
+
+    def set_progress(self, progress):
+        # * Kept in the cache as the closing itself runs in a single transaction
+        cache.set(self.progress_key, progress, timeout=60 * 60)
+
+    def queue_close(self):
+        """
+        Queues closing the accounts in the background, which replaces the closing entry if
+        the year has already been closed.
+        """
+        self.status = "Queued"
+        self.error = None
+        self.save(update_fields=["status", "error"])
+        self.set_progress(0)
+        from django_q.tasks import async_task
+
+        closing_id = self.id
+        on_commit(
+            lambda: async_task(
+                "apps.ledger.tasks.close_accounts",
+                closing_id,
+                task_name="account-closing-{}".format(closing_id),
+            )
         )
 
-        income_category = Category.objects.get(
-            system_code=acc_cat_system_codes["Income"],
-            company=company,
+    def get_closing_balances(self):
+        """
+        Returns the balances of income and expense accounts at the end of the fiscal year
+        with a single aggregate over period balances, which fiscal year ends split.
+        """
+        root_codes = [acc_cat_system_codes["Income"], acc_cat_system_codes["Expenses"]]
+        tree_ids = Category.objects.filter(
+            company_id=self.company_id,
+            system_code__in=root_codes,
             parent__isnull=True,
-        )
-        income_accounts = Account.objects.filter(
-            category__in=income_category.get_descendants(include_self=True)
+        ).values("tree_id")
+        return (
+            AccountPeriodBalance.objects.filter(
+                company_id=self.company_id,
+                period_start__lte=self.fiscal_period.end_date,
+                account__category__tree_id__in=tree_ids,
+            )
+            .order_by()
+            .values_list("account_id")
+            .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
         )
 
-        expenses_category = Category.objects.get(
-            system_code=acc_cat_system_codes["Expenses"],
-            company=company,
-            parent__isnull=True,
-        )
-        expenses_accounts = Account.objects.filter(
-            category__in=expenses_category.get_descendants(include_self=True)
-        )
+    def _remove_journal_entry(self):
+        if self.journal_entry_id:
+            journal_entry = self.journal_entry
+            self.journal_entry = None
+            journal_entry.delete()
 
-        journal_entry = JournalEntry.objects.create(
-            date=date,
-            content_type=ContentType.objects.get_for_model(self),
-            object_id=self.id,
-            type="Closing",
+    def close(self):
+        """
+        Closes income and expense accounts of the fiscal year to the profit and loss
+        account, replacing the closing entry of an earlier closing of the year.
+        """
+        date = self.fiscal_period.end_date
+        pl_account = Account.objects.get(
+            company_id=self.company_id,
+            system_code=acc_system_codes["Profit and Loss Account"],
         )
-        jeid = journal_entry.id
-
-        transactions = []
-
-        total_income_amount = 0
-        for income_account in income_accounts:
-            income_amount = income_account.get_day_closing(until_date=date)
-            # Amount is usually negative for Income
-            income_amount = -1 * income_amount
-            total_income_amount += income_amount
-            # TODO What if amount is positive?
-            if income_amount:
-                transaction = Transaction(
-                    account=income_account,
-                    dr_amount=income_amount,
-                    type="Closing",
-                    journal_entry_id=jeid,
-                    company_id=company.id,
+        with atomic():
+            self._remove_journal_entry()
+            self.set_progress(10)
+            balances = list(self.get_closing_balances())
+            self.set_progress(40)
+
+            journal_entry = JournalEntry.objects.create(
+                date=date,
+                content_type=ContentType.objects.get_for_model(self),
+                object_id=self.id,
+                type="Closing",
+            )
+            transactions = []
+            net = Decimal("0")
+            for account_id, dr, cr in balances:
+                # Income is usually a credit and expense a debit balance, both reversed
+                amount = zero_for_none(dr) - zero_for_none(cr)
+                if not amount:
+                    continue
+                net += amount
+                transactions.append(
+                    Transaction(
+                        account_id=account_id,
+                        dr_amount=-amount if amount < 0 else None,
+                        cr_amount=amount if amount > 0 else None,
+                        type="Closing",
+                        journal_entry=journal_entry,
+                        date=date,
+                        company_id=self.company_id,
+                    )
                 )
-                transactions.append(transaction)
-
-        total_expense_amount = 0
-        for expense_account in expenses_accounts:
-            expense_amount = expense_account.get_day_closing(until_date=date)
-            # Amount is usually positive for Expense
-            # TODO What if amount is negative?
-            total_expense_amount += expense_amount
-
-            if expense_amount:
-                transaction = Transaction(
-                    account=expense_account,
-                    cr_amount=expense_amount,
+            transactions.append(
+                Transaction(
+                    account=pl_account,
+                    dr_amount=net if net > 0 else None,
+                    cr_amount=-net if net < 0 else None,
                     type="Closing",
-                    journal_entry_id=jeid,
-                    company_id=company.id,
+                    journal_entry=journal_entry,
+                    date=date,
+                    company_id=self.company_id,
                 )
-                transactions.append(transaction)
-
-        diff = total_income_amount - total_expense_amount
-
-        if diff > 0:
-            pl_transaction = Transaction(
-                account=pl_account,
-                journal_entry_id=jeid,
-                company_id=company.id,
-                cr_amount=diff,
-                type="Closing",
-            )
-        else:
-            pl_transaction = Transaction(
-                account=pl_account,
-                journal_entry_id=jeid,
-                company_id=company.id,
-                dr_amount=-1 * diff,
-                type="Closing",
             )
+            for start in range(0, len(transactions), CLOSING_BATCH_SIZE):
+                Transaction.objects.bulk_create(
+                    transactions[start : start + CLOSING_BATCH_SIZE]
+                )
+                self.set_progress(
+                    40 + 50 * min(start + CLOSING_BATCH_SIZE, len(transactions))
+                    // len(transactions)
+                )
+            _record_movements(_transaction_movements(journal_entry.transactions.all()))
 
-        transactions.append(pl_transaction)
-
-        Transaction.objects.bulk_create(transactions)
-        self.journal_entry = journal_entry
-        self.status = "Closed"
-        self.save()
+            self.journal_entry = journal_entry
+            self.status = "Closed"
+            self.error = None
+            self.save()
+        self.set_progress(100)
+
+    def reopen(self):
+        """
+        Reopens a closed fiscal year by removing its closing entry.
+        """
+        with atomic():
+            self._remove_journal_entry()
+            self.status = "Pending"
+            self.error = None
+            self.save()
+        cache.delete(self.progress_key)
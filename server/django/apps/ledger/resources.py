@@ -6,7 +6,7 @@ from awecount.libs.resources import PrettyNameModelResource
 
 class TransactionResource(PrettyNameModelResource):
     account = Field(attribute="account__name", column_name="Account")
-    date = Field(attribute="journal_entry__date", column_name="Date")
+    date = Field(attribute="date", column_name="Date")
 
     class Meta:
         model = Transaction
@@ -1,5 +1,6 @@
 from django.contrib.contenttypes.models import ContentType
 from django.db import IntegrityError
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.exceptions import APIException, ValidationError
 
@@ -340,7 +341,15 @@ class AccountDetailSerializer(BaseModelSerializer):
         entries = (
             JournalEntry.objects.filter(transactions__account_id=obj.pk)
             .order_by("pk", "date")
-            .prefetch_related("transactions", "content_type", "transactions__account")
+            .prefetch_related(
+                Prefetch(
+                    "transactions",
+                    queryset=Transaction.objects.filter(account_id=obj.pk)
+                    .select_related("account")
+                    .with_running_balance(),
+                ),
+                "content_type",
+            )
             .select_related()
         )
         return JournalEntrySerializer(entries, context={"account": obj}, many=True).data
@@ -601,8 +610,16 @@ class AggregatorSerializer(serializers.Serializer):
 class AccountClosingSerializer(BaseModelSerializer):
     # fiscal_period = serializers.StringRelatedField()
     company = serializers.StringRelatedField()
+    progress = serializers.SerializerMethodField()
+
+    def get_progress(self, obj):
+        return obj.get_progress()
 
     class Meta:
         model = AccountClosing
-        fields = ["company", "fiscal_period", "status"]
-        extra_kwargs = {"status": {"read_only": True}, "company": {"read_only": True}}
+        fields = ["id", "company", "fiscal_period", "status", "progress", "error"]
+        extra_kwargs = {
+            "status": {"read_only": True},
+            "company": {"read_only": True},
+            "error": {"read_only": True},
+        }
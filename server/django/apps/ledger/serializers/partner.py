@@ -13,7 +13,7 @@ from apps.voucher.serializers.sales import (
     SalesVoucherCreateSerializer,
     SalesVoucherRowSerializer,
 )
-from awecount.libs import decimalize, get_next_voucher_no
+from awecount.libs import decimalize
 from awecount.libs.serializers import (
     DisableCancelEditMixin,
     RoyaltyLedgerInfoSerializer,
@@ -117,9 +117,6 @@ class PartnerJournalVoucherCreateSerializer(
     def create(self, validated_data):
         rows_data = validated_data.pop("rows")
         validated_data["company_id"] = self.context["request"].company.id
-        validated_data["voucher_no"] = get_next_voucher_no(
-            JournalVoucher, self.context["request"].company.id
-        )
         journal_voucher = JournalVoucher.objects.create(**validated_data)
         for _, row in enumerate(rows_data):
             row.pop("account")
@@ -0,0 +1,678 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from rest_framework.exceptions import ValidationError
+from weasyprint import HTML
+
+from apps.ledger.models.base import (
+    _get_fiscal_years,
+    _to_date,
+    get_category_tree,
+    get_period,
+)
+from awecount.libs import none_for_zero, zero_for_none
+
+BALANCE_SHEET_ROOTS = ("A", "L", "Q")
+INCOME_STATEMENT_ROOTS = ("I", "E")
+
+COLUMN_FIELDS = ("opening_dr", "opening_cr", "dr", "cr", "closing_dr", "closing_cr")
+
+STATEMENT_SQL = """
+    WITH movements AS (
+        SELECT account_id, NULL::date AS date, NULL AS type, dr_amount, cr_amount,
+            'opening' AS source, fiscal_year_id
+        FROM ledger_accountyearopening
+        WHERE company_id = %(company_id)s AND fiscal_year_id = ANY(%(fiscal_year_ids)s)
+        UNION ALL
+        SELECT account_id, period_start, type, dr_amount, cr_amount, 'period', NULL
+        FROM ledger_accountperiodbalance
+        WHERE company_id = %(company_id)s AND period_start < %(last_period_start)s
+            {period_filter}
+        UNION ALL
+        SELECT account_id, date, type, dr_amount, cr_amount, 'day', NULL
+        FROM ledger_accountdailymovement
+        WHERE company_id = %(company_id)s
+            AND date >= %(first_period_start)s AND date <= %(last_date)s
+    ),
+    roots AS (
+        SELECT code, tree_id, lft, rght
+        FROM ledger_category
+        WHERE company_id = %(company_id)s AND parent_id IS NULL{root_filter}
+    ),
+    totals AS (
+        SELECT a.id, a.name, a.code, a.category_id, r.code AS root_code,
+            c.tree_id, c.lft, c.rght,
+            {sums}
+        FROM movements m
+        JOIN ledger_account a ON a.id = m.account_id
+        JOIN ledger_category c ON c.id = a.category_id
+        JOIN roots r ON r.tree_id = c.tree_id AND c.lft BETWEEN r.lft AND r.rght
+        GROUP BY a.id, c.id, r.code
+    )
+    SELECT 'account', id, name, code, category_id, root_code, {columns}
+    FROM totals
+    UNION ALL
+    SELECT 'category', p.id, p.name, p.code, p.parent_id, MIN(t.root_code),
+        {category_sums}
+    FROM totals t
+    JOIN ledger_category p ON p.company_id = %(company_id)s AND p.tree_id = t.tree_id
+        AND p.lft <= t.lft AND p.rght >= t.rght
+    GROUP BY p.id
+"""
+
+
+MAX_PERIODS = 36
+
+GRANULARITIES = {
+    "month": relativedelta(months=1),
+    "quarter": relativedelta(months=3),
+    "year": relativedelta(years=1),
+}
+
+
+def split_period(start_date, end_date, granularity):
+    """
+    Splits the period from `start_date` to `end_date` into periods of `granularity`
+    counted from `start_date`, the last one ending at `end_date`.
+    """
+    periods = []
+    step = GRANULARITIES[granularity]
+    index = 0
+    while True:
+        start = start_date + step * index
+        if start > end_date:
+            break
+        index += 1
+        end = start_date + step * index - timedelta(days=1)
+        periods.append((start, min(end, end_date)))
+        if len(periods) > MAX_PERIODS:
+            break
+    return periods
+
+
+def get_periods(request):
+    """
+    Returns the (start_date, end_date) pairs of the statement requested, the period of
+    `start_date` and `end_date`, split by `granularity` if given, followed by
+    comparative periods, each passed as `compare=<start_date>:<end_date>`.
+    """
+    start_date = request.GET.get("start_date")
+    end_date = request.GET.get("end_date")
+    if not start_date or not end_date:
+        return []
+    periods = [(start_date, end_date)]
+    for period in request.GET.getlist("compare"):
+        dates = period.split(":")
+        if len(dates) != 2:
+            raise ValidationError(
+                {"compare": ["Periods must be given as start_date:end_date."]}
+            )
+        periods.append(tuple(dates))
+    try:
+        periods = [(_to_date(start), _to_date(end)) for start, end in periods]
+    except ValueError:
+        raise ValidationError({"detail": "Dates must be in YYYY-MM-DD format."})
+    for start, end in periods:
+        if start > end:
+            raise ValidationError(
+                {"detail": "Start date of a period must not be after its end date."}
+            )
+
+    granularity = request.GET.get("granularity")
+    if granularity:
+        if granularity not in GRANULARITIES:
+            raise ValidationError(
+                {"granularity": ["Must be one of {}.".format(", ".join(GRANULARITIES))]}
+            )
+        periods = split_period(*periods[0], granularity) + periods[1:]
+    if len(periods) > MAX_PERIODS:
+        raise ValidationError(
+            {"detail": "At most {} periods can be compared.".format(MAX_PERIODS)}
+        )
+    return periods
+
+
+def _boundary(name, date, fiscal_year, period_start, types=()):
+    """
+    SQL condition matching the movements before `date` and those of `types` on `date`,
+    the opening of its fiscal year and the periods of the year before its period, or all
+    periods before it outside fiscal years.
+    """
+    if fiscal_year:
+        condition = (
+            "(m.source = 'opening' AND m.fiscal_year_id = %(fy_{name})s) OR "
+            "(m.source = 'period' AND m.date >= %(ys_{name})s "
+            "AND m.date < %(ps_{name})s)"
+        )
+    else:
+        condition = "(m.source = 'period' AND m.date < %(ps_{name})s)"
+    condition += (
+        " OR (m.source = 'day' AND m.date >= %(ps_{name})s AND m.date < %(d_{name})s)"
+    )
+    if types:
+        condition += (
+            " OR (m.source = 'day' AND m.date = %(d_{name})s "
+            "AND m.type = ANY(%(t_{name})s))"
+        )
+    params = {
+        "fy_{}".format(name): fiscal_year and fiscal_year.id,
+        "ys_{}".format(name): fiscal_year and fiscal_year.start_date,
+        "ps_{}".format(name): period_start,
+        "d_{}".format(name): date,
+        "t_{}".format(name): list(types),
+    }
+    return condition.format(name=name), params
+
+
+def get_statement_balances(company_id, periods, root_codes):
+    """
+    Returns the opening and closing totals of accounts under the root categories with
+    `root_codes`, or under all root categories if None, and of those categories and their
+    descendants rolled up, for each of `periods`, from a single query.
+
+    Closings include transactions on the end date other than closing entries, like
+    `get_account_total_annotations`.
+
+    :returns: (accounts, categories), accounts being a list of dicts with `id`, `name`,
+        `code`, `category_id`, `root_code` and `columns`, and categories a dict of
+        category id to a dict with `id`, `name`, `code`, `parent_id`, `root_code` and
+        `columns`. Columns hold COLUMN_FIELDS of each period.
+    """
+    dates = [date for period in periods for date in period]
+    fiscal_years = _get_fiscal_years(dates)
+    params = {"company_id": company_id}
+    root_filter = ""
+    if root_codes is not None:
+        params["root_codes"] = list(root_codes)
+        root_filter = " AND code = ANY(%(root_codes)s)"
+    period_starts = []
+    boundary_fiscal_years = []
+    sums = []
+    columns = []
+    for index, (start_date, end_date) in enumerate(periods):
+        for name, date, types in (
+            ("o{}".format(index), start_date, ()),
+            ("c{}".format(index), end_date, ("Regular",)),
+        ):
+            fiscal_year, period_start = get_period(date, fiscal_years)
+            period_starts.append(period_start)
+            boundary_fiscal_years.append(fiscal_year)
+            condition, boundary_params = _boundary(
+                name, date, fiscal_year, period_start, types
+            )
+            params.update(boundary_params)
+            for field in ("dr", "cr"):
+                column = "{}_{}".format(name, field)
+                sums.append(
+                    "SUM(m.{}_amount) FILTER (WHERE {}) AS {}".format(
+                        field, condition, column
+                    )
+                )
+                columns.append(column)
+    params.update(
+        fiscal_year_ids=[
+            fiscal_year.id for fiscal_year in boundary_fiscal_years if fiscal_year
+        ],
+        first_period_start=min(period_starts),
+        last_period_start=max(period_starts),
+        last_date=max(dates),
+    )
+    # * Periods before the fiscal years of all boundaries are covered by their openings
+    period_filter = ""
+    if all(boundary_fiscal_years):
+        params["first_year_start"] = min(
+            fiscal_year.start_date for fiscal_year in boundary_fiscal_years
+        )
+        period_filter = "AND period_start >= %(first_year_start)s"
+    query = STATEMENT_SQL.format(
+        period_filter=period_filter,
+        root_filter=root_filter,
+        sums=",\n            ".join(sums),
+        columns=", ".join(columns),
+        category_sums=", ".join("SUM(t.{})".format(column) for column in columns),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    accounts = []
+    categories = {}
+    for kind, id, name, code, parent_id, root_code, *amounts in rows:
+        amounts = [zero_for_none(amount) for amount in amounts]
+        row_columns = []
+        for index in range(len(periods)):
+            opening_dr, opening_cr, closing_dr, closing_cr = amounts[
+                index * 4 : index * 4 + 4
+            ]
+            row_columns.append(
+                {
+                    "opening_dr": opening_dr,
+                    "opening_cr": opening_cr,
+                    "dr": closing_dr - opening_dr,
+                    "cr": closing_cr - opening_cr,
+                    "closing_dr": closing_dr,
+                    "closing_cr": closing_cr,
+                }
+            )
+        row = {"id": id, "name": name, "code": code, "root_code": root_code}
+        if kind == "account":
+            row.update(category_id=parent_id, columns=row_columns)
+            accounts.append(row)
+        else:
+            row.update(parent_id=parent_id, columns=row_columns)
+            categories[id] = row
+    return accounts, categories
+
+
+def _empty_columns(periods):
+    return [dict.fromkeys(COLUMN_FIELDS, Decimal("0")) for _ in periods]
+
+
+def build_statement(company_id, periods, root_codes, accounts=None, categories=None):
+    """
+    Returns the category trees under the root categories with `root_codes` with the
+    totals of each category and its accounts per period, from `get_statement_balances`
+    unless its result is passed.
+    """
+    if accounts is None or categories is None:
+        accounts, categories = get_statement_balances(company_id, periods, root_codes)
+    category_accounts = {}
+    for account in accounts:
+        category_accounts.setdefault(account["category_id"], []).append(
+            {
+                "id": account["id"],
+                "name": account["name"],
+                "code": account["code"],
+                "columns": account["columns"],
+            }
+        )
+
+    def build(node, depth=0):
+        totals = categories.get(node["id"])
+        return {
+            "id": node["id"],
+            "name": node["name"],
+            "code": node["code"],
+            "system_code": node["system_code"],
+            "depth": depth,
+            "columns": totals["columns"] if totals else _empty_columns(periods),
+            "accounts": sorted(
+                category_accounts.get(node["id"], []), key=lambda a: a["name"]
+            ),
+            "children": [build(child, depth + 1) for child in node["children"]],
+        }
+
+    return [
+        build(node)
+        for node in get_category_tree(company_id)
+        if node["code"] in root_codes
+    ]
+
+
+def find_root_category(tree, code):
+    for node in tree:
+        if node["code"] == code:
+            return node
+
+
+def get_closing_amounts(columns):
+    """
+    Returns the closing debit and credit of each period, as the `cd` and `cc` the
+    statement views respond with, None when zero.
+    """
+    return [
+        {
+            "cd": none_for_zero(column["closing_dr"]),
+            "cc": none_for_zero(column["closing_cr"]),
+        }
+        for column in columns
+    ]
+
+
+def get_profit_loss(categories, periods):
+    """
+    Returns income less expenses as of the end of each period.
+    """
+    profit_loss = []
+    for index in range(len(periods)):
+        total = Decimal("0")
+        for category in categories.values():
+            if category["parent_id"] is not None:
+                continue
+            column = category["columns"][index]
+            if category["code"] == "I":
+                total += column["closing_cr"] - column["closing_dr"]
+            elif category["code"] == "E":
+                total -= column["closing_dr"] - column["closing_cr"]
+        profit_loss.append(total)
+    return profit_loss
+
+
+STOCK_VALUE_SQL = """
+    WITH RECURSIVE weight_calc AS (
+        SELECT
+            ROW_NUMBER() OVER (PARTITION BY product_transaction.account_id ORDER BY product_journalentry.date, product_transaction.id) AS rn,
+            product_transaction.id AS id,
+            product_journalentry.date AS date,
+            dr_amount,
+            cr_amount,
+            product_transaction.account_id AS account_id,
+            django_content_type.model AS content_type,
+            CASE
+                WHEN dr_amount IS NOT NULL THEN rate
+            END AS entered_rate,
+            COALESCE(dr_amount, cr_amount * -1) AS weight
+        FROM product_transaction
+        JOIN product_inventoryaccount
+            ON product_transaction.account_id = product_inventoryaccount.id
+        JOIN product_journalentry
+            ON product_transaction.journal_entry_id = product_journalentry.id
+        JOIN django_content_type
+            ON product_journalentry.content_type_id = django_content_type.id
+        WHERE
+            product_inventoryaccount.company_id = %(company_id)s
+            AND product_journalentry.date <= %(last_date)s
+    ),
+    running_calcs AS (
+        SELECT
+            *,
+            SUM(weight) OVER (PARTITION BY account_id ORDER BY rn) AS current_balance
+        FROM weight_calc
+    ),
+    final_calc AS (
+        SELECT
+            rn,
+            id,
+            date,
+            account_id,
+            dr_amount,
+            cr_amount,
+            entered_rate,
+            weight,
+            current_balance,
+            CASE
+                WHEN content_type = 'debitnoterow' THEN entered_rate
+                WHEN content_type = 'creditnoterow' THEN 0
+                WHEN dr_amount IS NOT NULL THEN entered_rate
+                ELSE 0
+            END AS calculated_rate
+        FROM running_calcs
+        WHERE rn = 1
+        UNION ALL
+        SELECT
+            rc.rn,
+            rc.id,
+            rc.date,
+            rc.account_id,
+            rc.dr_amount,
+            rc.cr_amount,
+            rc.entered_rate,
+            rc.weight,
+            rc.current_balance,
+            CASE
+                WHEN rc.current_balance <> 0 THEN
+                    (
+                        (fc.calculated_rate * fc.current_balance) +
+                        (
+                            rc.weight *
+                            CASE
+                                WHEN rc.content_type = 'debitnoterow' THEN rc.entered_rate
+                                WHEN rc.content_type = 'creditnoterow' THEN fc.calculated_rate
+                                WHEN rc.dr_amount IS NOT NULL THEN rc.entered_rate
+                                ELSE fc.calculated_rate
+                            END
+                        )
+                    ) / rc.current_balance
+                ELSE 0
+            END AS calculated_rate
+        FROM running_calcs rc
+        JOIN final_calc fc
+            ON rc.rn = fc.rn + 1 AND rc.account_id = fc.account_id
+    ),
+    boundaries AS (
+        SELECT *
+        FROM unnest(%(dates)s::date[], %(inclusive)s::boolean[])
+            WITH ORDINALITY AS b(date, inclusive, position)
+    ),
+    ranked_rows AS (
+        SELECT
+            b.position,
+            fc.current_balance * fc.calculated_rate AS value,
+            ROW_NUMBER() OVER (PARTITION BY b.position, fc.account_id ORDER BY fc.rn DESC) AS row_num
+        FROM boundaries b
+        JOIN final_calc fc
+            ON fc.date < b.date OR (b.inclusive AND fc.date = b.date)
+    )
+    SELECT position, SUM(value)
+    FROM ranked_rows
+    WHERE row_num = 1
+    GROUP BY position
+"""
+
+
+def get_stock_values(company_id, periods):
+    """
+    Returns the opening and closing stock value of each period, at weighted average
+    rates, from a single pass over inventory transactions.
+    """
+    dates = []
+    inclusive = []
+    for start_date, end_date in periods:
+        dates.extend([start_date, end_date])
+        inclusive.extend([False, True])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            STOCK_VALUE_SQL,
+            {
+                "company_id": company_id,
+                "last_date": max(dates),
+                "dates": dates,
+                "inclusive": inclusive,
+            },
+        )
+        values = dict(cursor.fetchall())
+    return [
+        (
+            values.get(index * 2 + 1) or 0,
+            values.get(index * 2 + 2) or 0,
+        )
+        for index in range(len(periods))
+    ]
+
+
+TRIAL_BALANCE_FIELDS = (
+    ("od", "opening_dr"),
+    ("oc", "opening_cr"),
+    ("dr", "dr"),
+    ("cr", "cr"),
+    ("cd", "closing_dr"),
+    ("cc", "closing_cr"),
+)
+TRIAL_BALANCE_HEADERS = (
+    "Opening Dr",
+    "Opening Cr",
+    "Dr",
+    "Cr",
+    "Closing Dr",
+    "Closing Cr",
+)
+
+
+def get_trial_balance(company_id, periods):
+    """
+    Returns accounts with balances or movements in any of `periods`, with their opening,
+    period and closing debit and credit for each as `od`, `oc`, `dr`, `cr`, `cd` and
+    `cc`, None when zero.
+    """
+    accounts, _ = get_statement_balances(company_id, periods, None)
+    rows = []
+    for account in accounts:
+        columns = [
+            {key: none_for_zero(column[field]) for key, field in TRIAL_BALANCE_FIELDS}
+            for column in account["columns"]
+        ]
+        if not any(amount for column in columns for amount in column.values()):
+            continue
+        rows.append(
+            {
+                "id": account["id"],
+                "name": account["name"],
+                "code": account["code"],
+                "category_id": account["category_id"],
+                "columns": columns,
+            }
+        )
+    return sorted(rows, key=lambda row: row["name"])
+
+
+def get_trial_balance_lines(company_id, periods):
+    headers = ["Code", "Name"]
+    for start_date, end_date in periods:
+        for label in TRIAL_BALANCE_HEADERS:
+            headers.append("{} ({} to {})".format(label, start_date, end_date))
+    lines = []
+    totals = [Decimal("0")] * (len(periods) * len(TRIAL_BALANCE_FIELDS))
+    for row in get_trial_balance(company_id, periods):
+        amounts = [
+            round(zero_for_none(column[key]), 2)
+            for column in row["columns"]
+            for key, _ in TRIAL_BALANCE_FIELDS
+        ]
+        totals = [total + amount for total, amount in zip(totals, amounts)]
+        lines.append(
+            {
+                "depth": 0,
+                "is_category": False,
+                "code": row["code"],
+                "name": row["name"],
+                "amounts": amounts,
+            }
+        )
+    lines.append(
+        {
+            "depth": 0,
+            "is_category": True,
+            "code": None,
+            "name": "Total",
+            "amounts": totals,
+        }
+    )
+    return "Trial Balance", headers, lines
+
+
+STATEMENTS = {
+    "balance-sheet": ("Balance Sheet", BALANCE_SHEET_ROOTS),
+    "income-statement": ("Income Statement", INCOME_STATEMENT_ROOTS),
+}
+
+
+def _closing_amounts(columns):
+    amounts = []
+    for column in columns:
+        amounts.extend([round(column["closing_dr"], 2), round(column["closing_cr"], 2)])
+    return amounts
+
+
+def get_statement_lines(company_id, statement, periods):
+    """
+    Returns the title, headers and lines of `statement` for exports, lines being dicts
+    with `depth`, `is_category`, `code`, `name` and `amounts` of each period. Statements
+    list categories followed by their subcategories and accounts with closing amounts.
+    """
+    if statement == "trial-balance":
+        return get_trial_balance_lines(company_id, periods)
+    title, root_codes = STATEMENTS[statement]
+    # Income and expenses are included for the profit/loss of the balance sheet
+    accounts, categories = get_statement_balances(
+        company_id, periods, root_codes + INCOME_STATEMENT_ROOTS
+    )
+    tree = build_statement(company_id, periods, root_codes, accounts, categories)
+    headers = ["Code", "Name"]
+    for start_date, end_date in periods:
+        headers.extend(
+            [
+                "Dr ({} to {})".format(start_date, end_date),
+                "Cr ({} to {})".format(start_date, end_date),
+            ]
+        )
+
+    lines = []
+
+    def add_lines(node):
+        lines.append(
+            {
+                "depth": node["depth"],
+                "is_category": True,
+                "code": node["code"],
+                "name": node["name"],
+                "amounts": _closing_amounts(node["columns"]),
+            }
+        )
+        for child in node["children"]:
+            add_lines(child)
+        for account in node["accounts"]:
+            lines.append(
+                {
+                    "depth": node["depth"] + 1,
+                    "is_category": False,
+                    "code": account["code"],
+                    "name": account["name"],
+                    "amounts": _closing_amounts(account["columns"]),
+                }
+            )
+
+    for node in tree:
+        add_lines(node)
+
+    if statement == "balance-sheet":
+        amounts = []
+        for profit_loss in get_profit_loss(categories, periods):
+            amounts.extend(
+                [
+                    round(max(-profit_loss, 0), 2),
+                    round(max(profit_loss, 0), 2),
+                ]
+            )
+        lines.append(
+            {
+                "depth": 0,
+                "is_category": True,
+                "code": None,
+                "name": "Profit/Loss",
+                "amounts": amounts,
+            }
+        )
+    return title, headers, lines
+
+
+def get_statement_rows(lines):
+    for line in lines:
+        yield [
+            line["code"] or "",
+            "  " * line["depth"] + line["name"],
+            *line["amounts"],
+        ]
+
+
+def statement_pdf_response(filename, company, periods, title, headers, lines):
+    for line in lines:
+        line["indent"] = 4 + line["depth"] * 12
+    html = render_to_string(
+        "financial_statement_pdf.html",
+        {
+            "company": company,
+            "periods": periods,
+            "title": title,
+            "headers": headers,
+            "lines": lines,
+        },
+    )
+    response = HttpResponse(
+        HTML(string=html).write_pdf(), content_type="application/pdf"
+    )
+    response["Content-Disposition"] = 'attachment; filename="{}.pdf"'.format(filename)
+    return response
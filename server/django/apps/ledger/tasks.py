@@ -0,0 +1,58 @@
+from django.db import transaction
+
+from apps.ledger.models import (
+    AccountClosing,
+    fix_account_balances,
+    get_account_balance_drift,
+    get_balance_checksum_mismatches,
+    rebuild_period_balances,
+)
+
+
+def close_accounts(closing_id):
+    """
+    Closes the accounts of a queued account closing. The closing is locked while it runs
+    so that a closing queued twice is only applied once.
+    """
+    with transaction.atomic():
+        closing = (
+            AccountClosing.objects.select_for_update()
+            .select_related("fiscal_period")
+            .filter(id=closing_id, status="Queued")
+            .first()
+        )
+        if not closing:
+            return
+        try:
+            with transaction.atomic():
+                closing.close()
+        except Exception as e:
+            AccountClosing.objects.filter(id=closing_id).update(
+                status="Failed", error=str(e)
+            )
+            closing.set_progress(0)
+
+
+def checksum_account_balances():
+    """
+    Compares the account balances of each company with its daily movements, and
+    recomputes the balances of the accounts that drifted in companies that don't add up.
+    Scheduled to run daily.
+    """
+    fixed = {}
+    for company_id in get_balance_checksum_mismatches():
+        account_ids = [row[0] for row in get_account_balance_drift(company_id)]
+        if account_ids:
+            fixed[str(company_id)] = fix_account_balances(account_ids)
+    # * Kept as the result of the task, for the accounts fixed in each company
+    return fixed
+
+
+def rebuild_fiscal_year_balances(start_date, end_date):
+    """
+    Rebuilds the period balances of the months from `start_date` to `end_date`, and the
+    openings of fiscal years starting within them, after a fiscal year is added, changed
+    or removed.
+    """
+    with transaction.atomic():
+        rebuild_period_balances(start_date=start_date, end_date=end_date)
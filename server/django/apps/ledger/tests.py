@@ -0,0 +1,74 @@
+from datetime import date
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from apps.company.models import Company, FiscalYear
+from apps.ledger.models import (
+    Account,
+    AccountOpeningBalance,
+    Transaction,
+    set_bulk_transactions,
+)
+
+
+class SetBulkTransactionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fiscal_year = FiscalYear.objects.create(
+            name="2081/82", start_date=date(2024, 7, 16), end_date=date(2025, 7, 16)
+        )
+        cls.company = Company.objects.create(
+            name="Posting", current_fiscal_year=cls.fiscal_year
+        )
+        accounts = list(Account.objects.filter(company=cls.company).order_by("id")[:21])
+        cls.counter_account = accounts[0]
+        # Saved without save(), which posts the opening balance itself
+        cls.sources = AccountOpeningBalance.objects.bulk_create(
+            [
+                AccountOpeningBalance(
+                    company=cls.company,
+                    fiscal_year=cls.fiscal_year,
+                    account=account,
+                    opening_dr=100,
+                )
+                for account in accounts[1:]
+            ]
+        )
+        ContentType.objects.get_for_model(AccountOpeningBalance)
+
+    def post(self, sources, amount=100):
+        return set_bulk_transactions(
+            [
+                (
+                    source,
+                    date(2024, 8, 1),
+                    [
+                        ["dr", source.account, amount],
+                        ["cr", self.counter_account, amount],
+                    ],
+                )
+                for source in sources
+            ]
+        )
+
+    def assertConstantQueries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func(self.sources[:1])
+        with self.assertNumQueries(len(context.captured_queries)):
+            func(self.sources[1:])
+
+    def test_posting_queries_do_not_grow_with_sources(self):
+        self.assertConstantQueries(self.post)
+        self.assertEqual(
+            Transaction.objects.filter(company=self.company).count(),
+            len(self.sources) * 2,
+        )
+
+    def test_reposting_queries_do_not_grow_with_sources(self):
+        self.post(self.sources)
+        self.assertConstantQueries(lambda sources: self.post(sources, amount=150))
+        self.counter_account.refresh_from_db()
+        self.assertEqual(self.counter_account.current_cr, 150 * len(self.sources))
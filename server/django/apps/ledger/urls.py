@@ -58,16 +58,31 @@ urlpatterns = [
         ledger.TrialBalanceView.as_view(),
         name="trial-balance",
     ),
+    re_path(
+        r"^api/company/(?P<company_slug>[-\w]+)/trial-balance/export/$",
+        ledger.FinancialStatementExportView.as_view(statement="trial-balance"),
+        name="trial-balance-export",
+    ),
     re_path(
         r"^api/company/(?P<company_slug>[-\w]+)/balance-sheet/$",
         ledger.BalanceSheetView.as_view(),
         name="balance-sheet",
     ),
+    re_path(
+        r"^api/company/(?P<company_slug>[-\w]+)/balance-sheet/export/$",
+        ledger.FinancialStatementExportView.as_view(statement="balance-sheet"),
+        name="balance-sheet-export",
+    ),
     re_path(
         r"^api/company/(?P<company_slug>[-\w]+)/income-statement/$",
         ledger.IncomeStatementView.as_view(),
         name="income-statement",
     ),
+    re_path(
+        r"^api/company/(?P<company_slug>[-\w]+)/income-statement/export/$",
+        ledger.FinancialStatementExportView.as_view(statement="income-statement"),
+        name="income-statement-export",
+    ),
     re_path(
         r"^api/company/(?P<company_slug>[-\w]+)/tax-summary/$",
         ledger.TaxSummaryView.as_view(),
@@ -83,5 +98,10 @@ urlpatterns = [
         ledger.ChartOfAccountsView.as_view(),
         name="chart-of-accounts",
     ),
+    re_path(
+        r"^api/company/(?P<company_slug>[-\w]+)/posting-lag/$",
+        ledger.PostingLagView.as_view(),
+        name="posting-lag",
+    ),
 
 ]
@@ -1194,26 +1194,11 @@ class ItemViewSet(InputChoiceMixin, CRULViewSet):
                     AND U2."date" <= {'%s'}::date
             ), 0) AS "consumption_qty",
             COALESCE((
-                SELECT SUM(
-                    (
-                        CASE
-                            WHEN jsonb_array_length(value) >= 2 THEN
-                                -- Calculate weighted average: quantity * rate / quantity = rate
-                                (value->0)::numeric * (value->1)::numeric / NULLIF((value->0)::numeric, 0)
-                            ELSE 0
-                        END
-                    ) * U0.cr_amount
-                )
-                FROM "product_transaction" U0
+                SELECT SUM(U4."quantity" * U4."rate")
+                FROM "product_lotconsumption" U4
+                INNER JOIN "product_transaction" U0 ON U4."consumer_id" = U0."id"
                 INNER JOIN "product_journalentry" U2 ON U0."journal_entry_id" = U2."id"
-                INNER JOIN "django_content_type" U3 ON U2."content_type_id" = U3."id",
-                jsonb_each(
-                    CASE
-                        WHEN U0.consumption_data = '{{}}'::jsonb THEN '{{"0":[0,0]}}'::jsonb
-                        WHEN U0.consumption_data IS NULL THEN '{{"0":[0,0]}}'::jsonb
-                        ELSE U0.consumption_data
-                    END
-                ) AS j(key, value)
+                INNER JOIN "django_content_type" U3 ON U2."content_type_id" = U3."id"
                 WHERE
                     U0."account_id" = "product_item"."account_id"
                     AND U3."model" = 'inventoryconversionvoucherrow'
@@ -1621,7 +1606,7 @@ class InventoryAccountViewSet(InputChoiceMixin, CRULViewSet):
 
         # Only show 5 because fetching voucher_no is expensive because of GFK, GFK to be cached
         # self.paginator.page_size = 5
-        page = self.paginate_queryset(transactions)
+        page = self.paginate_queryset(transactions.with_running_balance())
         serializer = TransactionEntrySerializer(page, many=True)
         data["transactions"] = self.paginator.get_response_data(serializer.data)
         data["aggregate"] = aggregate
@@ -1,197 +1,166 @@
-from django.core.management.base import BaseCommand
-from django.db.models import F, Func, Sum, Window
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from apps.product.models import Transaction
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, Min, Sum
+
+from apps.product.models import (
+    PINNED_CONSUMERS,
+    LotConsumption,
+    Transaction,
+    replay_fifo,
+)
+from awecount.libs import zero_for_none
+
+
+def _fifo_state(account_id):
+    return (
+        zero_for_none(
+            Transaction.objects.filter(
+                account_id=account_id, fifo_inconsistency_quantity__gt=0
+            )
+            .exclude(journal_entry__content_type__model__in=PINNED_CONSUMERS)
+            .aggregate(quantity=Sum("fifo_inconsistency_quantity"))["quantity"]
+        ),
+        LotConsumption.objects.filter(consumer__account_id=account_id).count(),
+    )
+
+
+def recalculate(account_id, date, dry_run=False):
+    """
+    Replays FIFO of an inventory account from `date` in its own transaction, rolled back
+    on a dry run. Returns the number of replayed transactions, the inconsistent quantity and
+    the number of lot consumptions before and after, and the time taken.
+    """
+    start = time.perf_counter()
+    with transaction.atomic():
+        before = _fifo_state(account_id)
+        count = replay_fifo(account_id, date)
+        after = _fifo_state(account_id)
+        if dry_run:
+            transaction.set_rollback(True)
+    return count, before, after, time.perf_counter() - start
+
+
+def _recalculate(account_id, date, dry_run):
+    # Runs in a worker process, each worker opens a connection of its own on first query
+    return account_id, recalculate(account_id, date, dry_run)
 
 
 class Command(BaseCommand):
-    help = "Recalculate FIFO"
+    help = "Recalculate FIFO of the inventory accounts with inconsistencies"
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--company",
             type=int,
-            help="Company ID",
-            required=True,
+            help="Company ID, defaults to all companies",
         )
 
         parser.add_argument(
             "--item",
             type=int,
-            help="Item ID",
-            required=True,
+            help="Item ID, defaults to all items with FIFO inconsistency",
         )
 
-    def handle(self, *args, **options):
-        base_qs = Transaction.objects.filter(
-            account__company__id=options["company"], account__item__id=options["item"]
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Replay all transactions of the items instead of from the first inconsistent one",
         )
 
-        # * Step 1: Find the first transaction which has FIFO inconsistency
-        first_txn_to_fix = (
-            base_qs.filter(fifo_inconsistency_quantity__gt=0)
-            .exclude(journal_entry__content_type__model="debitnoterow")
-            .order_by("journal_entry__date", "id")
-            .first()
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes, defaults to the number of CPUs",
         )
 
-        if not first_txn_to_fix:
-            print("No FIFO inconsistency to fix")
-            return
-
-        # * Step 2: Find the transactions after the first transaction which has FIFO inconsistency
-        # * This is because, the first transaction which has FIFO inconsistency has probably
-        # * caused the FIFO inconsistency in the transactions after it.
-        # * While doing so, we also exclude the transactions of debit notes, because they are not to be touched
-        txns_to_probably_fix = (
-            base_qs.filter(
-                journal_entry__date__gte=first_txn_to_fix.journal_entry.date,
-                id__gte=first_txn_to_fix.id,
-            )
-            .exclude(journal_entry__content_type__model="debitnoterow")
-            .order_by("journal_entry__date", "id")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the changes without applying them",
         )
 
-        # * Step 3: Find the transactions which have been consumed by the transactions which have or may have FIFO inconsistency
-        # * This is because, we need to replenish the consumed transactions, so that it could be re-evaluated for FIFO consumption
-        txn_ids_to_replenish = (
-            txns_to_probably_fix.annotate(
-                dr_txn_id=Func(F("consumption_data"), function="jsonb_object_keys")
+    def get_accounts(self, options):
+        base_qs = Transaction.objects.all()
+        if options["company"]:
+            base_qs = base_qs.filter(account__company__id=options["company"])
+        if options["item"]:
+            base_qs = base_qs.filter(account__item__id=options["item"])
+
+        if not options["all"]:
+            # * Consumers of debit notes return a specific lot and are not replayed
+            base_qs = base_qs.filter(fifo_inconsistency_quantity__gt=0).exclude(
+                journal_entry__content_type__model__in=PINNED_CONSUMERS
             )
-            .values_list("dr_txn_id", flat=True)
-            .order_by("dr_txn_id")
-            .distinct()
-        )
-
-        txns_to_replenish = base_qs.filter(id__in=list(txn_ids_to_replenish))
-
-        replenished_txns = [
-            txn
-            for txn in txns_to_replenish
-            if not setattr(txn, "remaining_quantity", getattr(txn, "dr_amount"))
-        ]
-
-        # * We can do this and this won't affect the transactions of debit notes
-        # * Because, the transactions of debit notes are not included in the `txns_to_replenish`
-        # * which is because, credit transaction won't have the debit transaction id against
-        # * which debit note is issued, as it's removed while creating the debit note
-        Transaction.objects.bulk_update(replenished_txns, ["remaining_quantity"])
 
-        # * Step 4: Now transaction which have or may have FIFO inconsistency, we need to forcedully declare them inconsistent
-        txns_to_declare_inconsistent = []
-
-        for txn in txns_to_probably_fix:
-            txn.fifo_inconsistency_quantity = txn.cr_amount
-            txn.consumption_data = {}
-            txns_to_declare_inconsistent.append(txn)
-
-        Transaction.objects.bulk_update(
-            txns_to_declare_inconsistent,
-            ["fifo_inconsistency_quantity", "consumption_data"],
+        # * Busiest accounts first so that they don't hold up the end of the run
+        return list(
+            base_qs.order_by()
+            .values_list("account_id", "account__name")
+            .annotate(date=Min("journal_entry__date"), count=Count("id"))
+            .order_by("-count")
         )
 
-        # * Step 5: Now we need to find the transactions which can be consumed and to fix the transactions which have FIFO inconsistency
-        txns_can_be_consumed = (
-            base_qs.filter(cr_amount=None, remaining_quantity__gt=0)
-            .annotate(
-                running=Window(
-                    expression=Sum("remaining_quantity"),
-                    order_by=["journal_entry__date", "id"],
-                )
+    def report(self, index, total, name, result, dry_run):
+        count, before, after, elapsed = result
+        print(
+            "[{}/{}] {}: {}replayed {} transactions in {:.2f}s, inconsistent quantity "
+            "{} -> {}, lot consumptions {} -> {}".format(
+                index,
+                total,
+                name,
+                "would have " if dry_run else "",
+                count,
+                elapsed,
+                before[0],
+                after[0],
+                before[1],
+                after[1],
             )
-            .order_by("journal_entry__date", "id")
-            .only("id", "remaining_quantity")
         )
 
-        if len(txns_can_be_consumed) == 0:
-            print("No transactions to consume")
-            return
-
-        txns_to_fix = (
-            base_qs.filter(fifo_inconsistency_quantity__gt=0)
-            .annotate(
-                running=Window(
-                    expression=Sum("fifo_inconsistency_quantity"),
-                    order_by=["journal_entry__date", "id"],
-                )
-            )
-            .order_by("journal_entry__date", "id")
-            .exclude(journal_entry__content_type__model="debitnoterow")
-        )
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        dry_run = options["dry_run"]
+        accounts = self.get_accounts(options)
+        total = len(accounts)
 
-        if len(txns_to_fix) == 0:
-            print("No transactions to fix")
+        if not total:
+            print("No FIFO inconsistency to fix")
             return
 
-        # * Step 6: Now we need to fulfill the transactions which have FIFO inconsistency
-        # * by consuming the transactions which can be consumed
-
-        total_quantity_to_fulfill = txns_to_fix[len(txns_to_fix) - 1].running
-
-        txns_can_be_consumed_lte = txns_can_be_consumed.filter(
-            running__lte=total_quantity_to_fulfill
-        )
+        names = {account_id: name for account_id, name, date, count in accounts}
+        workers = max(min(options["workers"] or 1, total), 1)
+        print("Recalculating FIFO of {} items with {} workers".format(total, workers))
 
-        if len(txns_can_be_consumed_lte):
-            # * if the cumulative remaining quantity of the transactions is less than the required quantity fetch the next transaction as well
-            # * the last transaction i.e. the one with the highest running (< req_qty)
-            txn_highest = txns_can_be_consumed_lte[len(txns_can_be_consumed_lte) - 1]
-            if txn_highest.running < total_quantity_to_fulfill:
-                tx_next = txns_can_be_consumed.filter(
-                    running__gt=total_quantity_to_fulfill
-                )[:1]
-                if tx_next:
-                    txns_can_be_consumed_lte = txns_can_be_consumed.union(tx_next)
+        if workers == 1:
+            for index, (account_id, name, date, count) in enumerate(accounts, 1):
+                self.report(
+                    index, total, name, recalculate(account_id, date, dry_run), dry_run
+                )
         else:
-            txns_can_be_consumed_lte = txns_can_be_consumed.filter(
-                running__gt=total_quantity_to_fulfill
-            )[:1]
-
-        for txn_to_fix in txns_to_fix:
-            for consumable in txns_can_be_consumed_lte:
-                if (
-                    consumable.remaining_quantity == 0
-                    or txn_to_fix.fifo_inconsistency_quantity == 0
-                ):
-                    continue
-                if (
-                    txn_to_fix.fifo_inconsistency_quantity
-                    < consumable.remaining_quantity
-                ):
-                    txn_to_fix.consumption_data[consumable.id] = [
-                        txn_to_fix.fifo_inconsistency_quantity,
-                        consumable.rate,
-                    ]
-                    consumable.remaining_quantity -= (
-                        txn_to_fix.fifo_inconsistency_quantity
-                    )
-                    txn_to_fix.fifo_inconsistency_quantity = 0
-                elif (
-                    txn_to_fix.fifo_inconsistency_quantity
-                    >= consumable.remaining_quantity
-                ):
-                    txn_to_fix.fifo_inconsistency_quantity -= (
-                        consumable.remaining_quantity
-                    )
-                    txn_to_fix.consumption_data[consumable.id] = [
-                        consumable.remaining_quantity,
-                        consumable.rate,
-                    ]
-                    consumable.remaining_quantity = 0
-
-        Transaction.objects.bulk_update(
-            txns_to_fix,
-            [
-                "remaining_quantity",
-                "consumption_data",
-                "fifo_inconsistency_quantity",
-            ],
-        )
-        Transaction.objects.bulk_update(
-            txns_can_be_consumed_lte,
-            [
-                "remaining_quantity",
-                "consumption_data",
-                "fifo_inconsistency_quantity",
-            ],
+            # * Forked workers must not share the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                futures = [
+                    executor.submit(_recalculate, account_id, date, dry_run)
+                    for account_id, name, date, count in accounts
+                ]
+                for index, future in enumerate(as_completed(futures), 1):
+                    account_id, result = future.result()
+                    self.report(index, total, names[account_id], result, dry_run)
+
+        print(
+            "{} {} items in {:.2f}s".format(
+                "Checked" if dry_run else "Recalculated",
+                total,
+                time.perf_counter() - start,
+            )
         )
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:20
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_merge_20250602_1541'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryDailyMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('dr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('cr_amount', models.DecimalField(decimal_places=6, default=Decimal('0.000000'), max_digits=24)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_movements', to='product.inventoryaccount')),
+            ],
+            options={
+                'unique_together': {('account', 'date')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO product_inventorydailymovement (account_id, date, dr_amount, cr_amount)
+                SELECT t.account_id, je.date,
+                    COALESCE(SUM(t.dr_amount), 0), COALESCE(SUM(t.cr_amount), 0)
+                FROM product_transaction t
+                JOIN product_journalentry je ON je.id = t.journal_entry_id
+                GROUP BY t.account_id, je.date
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='current_balance',
+        ),
+    ]
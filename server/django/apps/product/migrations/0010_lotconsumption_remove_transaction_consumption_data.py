@@ -0,0 +1,59 @@
+# Generated by Django 4.2.20 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_inventorydailymovement_remove_transaction_current_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=6, max_digits=24)),
+                ('rate', models.DecimalField(blank=True, decimal_places=6, max_digits=24, null=True)),
+                ('consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='product.transaction')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='product.transaction')),
+            ],
+            options={
+                'unique_together': {('consumer', 'lot')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO product_lotconsumption (consumer_id, lot_id, quantity, rate)
+                SELECT c.consumer_id, c.lot_id, SUM(c.quantity), MAX(c.rate)
+                FROM (
+                    SELECT t.id AS consumer_id, j.key::bigint AS lot_id,
+                        (j.value->>0)::numeric AS quantity,
+                        NULLIF(NULLIF(j.value->>1, 'None'), '')::numeric AS rate
+                    FROM product_transaction t
+                    CROSS JOIN LATERAL jsonb_each(t.consumption_data) AS j(key, value)
+                    WHERE jsonb_typeof(t.consumption_data) = 'object'
+                        AND j.key ~ '^[0-9]+$'
+                        AND jsonb_typeof(j.value) = 'array'
+                ) c
+                JOIN product_transaction l ON l.id = c.lot_id
+                WHERE c.quantity > 0
+                GROUP BY c.consumer_id, c.lot_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='consumption_data',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['account', 'id'], name='product_txn_open_lots'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('fifo_inconsistency_quantity__gt', 0)), fields=['account', 'id'], name='product_txn_fifo_pending'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from decimal import Decimal
 
 from auditlog.registry import auditlog
@@ -7,9 +7,19 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator
 from django.db import IntegrityError, models, transaction
-from django.db.models import F, Func, JSONField, Q, Sum, Value, Window
-from django.db.models.functions import Cast, Coalesce
-from django.db.models.signals import pre_delete
+from django.db.models import (
+    Case,
+    F,
+    JSONField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -21,10 +31,11 @@ from apps.ledger.models import (
 )
 from apps.ledger.models import Category as AccountCategory
 from apps.ledger.models import Transaction as LedgerTransaction
-from apps.ledger.models import set_transactions as set_ledger_transactions
+from apps.ledger.models import set_bulk_transactions as set_bulk_ledger_transactions
 from apps.tax.models import TaxScheme
 from apps.voucher.base_models import InvoiceModel, InvoiceRowModel
 from awecount.libs import zero_for_none
+from awecount.libs.db import increment_or_create
 from awecount.libs.helpers import jsonify
 
 acc_cat_system_codes = settings.ACCOUNT_CATEGORY_SYSTEM_CODES
@@ -984,6 +995,72 @@ class JournalEntry(models.Model):
         verbose_name_plural = "Inventory Journal Entries"
 
 
+class TransactionQuerySet(models.QuerySet):
+    def with_running_balance(self):
+        """
+        Annotates `current_balance`, the quantity of the account after each transaction,
+        from the daily movements before the transaction's date and the transactions of the
+        same date.
+        """
+        zero = Value(
+            Decimal("0"), output_field=models.DecimalField(max_digits=24, decimal_places=6)
+        )
+        earlier_days = (
+            InventoryDailyMovement.objects.filter(
+                account_id=OuterRef("account_id"),
+                date__lt=OuterRef("journal_entry__date"),
+            )
+            .order_by()
+            .values("account_id")
+            .annotate(total=Sum(F("dr_amount") - F("cr_amount")))
+            .values("total")
+        )
+        same_day = (
+            Transaction.objects.filter(
+                account_id=OuterRef("account_id"),
+                journal_entry__date=OuterRef("journal_entry__date"),
+                id__lte=OuterRef("id"),
+            )
+            .order_by()
+            .values("account_id")
+            .annotate(
+                total=Sum(Coalesce("dr_amount", zero) - Coalesce("cr_amount", zero))
+            )
+            .values("total")
+        )
+        return self.annotate(
+            current_balance=Coalesce(Subquery(earlier_days), zero)
+            + Coalesce(Subquery(same_day), zero)
+        )
+
+    def update(self, **kwargs):
+        account = kwargs.get("account", kwargs.get("account_id"))
+        if account is None or hasattr(account, "resolve_expression"):
+            return super().update(**kwargs)
+
+        # Transactions moved to another account take their movements along,
+        # current_balance of the accounts is left to the caller
+        account_id = getattr(account, "id", account)
+        with transaction.atomic():
+            movements = {}
+            for row in (
+                self.order_by()
+                .values("account_id", "journal_entry__date")
+                .annotate(dr=Sum("dr_amount"), cr=Sum("cr_amount"))
+            ):
+                dr = zero_for_none(row["dr"])
+                cr = zero_for_none(row["cr"])
+                for key, sign in (
+                    ((row["account_id"], row["journal_entry__date"]), -1),
+                    ((account_id, row["journal_entry__date"]), 1),
+                ):
+                    old_dr, old_cr = movements.get(key, (0, 0))
+                    movements[key] = (old_dr + dr * sign, old_cr + cr * sign)
+            rows = super().update(**kwargs)
+            record_inventory_movements(movements)
+        return rows
+
+
 class Transaction(models.Model):
     account = models.ForeignKey(
         InventoryAccount,
@@ -1004,13 +1081,6 @@ class Transaction(models.Model):
         blank=True,
         validators=[MinValueValidator(Decimal("0.000000"))],
     )
-    current_balance = models.DecimalField(
-        max_digits=24,
-        decimal_places=6,
-        null=True,
-        blank=True,
-        validators=[MinValueValidator(Decimal("0.000000"))],
-    )
     journal_entry = models.ForeignKey(
         JournalEntry, related_name="transactions", on_delete=models.CASCADE
     )
@@ -1035,7 +1105,8 @@ class Transaction(models.Model):
         blank=True,
         validators=[MinValueValidator(Decimal("0.000000"))],
     )  # This is the quantity that is not accounted for in the fifo, or say which is not consumed
-    consumption_data = models.JSONField(blank=True, default=dict)
+
+    objects = TransactionQuerySet.as_manager()
 
     def __str__(self):
         return (
@@ -1070,29 +1141,70 @@ class Transaction(models.Model):
     def get_balance(self):
         return zero_for_none(self.dr_amount) - zero_for_none(self.cr_amount)
 
+    class Meta:
+        indexes = [
+            # Open lots and consumers short of quantity of an account are the starting
+            # state of a FIFO replay, only a small part of the transactions
+            models.Index(
+                fields=["account", "id"],
+                condition=Q(remaining_quantity__gt=0),
+                name="product_txn_open_lots",
+            ),
+            models.Index(
+                fields=["account", "id"],
+                condition=Q(fifo_inconsistency_quantity__gt=0),
+                name="product_txn_fifo_pending",
+            ),
+        ]
 
-def alter(account, date, diff):
-    Transaction.objects.filter(journal_entry__date__gt=date, account=account).update(
-        current_balance=(
-            Coalesce(F("current_balance"), Value(Decimal("0.000000")))
-            + Value(zero_for_none(diff))
-        )
+
+class InventoryDailyMovement(models.Model):
+    """
+    Quantities in and out of an inventory account per date, maintained by the posting path.
+    Running balances are derived from these instead of being stored on every transaction.
+    """
+
+    account = models.ForeignKey(
+        InventoryAccount, on_delete=models.CASCADE, related_name="daily_movements"
+    )
+    date = models.DateField()
+    dr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
+    )
+    cr_amount = models.DecimalField(
+        max_digits=24, decimal_places=6, default=Decimal("0.000000")
     )
 
+    def __str__(self):
+        return "{} [{}]".format(self.account, self.date)
 
-@receiver(pre_delete, sender=Transaction)
-def _transaction_delete(sender, instance, **kwargs):
-    transaction = instance
-    if transaction.dr_amount:
-        transaction.account.current_balance -= transaction.dr_amount
+    class Meta:
+        unique_together = ("account", "date")
 
-    if transaction.cr_amount:
-        transaction.account.current_balance += transaction.cr_amount
 
-    diff = zero_for_none(transaction.dr_amount) - zero_for_none(transaction.cr_amount)
-    alter(transaction.account, transaction.journal_entry.date, diff)
+def record_inventory_movements(movements):
+    """
+    :param movements: {(account_id, date): (dr_difference, cr_difference)}
+    """
+    increment_or_create(
+        InventoryDailyMovement,
+        ("account", "date"),
+        ("dr_amount", "cr_amount"),
+        {key: amounts for key, amounts in movements.items() if amounts[0] or amounts[1]},
+        conflict_fields=("account", "date"),
+    )
 
-    transaction.account.save()
+
+@receiver(pre_delete, sender=Transaction)
+def _transaction_balance_delete(sender, instance, **kwargs):
+    dr_amount = zero_for_none(instance.dr_amount)
+    cr_amount = zero_for_none(instance.cr_amount)
+    InventoryAccount.objects.filter(id=instance.account_id).update(
+        current_balance=F("current_balance") - dr_amount + cr_amount
+    )
+    record_inventory_movements(
+        {(instance.account_id, instance.journal_entry.date): (-dr_amount, -cr_amount)}
+    )
 
 
 def find_obsolete_transactions(model, date, *args):
@@ -1124,11 +1236,165 @@ def find_obsolete_transactions(model, date, *args):
         obsolete_transactions.delete()
 
 
-def fifo_avg(consumption_data, required_quantity):
-    # sort consumption data by key
-    consumption_data = OrderedDict(
-        sorted(consumption_data.items(), key=lambda x: int(x[0]))
+class LotConsumption(models.Model):
+    """
+    Quantity of a lot, a debit transaction of an inventory account, consumed by a credit
+    transaction of the same account at the rate of the lot. Maintained by `replay_fifo`.
+    """
+
+    consumer = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name="lot_consumptions"
     )
+    lot = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name="consumptions"
+    )
+    quantity = models.DecimalField(max_digits=24, decimal_places=6)
+    rate = models.DecimalField(max_digits=24, decimal_places=6, null=True, blank=True)
+
+    def __str__(self):
+        return "{} <- {} [{}]".format(self.consumer_id, self.lot_id, self.quantity)
+
+    class Meta:
+        unique_together = ("consumer", "lot")
+
+
+# Sources whose credit transactions return quantity of the lot they are issued against
+# instead of consuming in FIFO order, replays keep their consumptions
+PINNED_CONSUMERS = ["debitnoterow"]
+
+
+def _fifo_transactions(queryset):
+    return (
+        queryset.annotate(source_model=F("journal_entry__content_type__model"))
+        .order_by("journal_entry__date", "id")
+        .only(
+            "id",
+            "account_id",
+            "dr_amount",
+            "cr_amount",
+            "rate",
+            "remaining_quantity",
+            "fifo_inconsistency_quantity",
+        )
+    )
+
+
+def _allocate(open_lots, pending, consumptions):
+    # Matches the oldest open lots with the oldest consumers short of quantity
+    while open_lots and pending:
+        lot = open_lots[0]
+        consumer = pending[0]
+        quantity = min(lot.remaining_quantity, consumer.fifo_inconsistency_quantity)
+        key = (consumer.id, lot.id, lot.rate)
+        consumptions[key] = (consumptions.get(key, (0,))[0] + quantity,)
+        lot.remaining_quantity -= quantity
+        consumer.fifo_inconsistency_quantity -= quantity
+        if not lot.remaining_quantity:
+            open_lots.popleft()
+        if not consumer.fifo_inconsistency_quantity:
+            pending.popleft()
+
+
+def replay_fifo(account_id, date):
+    """
+    Re-runs FIFO consumption of an inventory account from `date`.
+
+    Consumptions involving transactions on or after `date` are released, the lots left open
+    and the consumers left short before `date` are restored from them, and the transactions
+    from `date` are replayed in (date, id) order. A lot first fills consumers posted while
+    the account was out of stock, whatever remains is left open for later consumers.
+    Consumers short of quantity at the end keep it as their fifo_inconsistency_quantity.
+    """
+    transactions = Transaction.objects.filter(account_id=account_id)
+    with transaction.atomic():
+        suffix = list(
+            _fifo_transactions(transactions.filter(journal_entry__date__gte=date))
+        )
+
+        consumptions = LotConsumption.objects.filter(
+            Q(consumer__account_id=account_id, consumer__journal_entry__date__gte=date)
+            | Q(lot__account_id=account_id, lot__journal_entry__date__gte=date)
+        )
+        pinned = {}
+        released_lots = {}
+        released_consumers = {}
+        for consumer_id, lot_id, quantity, source_model in consumptions.values_list(
+            "consumer_id",
+            "lot_id",
+            "quantity",
+            "consumer__journal_entry__content_type__model",
+        ):
+            if source_model in PINNED_CONSUMERS:
+                pinned[lot_id] = pinned.get(lot_id, 0) + quantity
+            else:
+                released_lots[lot_id] = released_lots.get(lot_id, 0) + quantity
+                released_consumers[consumer_id] = (
+                    released_consumers.get(consumer_id, 0) + quantity
+                )
+        consumptions.exclude(
+            consumer__journal_entry__content_type__model__in=PINNED_CONSUMERS
+        ).delete()
+
+        prefix = _fifo_transactions(transactions.filter(journal_entry__date__lt=date))
+        open_lots = deque(
+            prefix.filter(
+                Q(remaining_quantity__gt=0) | Q(id__in=list(released_lots)),
+                dr_amount__gt=0,
+            )
+        )
+        for lot in open_lots:
+            lot.remaining_quantity = zero_for_none(
+                lot.remaining_quantity
+            ) + released_lots.get(lot.id, 0)
+        pending = deque(
+            prefix.filter(
+                Q(fifo_inconsistency_quantity__gt=0)
+                | Q(id__in=list(released_consumers)),
+                cr_amount__gt=0,
+            ).exclude(journal_entry__content_type__model__in=PINNED_CONSUMERS)
+        )
+        for consumer in pending:
+            consumer.fifo_inconsistency_quantity = zero_for_none(
+                consumer.fifo_inconsistency_quantity
+            ) + released_consumers.get(consumer.id, 0)
+
+        updated_txns = [*open_lots, *pending]
+        new_consumptions = {}
+        _allocate(open_lots, pending, new_consumptions)
+
+        for txn in suffix:
+            if txn.dr_amount:
+                txn.remaining_quantity = max(txn.dr_amount - pinned.get(txn.id, 0), 0)
+                if txn.remaining_quantity:
+                    open_lots.append(txn)
+            elif txn.cr_amount and txn.source_model not in PINNED_CONSUMERS:
+                txn.fifo_inconsistency_quantity = txn.cr_amount
+                pending.append(txn)
+            else:
+                continue
+            updated_txns.append(txn)
+            _allocate(open_lots, pending, new_consumptions)
+
+        Transaction.objects.bulk_update(
+            updated_txns,
+            ["remaining_quantity", "fifo_inconsistency_quantity"],
+            batch_size=1000,
+        )
+        increment_or_create(
+            LotConsumption,
+            ("consumer", "lot", "rate"),
+            ("quantity",),
+            new_consumptions,
+            conflict_fields=("consumer", "lot"),
+        )
+    return len(suffix)
+
+
+def fifo_avg(consumptions, required_quantity):
+    """
+    :param consumptions: (quantity, rate) of the lots consumed, in the order of consumption
+    """
+    consumptions = list(consumptions)
     cumulative_quantity = Decimal("0")
     cumulative_rate = Decimal("0")
 
@@ -1136,18 +1402,17 @@ def fifo_avg(consumption_data, required_quantity):
     # if the required quantity is more than the total quantity,
     # we'll calculate the average rate for the total quantity
     required_quantity = min(
-        required_quantity, sum([Decimal(x[0]) for x in consumption_data.values()])
+        required_quantity, sum([quantity for quantity, rate in consumptions], Decimal("0"))
     )
 
-    for quantity, rate in consumption_data.values():
-        _quantity = Decimal(quantity)
-        _rate = Decimal(rate)
-        if cumulative_quantity + _quantity <= required_quantity:
-            cumulative_quantity += _quantity
-            cumulative_rate += _quantity * _rate
+    for quantity, rate in consumptions:
+        rate = zero_for_none(rate)
+        if cumulative_quantity + quantity <= required_quantity:
+            cumulative_quantity += quantity
+            cumulative_rate += quantity * rate
         else:
             remaining_quantity = required_quantity - cumulative_quantity
-            cumulative_rate += remaining_quantity * _rate
+            cumulative_rate += remaining_quantity * rate
             break
     # TODO: temp fix for 0 required_quantity
     return cumulative_rate / (required_quantity or 1)
@@ -1182,6 +1447,8 @@ def set_inventory_transactions(model, date, *args, clear=True):
         created = True
 
     all_transaction_ids = []
+    # earliest date to replay FIFO from, per account
+    replay_dates = {}
 
     for arg in args:
         matches = (
@@ -1198,228 +1465,46 @@ def set_inventory_transactions(model, date, *args, clear=True):
             diff = zero_for_none(transaction.cr_amount) - zero_for_none(
                 transaction.dr_amount
             )
+        previous_dr = zero_for_none(transaction.dr_amount)
+        previous_cr = zero_for_none(transaction.cr_amount)
+        pinned_lot = None
         if arg[0] in ["dr", "ob"]:
             transaction.cr_amount = None
             transaction.dr_amount = arg[2]
             transaction.remaining_quantity = arg[2]
+            transaction.fifo_inconsistency_quantity = None
             diff += arg[2]
 
-            # check if a transaction with later date has been created
-            # if yes, then we'll recalculate the fifo for all transactions referencing transaction after this date
-            future_dr_transactions = Transaction.objects.filter(
-                account=arg[1],
-                journal_entry__date__gt=date,
-                dr_amount__gt=0,
-            ).values_list("id", flat=True)
-
-            future_dr_transactions = list(future_dr_transactions)
-
-            # if the transaction is already created, then we'll add it to the list
-            if transaction.id:
-                future_dr_transactions.append(transaction.id)
-
-            updated_txns = []
-
-            dr_txns = {
-                txn.id: txn
-                for txn in Transaction.objects.filter(id__in=future_dr_transactions)
-            }
-
-            for txn in Transaction.objects.filter(
-                consumption_data__has_any_keys=future_dr_transactions
-            ):
-                txn.fifo_inconsistency_quantity = zero_for_none(
-                    txn.fifo_inconsistency_quantity
-                )
-
-                for key, value in list(txn.consumption_data.items()):
-                    if dr_txn := dr_txns.get(int(key), None):
-                        dr_txn.remaining_quantity += Decimal(value[0])
-                        updated_txns.append(dr_txn)
-                        txn.fifo_inconsistency_quantity += Decimal(value[0])
-                        txn.consumption_data.pop(key)
-
-                updated_txns.append(txn)
-
-            Transaction.objects.bulk_update(
-                updated_txns,
-                [
-                    "fifo_inconsistency_quantity",
-                    "consumption_data",
-                    "remaining_quantity",
-                ],
-            )
-
-            # check if the transaction is for Credit Note. If yes, then find the corresponding sales voucher row and transaction
+            # check if the transaction is for Credit Note. If yes, then the returned quantity
+            # is valued at the cost of the lots consumed by the corresponding sales voucher row
             if content_type.model == "creditnoterow":
                 t = Transaction.objects.get(
                     journal_entry__object_id=model.sales_row_data["id"],
                     journal_entry__content_type__model="salesvoucherrow",
                 )
-                arg[3] = fifo_avg(t.consumption_data, arg[2])
+                arg[3] = fifo_avg(
+                    t.lot_consumptions.order_by(
+                        "lot__journal_entry__date", "lot_id"
+                    ).values_list("quantity", "rate"),
+                    arg[2],
+                )
 
         elif arg[0] == "cr":
-            transaction.consumption_data = transaction.consumption_data or {}
             transaction.cr_amount = arg[2]
             transaction.dr_amount = None
+            transaction.remaining_quantity = None
+            # consumed by the replay below
+            transaction.fifo_inconsistency_quantity = arg[2]
             diff -= arg[2]
 
-            # check first if the transaction is for Debit Note, as it requires different handling
+            # Debit Notes return quantity of the corresponding purchase voucher row's lot
+            # instead of consuming in FIFO order
             if content_type.model == "debitnoterow":
-                # find the corresponding purchase voucher row and transaction
-
-                t = Transaction.objects.get(
+                pinned_lot = Transaction.objects.select_related("journal_entry").get(
                     journal_entry__object_id=model.purchase_row_data["id"],
                     journal_entry__content_type__model="purchasevoucherrow",
                 )
-                t.remaining_quantity = t.dr_amount - arg[2]
-                t.save()
-
-                # here we assume that all transaction referencing this transaction has been affetcted and
-                # we'll recalulate the fifo for all of them
-                (
-                    Transaction.objects.filter(
-                        consumption_data__has_key=str(t.id)
-                    ).update(
-                        fifo_inconsistency_quantity=(
-                            Coalesce(F("fifo_inconsistency_quantity"), 0)
-                            + Cast(
-                                F(f"consumption_data__{t.id}__0"),
-                                models.DecimalField(max_digits=24, decimal_places=6),
-                            )
-                        ),
-                        consumption_data=F("consumption_data") - str(t.id),
-                    ),
-                )
-
-                transaction.consumption_data[t.id] = [
-                    str(arg[2]),
-                    str(t.rate),
-                ]
-
-            else:
-                if Transaction.objects.filter(
-                    account=arg[1], cr_amount__gt=0, fifo_inconsistency_quantity__gt=0
-                ).exists():
-                    transaction.fifo_inconsistency_quantity = arg[2]
-                else:
-                    # check if transaction is for back date; if so, then will have to declare all credit transactions as fifo_inconsistency_quantity, and put the used quantity back to the respective dr transactions
-                    future_transactions = Transaction.objects.filter(
-                        account=arg[1], journal_entry__date__gt=date, cr_amount__gt=0
-                    )
-
-                    dr_ids = (
-                        future_transactions.annotate(
-                            keys=Func(
-                                F("consumption_data"), function="jsonb_object_keys"
-                            )
-                        )
-                        .values_list("keys", flat=True)
-                        .distinct()
-                    )
-
-                    dr_ids = list(dr_ids)
-
-                    if transaction.id:
-                        dr_ids.extend(
-                            [
-                                key
-                                for key in transaction.consumption_data.keys()
-                                if key not in dr_ids
-                            ]
-                        )
-
-                    dr_txns = {
-                        txn.id: txn for txn in Transaction.objects.filter(id__in=dr_ids)
-                    }
-
-                    updated_txns = []
-
-                    for txn in future_transactions:
-                        txn.fifo_inconsistency_quantity = txn.cr_amount
-                        for key, value in txn.consumption_data.items():
-                            dr_txn = dr_txns[int(key)]
-                            dr_txn.remaining_quantity += Decimal(value[0])
-                            updated_txns.append(dr_txn)
-                        txn.consumption_data = {}
-                        updated_txns.append(txn)
-
-                    Transaction.objects.bulk_update(
-                        updated_txns,
-                        [
-                            "fifo_inconsistency_quantity",
-                            "consumption_data",
-                            "remaining_quantity",
-                        ],
-                    )
-
-                    # Consumption data
-                    req_qty = arg[2]
-
-                    base_txn_qs = (
-                        Transaction.objects.filter(
-                            account=arg[1], cr_amount=None, remaining_quantity__gt=0
-                        )
-                        .annotate(
-                            running=Window(
-                                expression=Sum("remaining_quantity"),
-                                order_by=["journal_entry__date", "id"],
-                            )
-                        )
-                        .order_by("journal_entry__date", "id")
-                        .only("id", "remaining_quantity")
-                    )
-
-                    txn_qs = base_txn_qs.filter(running__lte=req_qty)
-                    count = len(txn_qs)
-                    if count:
-                        updated_txns = []
-
-                        # if the cumulative remaining quantity of the transactions is less than the required quantity fetch the next transaction as well
-
-                        # the last transaction i.e. the one with the highest running (< req_qty)
-                        txn_highest = txn_qs[count - 1]
-
-                        if txn_highest.running < req_qty:
-                            tx_next = base_txn_qs.filter(running__gt=req_qty).first()
-                            req_qty -= txn_highest.running
-                            if tx_next:
-                                tx_next.remaining_quantity -= req_qty
-                                updated_txns.append(tx_next)
-                                transaction.consumption_data[tx_next.id] = [
-                                    str(req_qty),
-                                    str(tx_next.rate),
-                                ]
-                            else:
-                                transaction.fifo_inconsistency_quantity = req_qty
-
-                        for txn in txn_qs:
-                            transaction.consumption_data[txn.id] = [
-                                str(txn.remaining_quantity),
-                                str(txn.rate),
-                            ]
-
-                        updated_txns += [
-                            txn
-                            for txn in txn_qs
-                            if not setattr(txn, "remaining_quantity", 0)
-                        ]
-
-                        Transaction.objects.bulk_update(
-                            updated_txns, ["remaining_quantity"]
-                        )
-
-                    else:  # possibly the required quantity is lesser than any cumulative remaining quantity
-                        tx_next = base_txn_qs.filter(running__gt=req_qty).first()
-                        if tx_next:
-                            tx_next.remaining_quantity -= req_qty
-                            tx_next.save()
-                            transaction.consumption_data[tx_next.id] = [
-                                str(req_qty),
-                                str(tx_next.rate),
-                            ]
-                        else:
-                            transaction.fifo_inconsistency_quantity = req_qty
+                transaction.fifo_inconsistency_quantity = 0
         else:
             raise Exception('Transactions can only be either "dr" or "cr".')
         transaction.account = arg[1]
@@ -1428,13 +1513,36 @@ def set_inventory_transactions(model, date, *args, clear=True):
                 transaction.account.current_balance
             )
         transaction.account.current_balance += diff
-        transaction.current_balance = transaction.account.current_balance
         transaction.rate = arg[3]
-        transaction.account.save()
+        InventoryAccount.objects.filter(id=transaction.account_id).update(
+            current_balance=F("current_balance") + diff
+        )
         journal_entry.transactions.add(transaction, bulk=False)
-        alter(transaction.account, date, diff)
+        record_inventory_movements(
+            {
+                (transaction.account_id, journal_entry.date): (
+                    zero_for_none(transaction.dr_amount) - previous_dr,
+                    zero_for_none(transaction.cr_amount) - previous_cr,
+                )
+            }
+        )
         all_transaction_ids.append(transaction.id)
 
+        replay_date = journal_entry.date
+        if pinned_lot:
+            LotConsumption.objects.filter(consumer=transaction).delete()
+            LotConsumption.objects.create(
+                consumer=transaction,
+                lot=pinned_lot,
+                quantity=arg[2],
+                rate=pinned_lot.rate,
+            )
+            # the lot's remaining quantity is reduced from its own date
+            replay_date = min(replay_date, pinned_lot.journal_entry.date)
+        replay_dates[transaction.account_id] = min(
+            replay_dates.get(transaction.account_id, replay_date), replay_date
+        )
+
     if clear:
         obsolete_transactions = journal_entry.transactions.exclude(
             id__in=all_transaction_ids
@@ -1442,6 +1550,106 @@ def set_inventory_transactions(model, date, *args, clear=True):
         if obsolete_transactions.count():
             obsolete_transactions.delete()
 
+    for account_id, replay_date in replay_dates.items():
+        replay_fifo(account_id, replay_date)
+
+
+def set_bulk_inventory_transactions(postings):
+    """
+    Set based counterpart of `set_inventory_transactions` for sources that have not been
+    posted yet, e.g. the rows of vouchers created in bulk.
+
+    :param postings: iterable of (submodel, date, entries) where entries are
+        ["dr"/"ob"/"cr", account, quantity, rate] lists as accepted by
+        `set_inventory_transactions`; credit and debit note rows are not supported
+
+    Journal entries and transactions are bulk created, balances and daily movements of the
+    accounts are updated with one statement each and FIFO is replayed once per account from
+    the earliest date posted to it.
+    """
+    postings = [
+        (submodel, date, [entry for entry in entries if entry is not None])
+        for submodel, date, entries in postings
+    ]
+    if not postings:
+        return []
+
+    journal_entries = []
+    for submodel, date, entries in postings:
+        content_type = ContentType.objects.get_for_model(submodel)
+        if content_type.model in ["creditnoterow", *PINNED_CONSUMERS]:
+            raise ValueError(
+                "{} cannot be posted in bulk, use set_inventory_transactions.".format(
+                    content_type.model
+                )
+            )
+        if hasattr(submodel, "voucher_id"):
+            voucher_id = submodel.voucher_id
+            voucher_no = submodel.voucher.voucher_no
+        else:
+            voucher_id = submodel.id
+            voucher_no = submodel.voucher_no
+        journal_entries.append(
+            JournalEntry(
+                content_type=content_type,
+                object_id=submodel.id,
+                date=date,
+                source_voucher_id=voucher_id,
+                source_voucher_no=voucher_no,
+            )
+        )
+
+    transactions = []
+    # {account_id: quantity difference}
+    balances = {}
+    # {(account_id, date): (dr_difference, cr_difference)}
+    movements = {}
+    # earliest date to replay FIFO from, per account
+    replay_dates = {}
+    for (submodel, date, entries), journal_entry in zip(postings, journal_entries):
+        for entry in entries:
+            account = entry[1]
+            quantity = Decimal(entry[2])
+            txn = Transaction(account=account, journal_entry=journal_entry, rate=entry[3])
+            if entry[0] in ["dr", "ob"]:
+                txn.dr_amount = quantity
+                txn.remaining_quantity = quantity
+                dr, cr = quantity, 0
+            elif entry[0] == "cr":
+                txn.cr_amount = quantity
+                # consumed by the replay below
+                txn.fifo_inconsistency_quantity = quantity
+                dr, cr = 0, quantity
+            else:
+                raise Exception('Transactions can only be either "dr" or "cr".')
+            transactions.append(txn)
+
+            balances[account.id] = balances.get(account.id, 0) + dr - cr
+            key = (account.id, date)
+            old_dr, old_cr = movements.get(key, (0, 0))
+            movements[key] = (old_dr + dr, old_cr + cr)
+            replay_dates[account.id] = min(replay_dates.get(account.id, date), date)
+
+    with transaction.atomic():
+        JournalEntry.objects.bulk_create(journal_entries, batch_size=1000)
+        Transaction.objects.bulk_create(transactions, batch_size=1000)
+        if balances:
+            InventoryAccount.objects.filter(id__in=list(balances)).update(
+                current_balance=F("current_balance")
+                + Case(
+                    *[
+                        When(id=account_id, then=Value(balance))
+                        for account_id, balance in balances.items()
+                    ],
+                    default=Value(0),
+                    output_field=models.DecimalField(max_digits=24, decimal_places=6),
+                )
+            )
+        record_inventory_movements(movements)
+        for account_id, replay_date in replay_dates.items():
+            replay_fifo(account_id, replay_date)
+    return journal_entries
+
 
 class TransactionRemovalLog(models.Model):
     deleted_at = models.DateTimeField(auto_now_add=True)
@@ -1458,69 +1666,73 @@ class TransactionRemovalLog(models.Model):
 
 @receiver(pre_delete, sender=Transaction)
 def _transaction_delete(sender, instance, **kwargs):
-    # if a tarnsaction is deleted, find the transaction which has consumed from this transaction
-    # and remove reference from it, and add the quantity to fifo_inconsistency_quantity
-    # using the fifo_inconsistency_quantity field, we can find the transactions which
-    # have been affected by this transaction and recalculate the fifo
-
+    # if a transaction is deleted, give the quantity it consumed back to its lots, or if it is
+    # a lot, add the quantity consumed from it to the fifo_inconsistency_quantity of its
+    # consumers; the account's FIFO is then replayed from the transaction's date
     if instance.dr_amount:
-        Transaction.objects.filter(consumption_data__has_key=str(instance.id)).update(
-            fifo_inconsistency_quantity=(
-                Coalesce(F("fifo_inconsistency_quantity"), 0)
-                + Cast(
-                    F(f"consumption_data__{instance.id}__0"),
-                    models.DecimalField(max_digits=24, decimal_places=6),
-                )
-            ),
-            consumption_data=F("consumption_data") - str(instance.id),
+        field, counterpart = "fifo_inconsistency_quantity", "consumer_id"
+        consumptions = LotConsumption.objects.filter(lot=instance)
+    else:
+        field, counterpart = "remaining_quantity", "lot_id"
+        consumptions = LotConsumption.objects.filter(consumer=instance)
+
+    for row in (
+        consumptions.order_by()
+        .values(counterpart)
+        .annotate(quantity=Sum("quantity"))
+    ):
+        Transaction.objects.filter(id=row[counterpart]).update(
+            **{field: Coalesce(F(field), 0) + row["quantity"]}
         )
 
-    if instance.cr_amount:
-        later_transactions = Transaction.objects.filter(
-            account=instance.account,
-            journal_entry__date__gte=instance.journal_entry.date,
-            id__gte=instance.id,
-            cr_amount__gt=0,
-        )
+    TransactionRemovalLog.objects.create(
+        row_id=instance.id,
+        transaction_type="Inventory",
+        row_dump=jsonify(instance),
+    )
 
-        dr_ids = (
-            later_transactions.annotate(
-                keys=Func(F("consumption_data"), function="jsonb_object_keys")
-            )
-            .values_list("keys", flat=True)
-            .distinct()
-        )
 
-        dr_txns = {
-            txn.id: txn for txn in Transaction.objects.filter(id__in=list(dr_ids))
-        }
+class FifoReplays:
+    """
+    Commit hook replaying FIFO of the inventory accounts queued by `queue_fifo_replay`,
+    once per account from the earliest date queued.
+    """
 
-        updated_txns = []
+    def __init__(self):
+        self.dates = {}
 
-        for txn in later_transactions:
-            txn.fifo_inconsistency_quantity = txn.cr_amount
-            for key, value in txn.consumption_data.items():
-                dr_txn = dr_txns[int(key)]
-                dr_txn.remaining_quantity += value[0]
-                updated_txns.append(dr_txn)
-            txn.consumption_data = {}
-            if txn.id != instance.id:
-                updated_txns.append(txn)
+    def __call__(self):
+        for account_id, date in self.dates.items():
+            replay_fifo(account_id, date)
 
-        Transaction.objects.bulk_update(
-            updated_txns,
-            [
-                "fifo_inconsistency_quantity",
-                "consumption_data",
-                "remaining_quantity",
-            ],
-        )
 
-    TransactionRemovalLog.objects.create(
-        row_id=instance.id,
-        transaction_type="Inventory",
-        row_dump=jsonify(instance),
+def queue_fifo_replay(account_id, date):
+    """
+    Replays FIFO of an inventory account from `date` once the current transaction
+    commits, so that deleting many transactions of an account replays it once.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        replay_fifo(account_id, date)
+        return
+    # * The hook is looked up among pending ones as hooks are dropped on rollback
+    hook = next(
+        (
+            func
+            for _, func, *_ in connection.run_on_commit
+            if isinstance(func, FifoReplays)
+        ),
+        None,
     )
+    if hook is None:
+        hook = FifoReplays()
+        transaction.on_commit(hook)
+    hook.dates[account_id] = min(hook.dates.get(account_id, date), date)
+
+
+@receiver(post_delete, sender=Transaction)
+def _transaction_fifo_replay(sender, instance, **kwargs):
+    queue_fifo_replay(instance.account_id, instance.journal_entry.date)
 
 
 class Item(CompanyBaseModel):
@@ -2160,34 +2372,27 @@ class InventoryAdjustmentVoucher(TransactionModel, InvoiceModel):
 
         # filter bypasses rows cached by prefetching
         if self.purpose in ["Damaged", "Expired"]:
+            acc_system_codes = settings.ACCOUNT_SYSTEM_CODES
+            # TODO: Do not fetch account with name
+            if self.purpose == "Damaged":
+                dr_account = get_account(
+                    self.company, acc_system_codes["Damage Expense"]
+                )
+            else:
+                dr_account = get_account(
+                    self.company, acc_system_codes["Expiry Expense"]
+                )
+            postings = []
             for row in self.rows.filter().select_related(
                 "item__purchase_account",
             ):
                 row_amount = row.quantity * row.rate
-                entries = [["cr", row.item.purchase_account, row_amount]]
-                acc_system_codes = settings.ACCOUNT_SYSTEM_CODES
-                if self.purpose == "Damaged":
-                    # TODO: Do not fetch account with name
-                    entries.append(
-                        [
-                            "dr",
-                            get_account(
-                                self.company, acc_system_codes["Damage Expense"]
-                            ),
-                            row_amount,
-                        ]
-                    )
-                elif self.purpose == "Expired":
-                    entries.append(
-                        [
-                            "dr",
-                            get_account(
-                                self.company, acc_system_codes["Expiry Expense"]
-                            ),
-                            row_amount,
-                        ]
-                    )
-                set_ledger_transactions(row, self.date, *entries, clear=True)
+                entries = [
+                    ["cr", row.item.purchase_account, row_amount],
+                    ["dr", dr_account, row_amount],
+                ]
+                postings.append((row, self.date, entries))
+            set_bulk_ledger_transactions(postings, clear=True)
 
         self.apply_inventory_transactions()
 
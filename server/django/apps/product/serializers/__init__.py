@@ -11,7 +11,7 @@ from apps.ledger.serializers import AccountBalanceSerializer, AccountMinSerializ
 from apps.product.helpers import create_book_category
 from apps.product.models import Item, Transaction
 from apps.tax.serializers import TaxSchemeMinSerializer, TaxSchemeSerializer
-from awecount.libs import get_next_voucher_no
+from awecount.libs import reserve_voucher_no
 from awecount.libs.Base64FileField import Base64FileField
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.exception import UnprocessableException
@@ -429,6 +429,7 @@ class JournalEntrySerializer(BaseModelSerializer):
 
 class TransactionEntrySerializer(BaseModelSerializer):
     date = serializers.ReadOnlyField(source="journal_entry.date")
+    current_balance = serializers.ReadOnlyField()
     source_type = serializers.SerializerMethodField()
     source_id = serializers.ReadOnlyField(source="journal_entry.source.get_source_id")
 
@@ -549,7 +550,7 @@ class InventoryAdjustmentVoucherCreateSerializer(BaseModelSerializer):
             return
         if validated_data.get("status") in ["Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             InventoryAdjustmentVoucher, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
@@ -697,7 +698,7 @@ class InventoryConversionVoucherCreateSerializer(BaseModelSerializer):
             return
         if validated_data.get("status") in ["Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             InventoryConversionVoucher, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
@@ -5,7 +5,7 @@ from django.conf import settings
 from django.utils import timezone
 from apps.ledger.serializers import PartyMinSerializer
 from apps.product.models import Item
-from awecount.libs import get_next_quotation_no
+from awecount.libs import reserve_voucher_no
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.serializers import FileOrStringField, StatusReversionMixin
 from lib.drf.serializers import BaseModelSerializer
@@ -89,8 +89,8 @@ class QuotationCreateSerializer(
             return
         if validated_data.get("status") == "Draft":
             return
-        next_quotation_no = get_next_quotation_no(
-            Quotation, self.context["request"].company.id
+        next_quotation_no = reserve_voucher_no(
+            Quotation, self.context["request"].company.id, attr="number"
         )
         validated_data["number"] = next_quotation_no
 
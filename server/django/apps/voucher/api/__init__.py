@@ -167,6 +167,7 @@ from ..serializers import (
     SalesDiscountMinSerializer,
     SalesDiscountSerializer,
     SalesRowSerializer,
+    SalesVoucherBulkCreateSerializer,
     SalesVoucherChoiceSerializer,
     SalesVoucherCreateSerializer,
     SalesVoucherDetailSerializer,
@@ -341,14 +342,14 @@ def import_sales_vouchers(request_obj, file):
 
 
     try:
-        with transaction.atomic():
-            for invoice_id, invoice_data in new_invoices:
-                serializer = SalesVoucherCreateSerializer(
-                    data=invoice_data, context={"request": request}
-                )
-                serializer.is_valid(raise_exception=True)
-                instance = serializer.create(validated_data=serializer.validated_data)
-                invoice_data["id"] = instance.id
+        serializer = SalesVoucherBulkCreateSerializer(
+            data={"invoices": [invoice_data for _, invoice_data in new_invoices]},
+            context={"request": request},
+        )
+        serializer.is_valid(raise_exception=True)
+        vouchers = serializer.save()
+        for (invoice_id, invoice_data), instance in zip(new_invoices, vouchers):
+            invoice_data["id"] = instance.id
     except ValidationError as e:
         error_message = e.message
     except RESTValidationError as e:
@@ -723,7 +724,7 @@ class SalesVoucherViewSet(InputChoiceMixin, DeleteRows, CRULViewSet):
         else:
             obj.mode = mode
             obj.bank_account_id = None
-        obj.apply_transactions()
+        obj.post_transactions()
         return Response({})
 
     @action(detail=True, methods=["POST"], url_path="update-payment-mode")
@@ -741,7 +742,7 @@ class SalesVoucherViewSet(InputChoiceMixin, DeleteRows, CRULViewSet):
         if payment_mode is None:
             obj.status = "Issued"
 
-        obj.apply_transactions()
+        obj.post_transactions()
         return Response({})
 
     @action(detail=True, methods=["POST"])
@@ -1058,7 +1059,8 @@ class POSViewSet(
         if serializer.validated_data["status"] != "Draft":
             serializer.validated_data["print_count"] = 1
         try:
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
         except ValidationError as e:
             raise APIException({"detail": e.messages})
 
@@ -1067,6 +1069,27 @@ class POSViewSet(
             raise APIException({"detail": "Issued POS invoices can't be updated"})
         return super().update(request, *args, **kwargs)
 
+    @action(detail=False, methods=["POST"], url_path="bulk")
+    def bulk_create(self, request, *args, **kwargs):
+        serializer = SalesVoucherBulkCreateSerializer(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        for invoice in serializer.validated_data["invoices"]:
+            if invoice["status"] != "Draft":
+                invoice["print_count"] = 1
+        try:
+            vouchers = serializer.save()
+        except ValidationError as e:
+            raise APIException({"detail": e.messages})
+        return Response(
+            [
+                {"id": voucher.id, "voucher_no": voucher.voucher_no}
+                for voucher in vouchers
+            ],
+            status=201,
+        )
+
 
 class PurchaseVoucherViewSet(
     CancelPurchaseVoucherMixin, InputChoiceMixin, DeleteRows, CRULViewSet
@@ -6,11 +6,24 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 from apps.ledger.models import JournalEntry
 from awecount.libs import nepdate, wGenerator
 
+POSTING_STATUSES = (
+    ("Posted", "Posted"),
+    ("Queued", "Queued"),
+    ("Failed", "Failed"),
+)
+POSTING_FIELDS = (
+    "posting_status",
+    "posting_version",
+    "posting_queued_at",
+    "posting_error",
+)
+
 
 class InvoiceModel(models.Model):
     meta_sub_total = models.DecimalField(
@@ -117,7 +130,13 @@ class InvoiceModel(models.Model):
     def voucher_meta(self):
         return self.get_voucher_meta()
 
-    def generate_meta(self, update_row_data=False, prefetched_rows=False, save=True):
+    def generate_meta(
+        self, update_row_data=False, prefetched_rows=False, save=True, save_rows=True
+    ):
+        """
+        :param save_rows: with update_row_data, saves each row; otherwise the amounts are only
+            set on the row objects for the caller to bulk update them
+        """
         dct = {
             "sub_total": 0,
             "sub_total_after_row_discounts": 0,
@@ -127,7 +146,7 @@ class InvoiceModel(models.Model):
             "tax": 0,
         }
         rows_data = []
-        row_objs = {}
+        row_objs = []
         # bypass prefetch cache using filter
         rows = self.rows.all() if prefetched_rows else self.rows.filter()
         for row in rows:
@@ -143,11 +162,11 @@ class InvoiceModel(models.Model):
             dct["sub_total_after_row_discounts"] += row_data["gross_total"]
             dct["sub_total"] += row_data["total"]
             rows_data.append(row_data)
-            row_objs[row.id] = row
+            row_objs.append(row)
 
         voucher_discount_data = self.get_voucher_discount_data()
 
-        for row_data in rows_data:
+        for row_data, row_obj in zip(rows_data, row_objs):
             if voucher_discount_data["type"] == "Percent":
                 dividend_discount = (
                     row_data["gross_total"] * voucher_discount_data["value"] / 100
@@ -175,11 +194,11 @@ class InvoiceModel(models.Model):
                 dct["non_taxable"] += row_data["pure_total"]
 
             if update_row_data:
-                row_obj = row_objs[row_data["id"]]
                 row_obj.discount_amount = total_row_discount
                 row_obj.tax_amount = row_data["tax_amount"]
                 row_obj.net_amount = row_data["pure_total"] + row_data["tax_amount"]
-                row_obj.save()
+                if save_rows:
+                    row_obj.save()
 
         dct["grand_total"] = dct["sub_total"] - dct["discount"] + dct["tax"]
 
@@ -276,6 +295,81 @@ class InvoiceModel(models.Model):
         abstract = True
 
 
+class PostingModel(models.Model):
+    """
+    Ledger and inventory posting of a voucher, which companies with asynchronous posting
+    hand over to the task cluster instead of running in the request. Every queuing bumps
+    `posting_version`, so each version of a voucher is posted once.
+    """
+
+    posting_status = models.CharField(
+        choices=POSTING_STATUSES, default=POSTING_STATUSES[0][0], max_length=10
+    )
+    posting_version = models.PositiveIntegerField(default=0)
+    posting_queued_at = models.DateTimeField(blank=True, null=True)
+    posting_error = models.TextField(blank=True, null=True)
+
+    @property
+    def posting_key(self):
+        return "post-{}-{}-v{}".format(
+            self._meta.label_lower, self.pk, self.posting_version
+        )
+
+    def post_transactions(self, voucher_meta=None, **kwargs):
+        """
+        Applies the transactions of the voucher, or queues them when the company posts
+        asynchronously. Drafts, cancellations and extra entries, which are not stored on
+        the voucher, are always applied right away.
+        """
+        if (
+            not self.company.async_voucher_posting
+            or self.status in ["Draft", "Cancelled"]
+            or any(kwargs.values())
+        ):
+            if self.posting_status != POSTING_STATUSES[0][0]:
+                # Supersedes the queued version
+                self.posting_status = POSTING_STATUSES[0][0]
+                self.posting_version += 1
+                self.posting_queued_at = None
+                self.posting_error = None
+                self.save(
+                    update_fields=[
+                        "posting_status",
+                        "posting_version",
+                        "posting_queued_at",
+                        "posting_error",
+                    ]
+                )
+            self.apply_transactions(voucher_meta=voucher_meta, **kwargs)
+            return
+        self.queue_posting(voucher_meta)
+
+    def queue_posting(self, voucher_meta=None):
+        from django_q.tasks import async_task
+
+        voucher_meta = voucher_meta or self.get_voucher_meta()
+        self.total_amount = voucher_meta["grand_total"]
+        if self.posting_status != POSTING_STATUSES[1][0]:
+            # Lag is measured from the oldest unposted change
+            self.posting_queued_at = timezone.now()
+        self.posting_status = POSTING_STATUSES[1][0]
+        self.posting_version += 1
+        self.posting_error = None
+        self.save()
+        company_id = self.company_id
+        task_name = self.posting_key
+        transaction.on_commit(
+            lambda: async_task(
+                "apps.voucher.tasks.post_queued_vouchers",
+                company_id,
+                task_name=task_name,
+            )
+        )
+
+    class Meta:
+        abstract = True
+
+
 class InvoiceRowModel(models.Model):
     company_id_accessor = "voucher__company_id"
 
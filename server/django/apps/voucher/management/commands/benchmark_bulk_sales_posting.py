@@ -0,0 +1,150 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.company.models import Company, CompanyMember
+from apps.product.models import Item
+from apps.voucher.models import TAX_TYPES, PaymentMode
+from apps.voucher.serializers import (
+    SalesVoucherBulkCreateSerializer,
+    SalesVoucherCreateSerializer,
+)
+from awecount.libs.helpers import deserialize_request
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare creating sales invoices one at a time against the bulk posting. "
+        "All changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID",
+            required=True,
+        )
+        parser.add_argument(
+            "--invoices",
+            type=int,
+            default=1000,
+            help="Number of invoices",
+        )
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=3,
+            help="Number of rows per invoice",
+        )
+
+    def measure(self, func):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return len(context.captured_queries), elapsed
+
+    def get_invoices(self, company, count, row_count):
+        items = list(
+            Item.objects.filter(company=company, can_be_sold=True).values_list(
+                "id", "selling_price"
+            )[:50]
+        )
+        if not items:
+            raise CommandError("Company has no items that can be sold")
+        payment_mode = PaymentMode.objects.filter(
+            company=company, enabled_for_sales=True
+        ).first()
+        if not payment_mode:
+            raise CommandError("Company has no payment mode enabled for sales")
+
+        date = timezone.now().date()
+        if not company.current_fiscal_year.includes(date):
+            raise CommandError("Today is not in the current fiscal year of the company")
+
+        invoices = []
+        for index in range(count):
+            rows = []
+            for row_index in range(row_count):
+                item_id, selling_price = items[(index + row_index) % len(items)]
+                rows.append(
+                    {
+                        "item_id": item_id,
+                        "quantity": 1,
+                        "rate": selling_price or 1,
+                        "discount": 0,
+                    }
+                )
+            invoices.append(
+                {
+                    "date": str(date),
+                    "status": "Issued",
+                    "payment_mode": payment_mode.id,
+                    "tax_type": TAX_TYPES[0][0],
+                    "discount": 0,
+                    "rows": rows,
+                }
+            )
+        return invoices
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.get(id=options["company"])
+        except Company.DoesNotExist:
+            raise CommandError("Company not found")
+
+        member = (
+            CompanyMember.objects.filter(company=company)
+            .select_related("member")
+            .first()
+        )
+        if not member:
+            raise CommandError("Company has no members")
+
+        invoices = self.get_invoices(company, options["invoices"], options["rows"])
+        # Stock and FIFO checks are skipped alike on both paths
+        request = deserialize_request(
+            {
+                "company_id": company.id,
+                "company": company,
+                "user": member.member,
+                "data": {"date": invoices[0]["date"]},
+                "query_params": {"fifo_inconsistency": "1", "negative_stock": "1"},
+            }
+        )
+        context = {"request": request}
+
+        def create_one_at_a_time():
+            for invoice in invoices:
+                serializer = SalesVoucherCreateSerializer(data=invoice, context=context)
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+
+        def create_in_bulk():
+            serializer = SalesVoucherBulkCreateSerializer(
+                data={"invoices": invoices}, context=context
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        single_queries, single_time = self.measure(create_one_at_a_time)
+        bulk_queries, bulk_time = self.measure(create_in_bulk)
+
+        self.stdout.write(
+            f"Invoices: {len(invoices)}, rows per invoice: {options['rows']}"
+        )
+        self.stdout.write(
+            f"One at a time: {single_queries} queries in {single_time:.2f} s "
+            f"({len(invoices) / single_time:.1f} invoices/s)"
+        )
+        self.stdout.write(
+            f"Bulk: {bulk_queries} queries in {bulk_time:.2f} s "
+            f"({len(invoices) / bulk_time:.1f} invoices/s)"
+        )
+        self.stdout.write(f"Speedup: {single_time / bulk_time:.1f}x")
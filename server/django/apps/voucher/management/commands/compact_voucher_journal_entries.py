@@ -0,0 +1,125 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.company.models import Company
+from apps.ledger.models import (
+    JournalEntry,
+    Transaction,
+    net_entries,
+    set_transactions,
+)
+from apps.voucher.models import CreditNote, DebitNote, PurchaseVoucher, SalesVoucher
+
+VOUCHER_MODELS = (SalesVoucher, PurchaseVoucher, CreditNote, DebitNote)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact per-row journal entries of vouchers into a single journal entry per voucher "
+        "for companies with aggregated voucher journal entries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=str,
+            help="Company ID, defaults to all companies with aggregation enabled",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the vouchers that would be compacted",
+        )
+
+    def get_extra_entries(self, voucher, voucher_journal_entry):
+        """
+        Entries of the voucher's own journal entry other than the commission, which are
+        stored with it to be posted again whenever the voucher is posted.
+        """
+        if voucher_journal_entry.extra_entries:
+            return voucher_journal_entry.get_extra_entries()
+        entries = [
+            ["dr", txn.account, txn.dr_amount]
+            if txn.dr_amount
+            else ["cr", txn.account, txn.cr_amount]
+            for txn in voucher_journal_entry.transactions.select_related("account")
+            if txn.dr_amount or txn.cr_amount
+        ]
+        commission = (
+            voucher.payment_mode.calculate_fee(voucher.total_amount)
+            if voucher.payment_mode
+            else None
+        )
+        if commission and commission > 0:
+            entries += [
+                ["cr", voucher.payment_mode.transaction_fee_account, commission],
+                ["dr", voucher.payment_mode.account, commission],
+            ]
+        return net_entries(entries)
+
+    def compact(self, voucher, row_content_type, voucher_content_type):
+        row_ids = list(voucher.rows.values_list("id", flat=True))
+        row_journal_entries = JournalEntry.objects.filter(
+            content_type=row_content_type, object_id__in=row_ids
+        )
+        voucher_journal_entries = JournalEntry.objects.filter(
+            content_type=voucher_content_type, object_id=voucher.id
+        )
+        voucher_journal_entry = voucher_journal_entries.first()
+        extra_entries = (
+            self.get_extra_entries(voucher, voucher_journal_entry)
+            if voucher_journal_entry
+            else []
+        )
+        entries = [
+            ["dr", txn.account, txn.dr_amount]
+            if txn.dr_amount
+            else ["cr", txn.account, txn.cr_amount]
+            for txn in Transaction.objects.filter(
+                journal_entry__in=row_journal_entries | voucher_journal_entries
+            ).select_related("account")
+            if txn.dr_amount or txn.cr_amount
+        ]
+        with transaction.atomic():
+            row_journal_entries.delete()
+            set_transactions(voucher, voucher.date, *net_entries(entries), clear=True)
+            voucher_journal_entries.update(
+                aggregates_rows=True,
+                extra_entries=JournalEntry.dump_entries(extra_entries),
+            )
+
+    def handle(self, *args, **options):
+        companies = Company.objects.all()
+        if options["company"]:
+            companies = companies.filter(id=options["company"])
+        else:
+            companies = companies.filter(aggregate_voucher_journal_entries=True)
+
+        for company in companies:
+            for model in VOUCHER_MODELS:
+                row_content_type = ContentType.objects.get_for_model(
+                    model.rows.field.model
+                )
+                voucher_content_type = ContentType.objects.get_for_model(model)
+                posted_row_ids = JournalEntry.objects.filter(
+                    content_type=row_content_type
+                ).values("object_id")
+                vouchers = (
+                    model.objects.filter(company=company, rows__id__in=posted_row_ids)
+                    .exclude(status__in=["Draft", "Cancelled"])
+                    .distinct()
+                )
+                count = 0
+                for voucher in vouchers.iterator():
+                    if not options["dry_run"]:
+                        self.compact(voucher, row_content_type, voucher_content_type)
+                    count += 1
+                self.stdout.write(
+                    "{}: {} {} {}".format(
+                        company,
+                        count,
+                        model._meta.verbose_name_plural,
+                        "to compact" if options["dry_run"] else "compacted",
+                    )
+                )
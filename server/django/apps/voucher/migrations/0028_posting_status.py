@@ -0,0 +1,61 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voucher', '0027_rename_enable_expense_type_in_voucher_purchasesetting_enable_type_in_voucher_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchasevoucher',
+            name='posting_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchasevoucher',
+            name='posting_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchasevoucher',
+            name='posting_status',
+            field=models.CharField(choices=[('Posted', 'Posted'), ('Queued', 'Queued'), ('Failed', 'Failed')], default='Posted', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='purchasevoucher',
+            name='posting_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='salesvoucher',
+            name='posting_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='salesvoucher',
+            name='posting_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='salesvoucher',
+            name='posting_status',
+            field=models.CharField(choices=[('Posted', 'Posted'), ('Queued', 'Queued'), ('Failed', 'Failed')], default='Posted', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='salesvoucher',
+            name='posting_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='purchasevoucher',
+            index=models.Index(condition=models.Q(('posting_status', 'Posted'), _negated=True), fields=['company', 'posting_queued_at'], name='purchase_voucher_unposted'),
+        ),
+        migrations.AddIndex(
+            model_name='salesvoucher',
+            index=models.Index(condition=models.Q(('posting_status', 'Posted'), _negated=True), fields=['company', 'posting_queued_at'], name='sales_voucher_unposted'),
+        ),
+    ]
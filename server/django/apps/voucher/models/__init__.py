@@ -13,7 +13,7 @@ from django.core.files.storage import default_storage
 from django.core.mail import EmailMessage
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Avg, Prefetch, Q
+from django.db.models import Avg, Count, Min, Prefetch, Q
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django_q.models import Schedule
@@ -31,6 +31,7 @@ from apps.ledger.models import (
     TransactionModel,
     get_account,
 )
+from apps.ledger.models import set_bulk_transactions as set_bulk_ledger_transactions
 from apps.ledger.models import set_transactions as set_ledger_transactions
 from apps.ledger.models.base import Account
 from apps.product.models import (
@@ -42,7 +43,7 @@ from apps.product.models import (
 from apps.quotation.models import Quotation
 from apps.tax.models import TaxScheme
 from apps.users.models import User
-from apps.voucher.base_models import InvoiceModel, InvoiceRowModel
+from apps.voucher.base_models import InvoiceModel, InvoiceRowModel, PostingModel
 from awecount.libs import decimalize, nepdate
 
 from .agent import SalesAgent
@@ -451,7 +452,9 @@ class ChallanRow(TransactionModel, InvoiceRowModel, CompanyBaseModel):
     key = "Challan"
 
 
-class SalesVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
+class SalesVoucher(
+    TransactionModel, InvoiceModel, PostingModel, CompanyBaseModel
+):
     voucher_no = models.PositiveSmallIntegerField(blank=True, null=True)
     party = models.ForeignKey(
         Party,
@@ -552,6 +555,13 @@ class SalesVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
 
     class Meta:
         unique_together = ("company", "voucher_no", "fiscal_year")
+        indexes = [
+            models.Index(
+                fields=["company", "posting_queued_at"],
+                condition=~Q(posting_status="Posted"),
+                name="sales_voucher_unposted",
+            )
+        ]
 
     @property
     def buyer_name(self):
@@ -614,44 +624,32 @@ class SalesVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
         payment_mode, _ = PaymentMode.objects.get_or_create(**kwargs)
         return payment_mode
 
-    def apply_transactions(self, voucher_meta=None, extra_entries=None):
-        voucher_meta = voucher_meta or self.get_voucher_meta()
-        if self.total_amount != voucher_meta["grand_total"]:
-            self.total_amount = voucher_meta["grand_total"]
-            self.save()
-
-        if self.status == "Cancelled":
-            self.cancel_transactions()
-            return
-        if self.status == "Draft":
-            return
-
-        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
-        if self.payment_mode:
-            dr_acc = self.payment_mode.account
-            self.status = "Paid"
-            self.payment_date = timezone.now().date()
-        else:
-            if not self.party:
-                raise ValueError(
-                    "Party is required for sales invoice, when not paid in cash!"
-                )
-            dr_acc = self.party.customer_account
-
-        self.save()
-        sub_total_after_row_discounts = self.get_total_after_row_discounts()
+    def get_row_ledger_postings(self, dr_acc, prefetched_rows=False):
+        """
+        :param prefetched_rows: uses the prefetched rows, which need their tax scheme, discount
+            and item accounts loaded, instead of querying them
+        """
+        sub_total_after_row_discounts = self.get_total_after_row_discounts(
+            use_prefetched=prefetched_rows
+        )
 
         dividend_discount, dividend_trade_discount = self.get_discount(
             sub_total_after_row_discounts
         )
 
-        # filter bypasses rows cached by prefetching
-        for row in self.rows.filter().select_related(
-            "tax_scheme",
-            "discount_obj",
-            "item__discount_allowed_account",
-            "item__sales_account",
-        ):
+        if prefetched_rows:
+            rows = self.rows.all()
+        else:
+            # filter bypasses rows cached by prefetching
+            rows = self.rows.filter().select_related(
+                "tax_scheme",
+                "discount_obj",
+                "item__discount_allowed_account",
+                "item__sales_account",
+            )
+
+        postings = []
+        for row in rows:
             entries = []
 
             row_total = decimalize(row.quantity) * decimalize(row.rate)
@@ -694,26 +692,53 @@ class SalesVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
             entries.append(["cr", row.item.sales_account, float(sales_value)])
             entries.append(["dr", dr_acc, float(row_total)])
 
-            set_ledger_transactions(row, self.date, *entries, clear=True)
+            postings.append((row, self.date, entries))
 
-        if extra_entries:
-            set_ledger_transactions(self, self.date, *extra_entries, clear=True)
+        return postings
 
+    def get_commission_entries(self, grand_total):
         if (
             self.payment_mode
-            and (
-                commission := self.payment_mode.calculate_fee(
-                    voucher_meta["grand_total"]
-                )
-            )
+            and (commission := self.payment_mode.calculate_fee(grand_total))
             and commission > 0
         ):
-            commission_entries = [
+            return [
                 ["dr", self.payment_mode.transaction_fee_account, commission],
                 ["cr", self.payment_mode.account, commission],
             ]
+        return None
 
-            set_ledger_transactions(self, self.date, *commission_entries, clear=True)
+    def apply_transactions(self, voucher_meta=None, extra_entries=None):
+        voucher_meta = voucher_meta or self.get_voucher_meta()
+        if self.total_amount != voucher_meta["grand_total"]:
+            self.total_amount = voucher_meta["grand_total"]
+            self.save()
+
+        if self.status == "Cancelled":
+            self.cancel_transactions()
+            return
+        if self.status == "Draft":
+            return
+
+        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
+        if self.payment_mode:
+            dr_acc = self.payment_mode.account
+            self.status = "Paid"
+            self.payment_date = timezone.now().date()
+        else:
+            if not self.party:
+                raise ValueError(
+                    "Party is required for sales invoice, when not paid in cash!"
+                )
+            dr_acc = self.party.customer_account
+
+        self.save()
+
+        self.set_voucher_transactions(
+            self.get_row_ledger_postings(dr_acc),
+            extra_entries=extra_entries,
+            commission_entries=self.get_commission_entries(voucher_meta["grand_total"]),
+        )
 
         self.apply_inventory_transactions()
 
@@ -1094,7 +1119,9 @@ class PurchaseOrderRow(TransactionModel, InvoiceRowModel):
     key = "Purchase Order"
 
 
-class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
+class PurchaseVoucher(
+    TransactionModel, InvoiceModel, PostingModel, CompanyBaseModel
+):
     voucher_no = models.CharField(max_length=25, null=True, blank=True)
     party = models.ForeignKey(Party, on_delete=models.PROTECT)
     date = models.DateField(default=timezone.now)
@@ -1198,6 +1225,15 @@ class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
         validators=[MinValueValidator(Decimal("0.000000"))],
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["company", "posting_queued_at"],
+                condition=~Q(posting_status="Posted"),
+                name="purchase_voucher_unposted",
+            )
+        ]
+
     def tax_till_declaration(self):
         landed_cost_rows = self.landed_cost_rows.all()
         sum = 0
@@ -1424,33 +1460,14 @@ class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
             )
         super().save(*args, **kwargs)
 
-    def apply_transactions(self, voucher_meta=None):
-        voucher_meta = voucher_meta or self.get_voucher_meta()
-        if self.total_amount != voucher_meta["grand_total"]:
-            self.total_amount = voucher_meta["grand_total"]
-            self.save()
-
-        if self.status == "Cancelled":
-            self.cancel_transactions()
-            return
-        if self.status == "Draft":
-            return
-
-        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
-        if self.payment_mode:
-            cr_acc = self.payment_mode.account
-            self.status = "Paid"
-        else:
-            cr_acc = self.party.supplier_account
-
-        self.save()
-
+    def get_row_ledger_postings(self, cr_acc):
         sub_total_after_row_discounts = self.get_total_after_row_discounts()
 
         dividend_discount, dividend_trade_discount = self.get_discount(
             sub_total_after_row_discounts
         )
 
+        postings = []
         # filter bypasses rows cached by prefetching
         for row in self.rows.filter().select_related(
             "tax_scheme",
@@ -1503,8 +1520,32 @@ class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
             entries.append(["dr", dr_account, purchase_value])
             entries.append(["cr", cr_acc, row_total])
 
-            set_ledger_transactions(row, self.date, *entries, clear=True)
+            postings.append((row, self.date, entries))
+
+        return postings
+
+    def apply_transactions(self, voucher_meta=None):
+        voucher_meta = voucher_meta or self.get_voucher_meta()
+        if self.total_amount != voucher_meta["grand_total"]:
+            self.total_amount = voucher_meta["grand_total"]
+            self.save()
+
+        if self.status == "Cancelled":
+            self.cancel_transactions()
+            return
+        if self.status == "Draft":
+            return
+
+        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
+        if self.payment_mode:
+            cr_acc = self.payment_mode.account
+            self.status = "Paid"
+        else:
+            cr_acc = self.party.supplier_account
+
+        self.save()
 
+        commission_entries = None
         if (
             self.payment_mode
             and (
@@ -1519,12 +1560,16 @@ class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
                 ["cr", self.payment_mode.account, commission],
             ]
 
-            set_ledger_transactions(self, self.date, *commission_entries, clear=True)
+        self.set_voucher_transactions(
+            self.get_row_ledger_postings(cr_acc),
+            commission_entries=commission_entries,
+        )
 
         if self.company.purchase_setting.enable_landed_cost:
             # TODO Optmiziation: Create account map outside the loop
             account_map = {}
             landed_cost_accounts = self.company.purchase_setting.landed_cost_accounts
+            postings = []
             for landed_cost in self.landed_cost_rows.all():
                 entries = []
                 if landed_cost.type == LandedCostRowType.CUSTOMS_VALUATION_UPLIFT:
@@ -1589,7 +1634,8 @@ class PurchaseVoucher(TransactionModel, InvoiceModel, CompanyBaseModel):
                             landed_cost.amount + row_tax_amount,
                         ]
                     )
-                set_ledger_transactions(landed_cost, self.date, *entries, clear=True)
+                postings.append((landed_cost, self.date, entries))
+            set_bulk_ledger_transactions(postings, clear=True)
 
         self.apply_inventory_transaction()
 
@@ -1793,34 +1839,14 @@ class CreditNote(TransactionModel, InvoiceModel, CompanyBaseModel):
                 ["dr", row.item.account, int(row.quantity), row.rate],
             )
 
-    def apply_transactions(self, extra_entries=None):
-        voucher_meta = self.get_voucher_meta()
-
-        if self.total_amount != voucher_meta["grand_total"]:
-            self.total_amount = voucher_meta["grand_total"]
-            self.save()
-
-        if self.status == "Cancelled":
-            self.cancel_transactions()
-            return
-        if self.status == "Draft":
-            return
-
-        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
-        if self.payment_mode:
-            cr_acc = self.payment_mode.account
-            self.status = "Resolved"
-        else:
-            cr_acc = self.party.customer_account
-
-        self.save()
-
+    def get_row_ledger_postings(self, cr_acc):
         sub_total_after_row_discounts = self.get_total_after_row_discounts()
 
         dividend_discount, dividend_trade_discount = self.get_discount(
             sub_total_after_row_discounts
         )
 
+        postings = []
         # filter bypasses rows cached by prefetching
         for row in self.rows.filter().select_related(
             "tax_scheme",
@@ -1865,11 +1891,33 @@ class CreditNote(TransactionModel, InvoiceModel, CompanyBaseModel):
 
             entries.append(["cr", cr_acc, row_total])
 
-            set_ledger_transactions(row, self.date, *entries, clear=True)
+            postings.append((row, self.date, entries))
 
-        if extra_entries:
-            set_ledger_transactions(self, self.date, *extra_entries, clear=True)
+        return postings
 
+    def apply_transactions(self, extra_entries=None):
+        voucher_meta = self.get_voucher_meta()
+
+        if self.total_amount != voucher_meta["grand_total"]:
+            self.total_amount = voucher_meta["grand_total"]
+            self.save()
+
+        if self.status == "Cancelled":
+            self.cancel_transactions()
+            return
+        if self.status == "Draft":
+            return
+
+        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
+        if self.payment_mode:
+            cr_acc = self.payment_mode.account
+            self.status = "Resolved"
+        else:
+            cr_acc = self.party.customer_account
+
+        self.save()
+
+        commission_entries = None
         if (
             self.payment_mode
             and (
@@ -1884,7 +1932,11 @@ class CreditNote(TransactionModel, InvoiceModel, CompanyBaseModel):
                 ["cr", self.payment_mode.account, commission],
             ]
 
-            set_ledger_transactions(self, self.date, *commission_entries, clear=True)
+        self.set_voucher_transactions(
+            self.get_row_ledger_postings(cr_acc),
+            extra_entries=extra_entries,
+            commission_entries=commission_entries,
+        )
 
         self.apply_inventory_transaction()
 
@@ -2035,27 +2087,7 @@ class DebitNote(TransactionModel, InvoiceModel, CompanyBaseModel):
                 ["cr", row.item.account, int(row.quantity), row.rate],
             )
 
-    def apply_transactions(self):
-        voucher_meta = self.get_voucher_meta()
-        if self.total_amount != voucher_meta["grand_total"]:
-            self.total_amount = voucher_meta["grand_total"]
-            self.save()
-
-        if self.status == "Cancelled":
-            self.cancel_transactions()
-            return
-        if self.status == "Draft":
-            return
-
-        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
-        if self.payment_mode:
-            dr_acc = self.payment_mode.account
-            self.status = "Resolved"
-        else:
-            dr_acc = self.party.supplier_account
-
-        self.save()
-
+    def get_row_ledger_postings(self, dr_acc):
         sub_total_after_row_discounts = self.get_total_after_row_discounts()
 
         dividend_discount, dividend_trade_discount = self.get_discount(
@@ -2069,6 +2101,7 @@ class DebitNote(TransactionModel, InvoiceModel, CompanyBaseModel):
             raise ValidationError("All invoices must be of the same type for a debit note.")
         invoice_type = invoices[0].type
 
+        postings = []
         # filter bypasses rows cached by prefetching
         for row in self.rows.filter().select_related(
             "tax_scheme",
@@ -2120,8 +2153,32 @@ class DebitNote(TransactionModel, InvoiceModel, CompanyBaseModel):
 
             entries.append(["dr", dr_acc, row_total])
 
-            set_ledger_transactions(row, self.date, *entries, clear=True)
+            postings.append((row, self.date, entries))
+
+        return postings
 
+    def apply_transactions(self):
+        voucher_meta = self.get_voucher_meta()
+        if self.total_amount != voucher_meta["grand_total"]:
+            self.total_amount = voucher_meta["grand_total"]
+            self.save()
+
+        if self.status == "Cancelled":
+            self.cancel_transactions()
+            return
+        if self.status == "Draft":
+            return
+
+        # TODO Also keep record of cash payment for party in party ledger [To show transactions for particular party]
+        if self.payment_mode:
+            dr_acc = self.payment_mode.account
+            self.status = "Resolved"
+        else:
+            dr_acc = self.party.supplier_account
+
+        self.save()
+
+        commission_entries = None
         if (
             self.payment_mode
             and (
@@ -2136,7 +2193,10 @@ class DebitNote(TransactionModel, InvoiceModel, CompanyBaseModel):
                 ["cr", self.payment_mode.account, commission],
             ]
 
-            set_ledger_transactions(self, self.date, *commission_entries, clear=True)
+        self.set_voucher_transactions(
+            self.get_row_ledger_postings(dr_acc),
+            commission_entries=commission_entries,
+        )
 
         self.apply_inventory_transaction()
 
@@ -2478,6 +2538,38 @@ class LandedCostRow(models.Model):
         super().save(*args, **kwargs)
 
 
+ASYNC_POSTED_MODELS = (SalesVoucher, PurchaseVoucher)
+
+
+def get_posting_lag(company_id):
+    """
+    Vouchers of the company saved but not yet posted, and the age of the oldest of them,
+    for reports to tell that they may be stale.
+    """
+    queued = failed = 0
+    oldest = None
+    for model in ASYNC_POSTED_MODELS:
+        stats = (
+            model.objects.filter(company_id=company_id)
+            .exclude(posting_status="Posted")
+            .aggregate(
+                queued=Count("id", filter=Q(posting_status="Queued")),
+                failed=Count("id", filter=Q(posting_status="Failed")),
+                oldest=Min("posting_queued_at"),
+            )
+        )
+        queued += stats["queued"]
+        failed += stats["failed"]
+        if stats["oldest"] and (oldest is None or stats["oldest"] < oldest):
+            oldest = stats["oldest"]
+    return {
+        "queued": queued,
+        "failed": failed,
+        "oldest_queued_at": oldest,
+        "lag_seconds": (timezone.now() - oldest).total_seconds() if oldest else 0,
+    }
+
+
 # class LandingCostDistribution(models.Model):
 #     landing_cost_row = models.ForeignKey(
 #         LandingCostRow,
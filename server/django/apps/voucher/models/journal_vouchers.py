@@ -7,7 +7,7 @@ from django.db import models
 from apps.company.models import Company, CompanyBaseModel
 from apps.ledger.models import Account, JournalEntry
 from apps.ledger.models import set_transactions as set_ledger_transactions
-from awecount.libs import get_next_voucher_no
+from awecount.libs import advance_voucher_sequence, reserve_voucher_no
 
 
 class JournalVoucher(models.Model):
@@ -26,10 +26,17 @@ class JournalVoucher(models.Model):
     class Meta:
         unique_together = ("company", "voucher_no")
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if not self.pk and not self.voucher_no:
-            self.voucher_no = get_next_voucher_no(JournalVoucher, self.company_id)
+    def save(self, *args, **kwargs):
+        self.validate_unique()
+        if not self.pk:
+            if self.voucher_no:
+                # Voucher number can be entered by hand
+                advance_voucher_sequence(
+                    JournalVoucher, self.company_id, self.voucher_no
+                )
+            else:
+                self.voucher_no = reserve_voucher_no(JournalVoucher, self.company_id)
+        super().save(*args, **kwargs)
 
     def get_source_id(self):
         return self.id
@@ -84,10 +91,6 @@ class JournalVoucher(models.Model):
             content_type=content_type, object_id=self.id
         ).delete()
 
-    def save(self, *args, **kwargs):
-        self.validate_unique()
-        super().save(*args, **kwargs)
-
 
 class JournalVoucherRow(CompanyBaseModel):
     TYPES = [("Dr", "Dr"), ("Cr", "Cr")]
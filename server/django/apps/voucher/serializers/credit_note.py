@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from awecount.libs import get_next_voucher_no
+from awecount.libs import reserve_voucher_no
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.serializers import StatusReversionMixin
 from lib.drf.serializers import BaseModelSerializer
@@ -50,7 +50,7 @@ class CreditNoteCreateSerializer(
             return
         if validated_data.get("status") in ["Draft", "Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             CreditNote, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
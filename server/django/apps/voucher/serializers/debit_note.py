@@ -6,7 +6,7 @@ from apps.voucher.serializers import (
     PurchaseDiscountSerializer,
     PurchaseVoucherRowDetailSerializer,
 )
-from awecount.libs import get_next_voucher_no
+from awecount.libs import reserve_voucher_no
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.exception import UnprocessableException
 from awecount.libs.serializers import StatusReversionMixin
@@ -51,7 +51,7 @@ class DebitNoteCreateSerializer(
             return
         if validated_data.get("status") in ["Draft", "Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             DebitNote, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
@@ -1,6 +1,6 @@
 from decimal import Decimal
 
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 from rest_framework.exceptions import APIException, ValidationError
 
@@ -53,7 +53,14 @@ class JournalVoucherCreateSerializer(DisableCancelEditMixin, BaseModelSerializer
     def create(self, validated_data):
         rows_data = validated_data.pop("rows")
         validated_data["company_id"] = self.context["request"].company.id
-        journal_voucher = JournalVoucher.objects.create(**validated_data)
+        try:
+            with transaction.atomic():
+                journal_voucher = JournalVoucher.objects.create(**validated_data)
+        except IntegrityError:
+            # Number entered by hand and taken by a concurrent request
+            raise ValidationError(
+                {"voucher_no": ["Journal voucher with this number already exists."]}
+            )
         for index, row in enumerate(rows_data):
             account = row.pop("account")
             row["account_id"] = account.get("id")
@@ -63,6 +70,8 @@ class JournalVoucherCreateSerializer(DisableCancelEditMixin, BaseModelSerializer
 
     def update(self, instance, validated_data):
         rows_data = validated_data.pop("rows")
+        if validated_data.get("voucher_no") is None:
+            validated_data.pop("voucher_no", None)
         validated_data["company_id"] = self.context["request"].company.id
         self.disable_cancel_edit(validated_data, instance)
         JournalVoucher.objects.filter(pk=instance.id).update(**validated_data)
@@ -85,6 +94,8 @@ class JournalVoucherCreateSerializer(DisableCancelEditMixin, BaseModelSerializer
     class Meta:
         model = JournalVoucher
         exclude = ("company",)
+        # Numbered when saved unless entered by hand
+        extra_kwargs = {"voucher_no": {"required": False, "allow_null": True}}
 
 
 class JournalVoucherListSerializer(BaseModelSerializer):
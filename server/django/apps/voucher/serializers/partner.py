@@ -3,6 +3,7 @@ from rest_framework.exceptions import ValidationError
 
 from apps.product.models import Item
 from apps.product.serializers import ItemPurchaseSerializer, ItemSerializer
+from apps.voucher.base_models import POSTING_FIELDS
 from apps.voucher.models import (
     CreditNoteRow,
     DebitNoteRow,
@@ -330,6 +331,7 @@ class PartnerPurchaseVoucherCreateSerializer(
     class Meta:
         model = PurchaseVoucher
         exclude = ("company", "user", "bank_account", "discount_obj", "fiscal_year")
+        read_only_fields = POSTING_FIELDS
 
 
 class PartnerPurchaseVoucherListSerializer(BaseModelSerializer):
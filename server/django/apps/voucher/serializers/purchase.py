@@ -6,12 +6,13 @@ from apps.ledger.serializers import PartyMinSerializer
 from apps.product.models import Item
 from apps.product.serializers import ItemPurchaseSerializer
 from apps.tax.serializers import TaxSchemeSerializer
-from awecount.libs import get_next_voucher_no
+from awecount.libs import reserve_voucher_no
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.exception import UnprocessableException
 from awecount.libs.serializers import StatusReversionMixin
 from lib.drf.serializers import BaseModelSerializer
 
+from ..base_models import POSTING_FIELDS
 from ..models import (
     LandedCostRow,
     PurchaseDiscount,
@@ -213,7 +214,7 @@ class PurchaseVoucherCreateSerializer(
             instance.purchase_orders.clear()
             instance.purchase_orders.set(purchase_orders)
         meta = instance.generate_meta(update_row_data=True)
-        instance.apply_transactions(voucher_meta=meta)
+        instance.post_transactions(voucher_meta=meta)
         return instance
 
     def update(self, instance: PurchaseVoucher, validated_data):
@@ -258,12 +259,13 @@ class PurchaseVoucherCreateSerializer(
             instance.purchase_orders.set(purchase_orders)
         instance.refresh_from_db()
         meta = instance.generate_meta(update_row_data=True)
-        instance.apply_transactions(voucher_meta=meta)
+        instance.post_transactions(voucher_meta=meta)
         return instance
 
     class Meta:
         model = PurchaseVoucher
         exclude = ("company", "user", "bank_account", "discount_obj", "fiscal_year")
+        read_only_fields = POSTING_FIELDS
 
 
 class PurchaseVoucherListSerializer(BaseModelSerializer):
@@ -407,7 +409,7 @@ class PurchaseOrderCreateSerializer(BaseModelSerializer):
     def assign_voucher_number(self, validated_data, instance=None):
         if instance and instance.voucher_no:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             PurchaseOrder, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
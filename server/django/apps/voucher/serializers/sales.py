@@ -1,20 +1,36 @@
 import datetime
+from collections.abc import Mapping
 
 from django.conf import settings
-from django.db.models import F
+from django.db import transaction
+from django.db.models import F, Max, Prefetch, prefetch_related_objects
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from apps.bank.models import ChequeDeposit
+from apps.ledger.models import (
+    JournalEntry,
+    Party,
+    net_entries,
+    set_bulk_ledger_transactions,
+)
 from apps.ledger.serializers import PartyMinSerializer
-from apps.product.models import Item
+from apps.product.models import Item, set_bulk_inventory_transactions
 from apps.product.serializers import ItemSalesSerializer
+from apps.tax.models import TaxScheme
 from apps.tax.serializers import TaxSchemeSerializer
-from apps.voucher.models import Challan, ChallanRow, PaymentReceipt, SalesAgent
+from apps.voucher.base_models import POSTING_FIELDS
+from apps.voucher.models import (
+    Challan,
+    ChallanRow,
+    PaymentMode,
+    PaymentReceipt,
+    SalesAgent,
+)
 from apps.voucher.models.discounts import PurchaseDiscount
 from apps.voucher.serializers.purchase import PurchaseVoucherCreateSerializer
-from awecount.libs import get_next_voucher_no
+from awecount.libs import reserve_voucher_no, reserve_voucher_nos
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.exception import UnprocessableException
 from awecount.libs.helpers import get_full_file_url
@@ -276,7 +292,7 @@ class SalesVoucherCreateSerializer(
             return
         if validated_data.get("status") in ["Draft", "Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             SalesVoucher, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
@@ -371,13 +387,16 @@ class SalesVoucherCreateSerializer(
                 #         {'date': ['Invoice with later date already exists!']},
                 #     )
 
+    def get_row_items(self, item_ids):
+        return {item.id: item for item in Item.objects.filter(id__in=item_ids)}
+
     def validate_rows(self, rows):
         request = self.context["request"]
         sales_setting = request.company.sales_setting
 
         # Collect all item IDs and fetch items in a single query
         item_ids = [row.get("item_id") for row in rows]
-        items = {item.id: item for item in Item.objects.filter(id__in=item_ids)}
+        items = self.get_row_items(item_ids)
 
         for row in rows:
             item_id = row.get("item_id")
@@ -462,7 +481,7 @@ class SalesVoucherCreateSerializer(
             instance.challans.clear()
             instance.challans.add(*challans)
         meta = instance.generate_meta(update_row_data=True)
-        instance.apply_transactions(voucher_meta=meta, extra_entries=extra_entries)
+        instance.post_transactions(voucher_meta=meta, extra_entries=extra_entries)
         # TODO: synchronize with CBMS
         # instance.synchronize()
         return instance
@@ -500,7 +519,7 @@ class SalesVoucherCreateSerializer(
 
         instance.refresh_from_db()
         meta = instance.generate_meta(update_row_data=True)
-        instance.apply_transactions(voucher_meta=meta)
+        instance.post_transactions(voucher_meta=meta)
         # instance.synchronize(verb='PATCH')
         return instance
 
@@ -513,6 +532,389 @@ class SalesVoucherCreateSerializer(
             "discount_obj",
             "fiscal_year",
         )
+        read_only_fields = POSTING_FIELDS
+
+
+class SalesVoucherBulkItemSerializer(SalesVoucherCreateSerializer):
+    """
+    An invoice of a bulk posting. Relations are plain IDs which, like the company wide
+    validations, are checked for all invoices at once by `SalesVoucherBulkCreateSerializer`.
+    Challans, quotations and extra entries are not supported in bulk.
+    """
+
+    unsupported_fields = ("challans", "quotation", "extra_entries")
+
+    party = serializers.IntegerField(source="party_id", required=False, allow_null=True)
+    payment_mode = serializers.IntegerField(
+        source="payment_mode_id", required=False, allow_null=True
+    )
+    sales_agent = serializers.IntegerField(
+        source="sales_agent_id", required=False, allow_null=True
+    )
+
+    def to_internal_value(self, data):
+        unsupported = {
+            field: ["Not supported in bulk posting."]
+            for field in self.unsupported_fields
+            if isinstance(data, Mapping) and data.get(field)
+        }
+        if unsupported:
+            raise ValidationError(unsupported)
+        return super().to_internal_value(data)
+
+    def validate(self, data):
+        # * Stock and later invoices are checked for all invoices together, against the
+        # dates of each invoice rather than of the request
+        return data
+
+    def get_row_items(self, item_ids):
+        # The same child serializer validates every invoice, so items are fetched once
+        items = self.__dict__.setdefault("row_items", {})
+        missing = set(item_ids) - items.keys()
+        if missing:
+            items.update(super().get_row_items(missing))
+        return items
+
+    class Meta(SalesVoucherCreateSerializer.Meta):
+        exclude = SalesVoucherCreateSerializer.Meta.exclude + ("challans", "quotation")
+
+
+class SalesVoucherBulkCreateSerializer(serializers.Serializer):
+    """
+    Creates and posts many sales invoices at once, for POS and imports. Related objects are
+    fetched once for the batch, issued invoices get a contiguous range of voucher numbers and
+    ledger and inventory transactions are posted with bulk inserts.
+    """
+
+    invoices = SalesVoucherBulkItemSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        request = self.context["request"]
+        company = request.company
+        query_params = getattr(request, "query_params", {})
+        invoices = data["invoices"]
+        errors = {}
+
+        def add_error(index, field, message):
+            errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+        def ids_of(values):
+            return {value for value in values if value}
+
+        rows = [row for invoice in invoices for row in invoice["rows"]]
+        discount_ids = {
+            int(obj["discount_type"])
+            for obj in [*invoices, *rows]
+            if obj.get("discount_type") and str(obj["discount_type"]).isdigit()
+        }
+        self.parties = Party.objects.filter(company=company).select_related(
+            "customer_account"
+        ).in_bulk(ids_of(invoice.get("party_id") for invoice in invoices))
+        self.payment_modes = PaymentMode.objects.filter(company=company).select_related(
+            "account", "transaction_fee_account"
+        ).in_bulk(ids_of(invoice.get("payment_mode_id") for invoice in invoices))
+        # Cash invoices without a payment mode are paid by the Cash mode, as with
+        # SalesVoucher.save, and checked along with the given payment modes
+        cash_invoices = [
+            invoice
+            for invoice in invoices
+            if not invoice.get("payment_mode_id") and invoice.get("mode") == "Cash"
+        ]
+        if cash_invoices:
+            cash = PaymentMode.objects.select_related(
+                "account", "transaction_fee_account"
+            ).get_or_create(company=company, name="Cash")[0]
+            self.payment_modes[cash.id] = cash
+            for invoice in cash_invoices:
+                invoice["payment_mode_id"] = cash.id
+        sales_agents = SalesAgent.objects.filter(company=company).in_bulk(
+            ids_of(invoice.get("sales_agent_id") for invoice in invoices)
+        )
+        self.discounts = SalesDiscount.objects.filter(company=company).in_bulk(
+            discount_ids
+        )
+        items = Item.objects.filter(company=company).select_related("unit").in_bulk(
+            ids_of(row["item_id"] for row in rows)
+        )
+        tax_schemes = TaxScheme.objects.filter(company=company).in_bulk(
+            ids_of(row.get("tax_scheme_id") for row in rows)
+        )
+
+        fiscal_year = company.current_fiscal_year
+        for index, invoice in enumerate(invoices):
+            status = invoice.get("status")
+            if (
+                not invoice.get("party_id")
+                and not invoice.get("payment_mode_id")
+                and status != "Draft"
+            ):
+                add_error(index, "party", "Party is required for a credit issue.")
+            if invoice.get("discount") and invoice["discount"] < 0:
+                add_error(index, "discount", "Discount cannot be negative.")
+            if not fiscal_year.includes(invoice["date"]):
+                add_error(index, "date", "Date not in current fiscal year.")
+            if invoice.get("party_id") and invoice["party_id"] not in self.parties:
+                add_error(index, "party", "Party not found.")
+            payment_mode_id = invoice.get("payment_mode_id")
+            if payment_mode_id and (
+                payment_mode_id not in self.payment_modes
+                or not self.payment_modes[payment_mode_id].enabled_for_sales
+            ):
+                add_error(index, "payment_mode", "Payment mode not enabled for sales.")
+            if (
+                invoice.get("sales_agent_id")
+                and invoice["sales_agent_id"] not in sales_agents
+            ):
+                add_error(index, "sales_agent", "Sales agent not found.")
+            for obj in [invoice, *invoice["rows"]]:
+                discount_type = obj.get("discount_type")
+                if (
+                    discount_type
+                    and str(discount_type).isdigit()
+                    and int(discount_type) not in self.discounts
+                ):
+                    add_error(index, "discount_type", "Discount not found.")
+            for row in invoice["rows"]:
+                if row["item_id"] not in items:
+                    add_error(index, "item_id", "Item not found.")
+                if row.get("tax_scheme_id") and row["tax_scheme_id"] not in tax_schemes:
+                    add_error(index, "tax_scheme_id", "Tax scheme not found.")
+
+        if errors:
+            raise ValidationError({"invoices": errors})
+
+        inventory_setting = company.inventory_setting
+        item_ids = list(ids_of(row["item_id"] for row in rows))
+
+        if inventory_setting.enable_fifo and not query_params.get("fifo_inconsistency"):
+            last_dates = dict(
+                SalesVoucherRow.objects.filter(item_id__in=item_ids)
+                .exclude(voucher__status__in=["Draft", "Cancelled"])
+                .values("item_id")
+                .annotate(date=Max("voucher__date"))
+                .values_list("item_id", "date")
+            )
+            for item_id, date in (
+                ChallanRow.objects.filter(item_id__in=item_ids, voucher__status="Issued")
+                .values("item_id")
+                .annotate(date=Max("voucher__date"))
+                .values_list("item_id", "date")
+            ):
+                last_dates[item_id] = max(last_dates.get(item_id, date), date)
+
+            for invoice in invoices:
+                for row in invoice["rows"]:
+                    last_date = last_dates.get(row["item_id"])
+                    if last_date and last_date > invoice["date"]:
+                        raise UnprocessableException(
+                            detail="There are Challans or SalesVouchers on later dates. This might create insonsistencies in FIFO.",
+                            code="fifo_inconsistency",
+                        )
+
+        # Check negative stock for the quantities of all invoices together
+        if inventory_setting.enable_negative_stock_check and not query_params.get(
+            "negative_stock"
+        ):
+            quantities = {}
+            for row in rows:
+                quantities[row["item_id"]] = (
+                    quantities.get(row["item_id"], 0) + row["quantity"]
+                )
+            for item in Item.objects.filter(id__in=item_ids).select_related(
+                "account", "unit"
+            ):
+                remaining = item.account.current_balance if item.account_id else 0
+                if remaining < quantities[item.id]:
+                    raise UnprocessableException(
+                        detail=f"You do not have enough stock for item {item.name} in your inventory to create this sales. Available stock: {remaining} {item.unit.name if item.unit else 'units'}",
+                        code="negative_stock",
+                    )
+
+        return data
+
+    def create(self, validated_data):
+        request = self.context["request"]
+        company = request.company
+        invoice_serializer = self.fields["invoices"].child
+        invoices = validated_data["invoices"]
+        now = timezone.now()
+        today = now.date()
+        async_posting = company.async_voucher_posting
+
+        with transaction.atomic():
+            issued_count = len(
+                [
+                    invoice
+                    for invoice in invoices
+                    if invoice.get("status") not in ["Draft", "Cancelled"]
+                ]
+            )
+            voucher_nos = iter(
+                reserve_voucher_nos(SalesVoucher, company.id, issued_count)
+            )
+
+            vouchers = []
+            voucher_rows = []
+            for invoice in invoices:
+                data = dict(invoice)
+                rows_data = data.pop("rows")
+                invoice_serializer.assign_discount_obj(data)
+                if data.get("status") not in ["Draft", "Cancelled"]:
+                    data["voucher_no"] = next(voucher_nos)
+
+                invoice_serializer.validate_invoice_date(
+                    dict(
+                        data,
+                        company_id=company.id,
+                        fiscal_year_id=company.current_fiscal_year_id,
+                    )
+                )
+
+                voucher = SalesVoucher(
+                    **data,
+                    company=company,
+                    user_id=request.user.id,
+                    fiscal_year_id=company.current_fiscal_year_id,
+                )
+                voucher.party = self.parties.get(voucher.party_id)
+                voucher.payment_mode = self.payment_modes.get(voucher.payment_mode_id)
+                if voucher.discount_obj_id:
+                    voucher.discount_obj = self.discounts[int(voucher.discount_obj_id)]
+                if voucher.payment_mode and voucher.status not in ["Draft", "Cancelled"]:
+                    voucher.status = "Paid"
+                    voucher.payment_date = today
+                if async_posting and voucher.status not in ["Draft", "Cancelled"]:
+                    # Posted by the task cluster, as with PostingModel.queue_posting
+                    voucher.posting_status = "Queued"
+                    voucher.posting_version = 1
+                    voucher.posting_queued_at = now
+                vouchers.append(voucher)
+
+                for row_data in rows_data:
+                    row_data = invoice_serializer.assign_discount_obj(dict(row_data))
+                    row_data.pop("id", None)
+                    voucher_rows.append(SalesVoucherRow(voucher=voucher, **row_data))
+
+            SalesVoucher.objects.bulk_create(vouchers, batch_size=500)
+            SalesVoucherRow.objects.bulk_create(voucher_rows, batch_size=1000)
+            prefetch_related_objects(
+                vouchers,
+                Prefetch(
+                    "rows",
+                    queryset=SalesVoucherRow.objects.select_related(
+                        "discount_obj",
+                        "tax_scheme__payable",
+                        "item__account",
+                        "item__sales_account",
+                        "item__discount_allowed_account",
+                    ).order_by("id"),
+                ),
+            )
+
+            ledger_postings = []
+            inventory_postings = []
+            for voucher in vouchers:
+                meta = voucher.generate_meta(
+                    update_row_data=True,
+                    prefetched_rows=True,
+                    save=False,
+                    save_rows=False,
+                )
+                for key in [
+                    "sub_total",
+                    "sub_total_after_row_discounts",
+                    "discount",
+                    "non_taxable",
+                    "taxable",
+                    "tax",
+                ]:
+                    setattr(voucher, "meta_" + key, meta[key])
+                voucher.total_amount = meta["grand_total"]
+
+                if (
+                    voucher.status in ["Draft", "Cancelled"]
+                    or voucher.posting_status == "Queued"
+                ):
+                    continue
+                if voucher.payment_mode:
+                    dr_acc = voucher.payment_mode.account
+                else:
+                    dr_acc = voucher.party.customer_account
+                row_postings = voucher.get_row_ledger_postings(
+                    dr_acc, prefetched_rows=True
+                )
+                commission_entries = voucher.get_commission_entries(
+                    meta["grand_total"]
+                )
+                if company.aggregate_voucher_journal_entries:
+                    ledger_postings.append(
+                        (
+                            voucher,
+                            voucher.date,
+                            net_entries(
+                                *[entries for _, _, entries in row_postings],
+                                commission_entries or [],
+                            ),
+                        )
+                    )
+                else:
+                    ledger_postings += row_postings
+                    if commission_entries:
+                        ledger_postings.append(
+                            (voucher, voucher.date, commission_entries)
+                        )
+
+                for row in voucher.rows.all():
+                    if not (row.item.track_inventory or row.item.fixed_asset):
+                        continue
+                    quantity = int(row.quantity)
+                    if quantity:
+                        inventory_postings.append(
+                            (
+                                row,
+                                voucher.date,
+                                [["cr", row.item.account, quantity, row.rate]],
+                            )
+                        )
+
+            SalesVoucherRow.objects.bulk_update(
+                [row for voucher in vouchers for row in voucher.rows.all()],
+                ["discount_amount", "tax_amount", "net_amount"],
+                batch_size=1000,
+            )
+            SalesVoucher.objects.bulk_update(
+                vouchers,
+                [
+                    "meta_sub_total",
+                    "meta_sub_total_after_row_discounts",
+                    "meta_discount",
+                    "meta_non_taxable",
+                    "meta_taxable",
+                    "meta_tax",
+                    "total_amount",
+                ],
+                batch_size=500,
+            )
+            journal_entries = set_bulk_ledger_transactions(ledger_postings)
+            if company.aggregate_voucher_journal_entries:
+                JournalEntry.objects.filter(
+                    id__in=[journal_entry.id for journal_entry in journal_entries]
+                ).update(aggregates_rows=True)
+            set_bulk_inventory_transactions(inventory_postings)
+
+            if any(voucher.posting_status == "Queued" for voucher in vouchers):
+                from django_q.tasks import async_task
+
+                company_id = company.id
+                task_name = "post-bulk-{}-{}".format(company_id, vouchers[0].pk)
+                transaction.on_commit(
+                    lambda: async_task(
+                        "apps.voucher.tasks.post_queued_vouchers",
+                        company_id,
+                        task_name=task_name,
+                    )
+                )
+        return vouchers
 
 
 class RecurringVoucherTemplateSalesInvoiceDataSerializer(SalesVoucherCreateSerializer):
@@ -950,7 +1352,7 @@ class ChallanCreateSerializer(StatusReversionMixin, BaseModelSerializer):
             return
         if validated_data.get("status") in ["Draft", "Cancelled"]:
             return
-        next_voucher_no = get_next_voucher_no(
+        next_voucher_no = reserve_voucher_no(
             Challan, self.context["request"].company.id
         )
         validated_data["voucher_no"] = next_voucher_no
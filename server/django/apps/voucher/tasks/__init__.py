@@ -1,14 +1,14 @@
 import random
 from copy import deepcopy
 
-from django.db import transaction
+from django.db import connection, transaction
 from django.conf import settings
 from awecount.libs.helpers import (
     add_time_to_date,
     deserialize_request,
 )
 from django.core.mail import EmailMessage
-from apps.voucher.models import RecurringVoucherTemplate
+from apps.voucher.models import ASYNC_POSTED_MODELS, RecurringVoucherTemplate
 
 @transaction.atomic
 def generate_voucher(template_id):
@@ -85,4 +85,62 @@ def generate_voucher(template_id):
 
     template.no_of_vouchers_created += 1
     template.last_generated = template.next_date
-    template.save()
\ No newline at end of file
+    template.save()
+
+
+def _queued_vouchers(company_id):
+    queued = []
+    for model in ASYNC_POSTED_MODELS:
+        queued += [
+            (queued_at, voucher_id, model)
+            for voucher_id, queued_at in model.objects.filter(
+                company_id=company_id, posting_status="Queued"
+            ).values_list("id", "posting_queued_at")
+        ]
+    return sorted(queued, key=lambda voucher: voucher[:2])
+
+
+def post_queued_vouchers(company_id):
+    """
+    Posts the queued vouchers of a company in the order they were queued. A session lock
+    per company keeps workers from posting the same company concurrently, so running
+    balances come out the same as with synchronous posting; a job that waited on the lock
+    finds the vouchers it was queued for already posted and returns.
+    """
+    lock_key = "voucher-posting-{}".format(company_id)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", [lock_key])
+    posted = 0
+    try:
+        # * Vouchers queued while posting are picked up by the next round
+        while queued := _queued_vouchers(company_id):
+            for _, voucher_id, model in queued:
+                posted += _post_voucher(model, voucher_id)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [lock_key])
+    return posted
+
+
+def _post_voucher(model, voucher_id):
+    with transaction.atomic():
+        # Locking the voucher keeps it from being saved again while it is posted
+        voucher = (
+            model.objects.select_for_update()
+            .filter(id=voucher_id, posting_status="Queued")
+            .first()
+        )
+        if not voucher:
+            return 0
+        try:
+            with transaction.atomic():
+                voucher.apply_transactions()
+        except Exception as e:
+            model.objects.filter(id=voucher_id).update(
+                posting_status="Failed", posting_error=str(e)
+            )
+            return 0
+        model.objects.filter(id=voucher_id).update(
+            posting_status="Posted", posting_queued_at=None, posting_error=None
+        )
+    return 1
@@ -2,6 +2,7 @@ from datetime import datetime
 from inspect import isclass
 
 from django.core.exceptions import SuspiciousOperation, ValidationError
+from django.db import transaction
 from django.db.models import Q
 from django.http import Http404
 from rest_framework import mixins, serializers, viewsets
@@ -50,7 +51,9 @@ class CompanyViewSetMixin(object):
         if hasattr(model, "company_id"):
             serializer.validated_data["company_id"] = self.request.company.id
         try:
-            serializer.save()
+            # * Voucher numbers reserved while saving are given back if saving fails
+            with transaction.atomic():
+                serializer.save()
         except ValidationError as e:
             raise RESTValidationError({"detail": e.messages})
 
@@ -59,7 +62,8 @@ class CompanyViewSetMixin(object):
             if serializer.instance.company_id != self.request.company.id:
                 raise SuspiciousOperation("Modifying object owned by other company!")
         try:
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
         except ValidationError as e:
             raise RESTValidationError({"detail": e.messages})
 
@@ -7,38 +7,124 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import connection
 
 
-def get_next_voucher_no(cls, company_id, attr="voucher_no"):
+def is_numbered_by_fiscal_year(cls, attr):
+    # Check if the voucher number needs to be unique by fiscal year
+    for unique_tuple in cls._meta.unique_together:
+        if attr in unique_tuple and "fiscal_year" in unique_tuple:
+            return True
+    return False
+
+
+def get_max_voucher_no(cls, company_id, attr="voucher_no", fiscal_year_id=None):
     from django.db.models import Max
 
     qs = cls.objects.all()
     if company_id:
         qs = qs.filter(company_id=company_id)
 
-    # Check if the voucher number needs to be unique by fiscal year
-    for unique_tuple in cls._meta.unique_together:
-        if attr in unique_tuple and "fiscal_year" in unique_tuple:
+    if is_numbered_by_fiscal_year(cls, attr):
+        if fiscal_year_id:
+            qs = qs.filter(fiscal_year_id=fiscal_year_id)
+        else:
             qs = qs.filter(fiscal_year__companies=company_id)
-            break
 
-    max_voucher_no = qs.aggregate(Max(attr))[attr + "__max"]
-    if max_voucher_no:
-        return int(max_voucher_no) + 1
-    else:
-        return 1
+    return int(qs.aggregate(Max(attr))[attr + "__max"] or 0)
 
 
-def get_next_quotation_no(cls, company_id, attr="number"):
-    from django.db.models import Max
+def _voucher_sequence_lookup(cls, company_id, attr):
+    from apps.company.models import Company
 
-    qs = cls.objects.all()
-    if company_id:
-        qs = qs.filter(company_id=company_id)
+    fiscal_year_id = None
+    if is_numbered_by_fiscal_year(cls, attr):
+        fiscal_year_id = (
+            Company.objects.filter(id=company_id)
+            .values_list("current_fiscal_year_id", flat=True)
+            .first()
+        )
+    return {
+        "company_id": company_id,
+        "fiscal_year_id": fiscal_year_id,
+        "content_type": ContentType.objects.get_for_model(cls),
+    }
 
-    max_voucher_no = qs.aggregate(Max(attr))[attr + "__max"]
-    if max_voucher_no:
-        return int(max_voucher_no) + 1
-    else:
-        return 1
+
+def get_next_voucher_no(cls, company_id, attr="voucher_no"):
+    """
+    Next voucher number to show on a form, without reserving it. Use
+    `reserve_voucher_no` to number a voucher being saved.
+    """
+    from apps.company.models import VoucherSequence
+
+    if not company_id:
+        return get_max_voucher_no(cls, company_id, attr=attr) + 1
+
+    lookup = _voucher_sequence_lookup(cls, company_id, attr)
+    last_number = (
+        VoucherSequence.objects.filter(**lookup)
+        .values_list("last_number", flat=True)
+        .first()
+    )
+    if last_number is None:
+        last_number = get_max_voucher_no(
+            cls, company_id, attr=attr, fiscal_year_id=lookup["fiscal_year_id"]
+        )
+    return last_number + 1
+
+
+def reserve_voucher_nos(cls, company_id, count=1, attr="voucher_no"):
+    """
+    Reserves a contiguous range of the next `count` voucher numbers from the sequence of
+    the company, seeding the sequence from existing vouchers on first use. The sequence
+    row stays locked until the surrounding transaction ends, so concurrent requests get
+    distinct numbers, and a rolled back transaction gives its numbers back.
+    """
+    from django.db import IntegrityError, transaction
+
+    from apps.company.models import VoucherSequence
+
+    lookup = _voucher_sequence_lookup(cls, company_id, attr)
+    with transaction.atomic():
+        sequence = VoucherSequence.objects.select_for_update().filter(**lookup).first()
+        if sequence is None:
+            try:
+                with transaction.atomic():
+                    sequence = VoucherSequence.objects.create(
+                        last_number=get_max_voucher_no(
+                            cls,
+                            company_id,
+                            attr=attr,
+                            fiscal_year_id=lookup["fiscal_year_id"],
+                        ),
+                        **lookup,
+                    )
+            except IntegrityError:
+                # Created by a concurrent request in the meantime
+                sequence = VoucherSequence.objects.select_for_update().get(**lookup)
+        start = sequence.last_number + 1
+        sequence.last_number += count
+        sequence.save(update_fields=["last_number"])
+    return range(start, start + count)
+
+
+def reserve_voucher_no(cls, company_id, attr="voucher_no"):
+    return reserve_voucher_nos(cls, company_id, attr=attr)[0]
+
+
+def advance_voucher_sequence(cls, company_id, number, attr="voucher_no"):
+    """
+    Moves the sequence past a number entered by hand, so that it is not reserved again.
+    """
+    from django.db.models.functions import Greatest
+
+    from apps.company.models import VoucherSequence
+
+    VoucherSequence.objects.filter(
+        **_voucher_sequence_lookup(cls, company_id, attr)
+    ).update(last_number=Greatest("last_number", int(number)))
+
+
+def get_next_quotation_no(cls, company_id, attr="number"):
+    return get_next_voucher_no(cls, company_id, attr=attr)
 
 
 def zero_for_none(obj):
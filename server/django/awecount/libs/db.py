@@ -1,6 +1,57 @@
+from django.db import connection
 from django.db.models import Sum
 
 
 class DistinctSum(Sum):
     function = "SUM"
     template = "%(function)s(DISTINCT %(expressions)s)"
+
+
+def increment_or_create(
+    model, fields, amount_fields, rows, conflict_fields, batch_size=2000
+):
+    """
+    Adds amounts to the rows of `model` identified by `conflict_fields`, creating missing rows,
+    with INSERT ... ON CONFLICT DO UPDATE statements.
+
+    :param fields: names of the fields making up the keys of `rows`
+    :param amount_fields: names of the fields incremented by the values of `rows`
+    :param rows: {(values of fields): (values of amount_fields)}, keys must be unique as a
+        single statement cannot update the same row twice
+    :param conflict_fields: fields of a unique constraint of `model`
+    """
+    if not rows:
+        return
+    opts = model._meta
+    table = connection.ops.quote_name(opts.db_table)
+    columns = [
+        connection.ops.quote_name(opts.get_field(name).column)
+        for name in (*fields, *amount_fields)
+    ]
+    conflict_columns = [
+        connection.ops.quote_name(opts.get_field(name).column)
+        for name in conflict_fields
+    ]
+    updates = ", ".join(
+        "{column} = {table}.{column} + EXCLUDED.{column}".format(
+            column=column, table=table
+        )
+        for column in columns[len(fields) :]
+    )
+    placeholder = "({})".format(", ".join(["%s"] * len(columns)))
+
+    items = list(rows.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), batch_size):
+            batch = items[start : start + batch_size]
+            cursor.execute(
+                "INSERT INTO {table} ({columns}) VALUES {values} "
+                "ON CONFLICT ({conflict}) DO UPDATE SET {updates}".format(
+                    table=table,
+                    columns=", ".join(columns),
+                    values=", ".join([placeholder] * len(batch)),
+                    conflict=", ".join(conflict_columns),
+                    updates=updates,
+                ),
+                [value for key, amounts in batch for value in (*key, *amounts)],
+            )
@@ -0,0 +1,73 @@
+import csv
+import tempfile
+
+from django.http import StreamingHttpResponse
+from openpyxl import Workbook
+
+CHUNK_SIZE = 64 * 1024
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+class Echo:
+    """
+    File-like object handing back what is written to it, for csv.writer to produce lines
+    one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    buffer = []
+    size = 0
+    for row in rows:
+        line = writer.writerow(row)
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_xlsx(title, headers, rows):
+    """
+    Writes rows to a write-only workbook, which keeps them in a temporary file instead of
+    memory, and streams the saved workbook. Unlike CSV, the file can only be sent once all
+    rows are written.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title[:31])
+    sheet.append(headers)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def streaming_export_response(filename, format, title, headers, rows):
+    """
+    Streams `rows`, an iterable of lists, as a CSV or XLSX download.
+    """
+    if format == "xlsx":
+        content = stream_xlsx(title, headers, rows)
+    else:
+        format = "csv"
+        content = stream_csv(headers, rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[format])
+    response["Content-Disposition"] = 'attachment; filename="{}.{}"'.format(
+        filename, format
+    )
+    return response
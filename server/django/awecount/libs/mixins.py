@@ -1,16 +1,45 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.utils.text import slugify
 from rest_framework.decorators import action
 from rest_framework.exceptions import APIException
 from rest_framework.exceptions import ValidationError as RESTValidationError
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from apps.ledger.models import Transaction
+from apps.ledger.models import Account, Transaction
+from apps.ledger.models.base import (
+    get_account_total_annotations,
+    get_category_tree_version,
+)
 from apps.ledger.serializers import TransactionEntrySerializer
-from awecount.libs import delete_rows
+from awecount.libs import delete_rows, zero_for_none
 from awecount.libs.CustomViewSet import GenericSerializer
 from awecount.libs.exception import UnprocessableException
+from awecount.libs.exports import streaming_export_response
 from awecount.libs.serializers import ShortNameChoiceSerializer
 
 
+def get_opening(account_ids, date):
+    """
+    Debit and credit totals of the accounts before `date`, from the opening of its fiscal
+    year and the movements of the year since.
+    """
+    opening_dr = opening_cr = Decimal(0)
+    for dr, cr in (
+        Account.objects.filter(id__in=account_ids)
+        .annotate(**get_account_total_annotations(date, "od", "oc"))
+        .values_list("od", "oc")
+    ):
+        opening_dr += zero_for_none(dr)
+        opening_cr += zero_for_none(cr)
+    return opening_dr, opening_cr
+
+
 class InputChoiceMixin(object):
     @action(detail=False)
     def choices(self, request, *args, **kwargs):
@@ -66,202 +95,439 @@ class DeleteRows(object):
         return super(DeleteRows, self).update(request, *args, **kwargs)
 
 
-class TransactionsViewMixin(object):
-    @action(detail=True, methods=["get"])
-    def transactions(self, request, pk=None, *args, **kwargs):
-        param = request.GET
-        obj = self.get_object()
-        serializer_class = self.get_serializer_class()
-        data = serializer_class(obj).data
-        account_ids = self.get_account_ids(obj)
-        start_date = param.get("start_date", None)
-        end_date = param.get("end_date", None)
-        # page = int(param.get('page', 1))
-        # page_size = int(param.get('page_size', 20))
+# Transactions of the accounts in entries that also touch other accounts, scoped to the
+# company so that the (company, account, date) index drives the scan
+LEDGER_SCOPE = """
+    FROM
+        ledger_transaction AS t
+    JOIN
+        ledger_journalentry AS je ON t.journal_entry_id = je.id
+    WHERE
+        t.company_id = %(company_id)s
+        AND t.account_id = ANY(%(account_ids)s)
+        AND EXISTS (
+            SELECT 1 FROM ledger_transaction AS other
+            WHERE
+                other.journal_entry_id = t.journal_entry_id
+                AND NOT other.account_id = ANY(%(account_ids)s)
+        )
+"""
+
+# Seconds ledger summaries are cached for, they are left behind as soon as the company's
+# ledger changes
+LEDGER_SUMMARY_TIMEOUT = 60 * 60
+
+# Transactions of a voucher on a date make up one entry of the statement
+LEDGER_ENTRY_GROUP_BY = """
+    GROUP BY
+        je.source_voucher_id,
+        je.source_voucher_no,
+        je.content_type_id,
+        t.date
+"""
+
+# Columns of an entry, read off the transactions grouped by LEDGER_ENTRY_GROUP_BY
+LEDGER_ENTRY_COLUMNS = """
+    SELECT
+        MIN(t.id) AS id,
+        je.source_voucher_id AS source_id,
+        je.source_voucher_no AS voucher_no,
+        je.content_type_id,
+        t.date,
+        SUM(t.dr_amount) AS total_dr_amount,
+        SUM(t.cr_amount) AS total_cr_amount,
+        ARRAY_AGG(DISTINCT t.journal_entry_id) AS journal_entry_ids
+"""
+
+# Other accounts of the journal entries of an entry `e`
+LEDGER_ENTRY_COUNTERPARTS = """
+    FROM
+        ledger_transaction AS other
+    JOIN
+        ledger_account AS acc ON other.account_id = acc.id
+    WHERE
+        other.journal_entry_id = ANY(e.journal_entry_ids)
+        AND NOT other.account_id = ANY(%(account_ids)s)
+"""
+
+
+STATEMENT_HEADERS = [
+    "Date",
+    "Voucher Type",
+    "Voucher No.",
+    "Particulars",
+    "Debit",
+    "Credit",
+    "Balance",
+]
 
-        account_id_list_str = ",".join([str(account_id) for account_id in account_ids])
 
-        # transactions = Transaction.objects.select_related('account').filter(account_id__in=account_ids).values(
-        # 'journal_entry__source_voucher_id', 'journal_entry__content_type__model').order_by('journal_entry__source_voucher_id').annotate(
-        #     count=Count('journal_entry__source_voucher_id'))
+def get_source_type(content_type):
+    if content_type.model == "account":
+        return "Opening Balance"
+    model = content_type.model_class()
+    if not model:
+        return content_type.model
+    return model._meta.verbose_name.title().replace("Row", "").strip()
+
+
+def get_date_filter(start_date=None, end_date=None):
+    return "{}{}".format(
+        " AND t.date >= %(start_date)s" if start_date else "",
+        " AND t.date <= %(end_date)s" if end_date else "",
+    )
+
+
+class TransactionsViewMixin(object):
+    """
+    Account statement of the accounts of `get_account_ids`, newest first. Pages are fetched
+    by the (date, id) of the last entry of the previous page, passed back as `cursor` in
+    the next link, so that a deep page costs as much as the first one. Opening, total and
+    carry forward sums are computed in SQL. `transactions/export` streams the whole
+    statement with running balances as CSV or XLSX.
+    """
+
+    def get_ledger_cursor(self, param):
+        cursor = param.get("cursor")
+        if not cursor:
+            return None
+        try:
+            date, entry_id = cursor.split("_")
+            return datetime.strptime(date, "%Y-%m-%d").date(), int(entry_id)
+        except ValueError:
+            raise RESTValidationError({"cursor": ["Invalid cursor."]})
 
-        raw_query = f"""
-        WITH SourceAggregation AS (
-            WITH AccountAggregation AS (
+    def get_ledger_entries(self, params, date_filter, cursor, offset, limit):
+        """
+        Entries of a page, after `cursor` or `offset` entries. Every date with transactions
+        after the cursor has an entry after it, so the entries of the page fall within
+        the last `offset + limit` such dates, found walking the index by (date, id).
+        Only the transactions of those dates are grouped.
+        """
+        query = f"""
+        WITH bound AS (
+            SELECT
+                MIN(dates.date) AS date
+            FROM (
+                SELECT DISTINCT
+                    t.date
+                {LEDGER_SCOPE}
+                    {date_filter}
+                    {"AND (t.date, t.id) < (%(cursor_date)s, %(cursor_id)s)" if cursor else ""}
+                ORDER BY
+                    t.date DESC
+                LIMIT %(date_limit)s
+            ) AS dates
+        ),
+        entries AS (
+            {LEDGER_ENTRY_COLUMNS}
+            {LEDGER_SCOPE}
+                {date_filter}
+                AND t.date >= (SELECT date FROM bound)
+                {"AND t.date <= %(cursor_date)s" if cursor else ""}
+            {LEDGER_ENTRY_GROUP_BY}
+            {"HAVING (t.date, MIN(t.id)) < (%(cursor_date)s, %(cursor_id)s)" if cursor else ""}
+            ORDER BY
+                t.date DESC, id DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        )
+        SELECT
+            e.id,
+            e.source_id,
+            e.voucher_no,
+            e.date,
+            e.total_dr_amount,
+            e.total_cr_amount,
+            ct.model AS content_type_model,
+            ct.app_label AS content_type_app_label,
+            (
                 SELECT
-                    je.id AS journal_entry_id,
-                    je.source_voucher_id,
-                    je.source_voucher_no,
-                    je.date,
-                    ct.model AS content_type_model,
-                    ct.app_label AS content_type_app_label,
-                    JSONB_AGG(DISTINCT JSONB_BUILD_OBJECT('id', acc.id, 'name', acc.name)) AS accounts
-                FROM
-                    ledger_transaction AS t
-                JOIN
-                    ledger_journalentry AS je ON t.journal_entry_id = je.id
-                JOIN
-                    ledger_account AS acc ON t.account_id = acc.id
-                JOIN
-                    django_content_type AS ct ON je.content_type_id = ct.id
-                WHERE
-                    t.account_id NOT IN ({account_id_list_str})
-                    {"AND je.date >= '" + start_date + "'" if start_date else ''}
-                    {"AND je.date <= '" + end_date + "'" if end_date else ''}
-                GROUP BY
-                    je.id, je.source_voucher_id, je.date, ct.model, ct.app_label
+                    JSONB_AGG(DISTINCT JSONB_BUILD_OBJECT('id', acc.id, 'name', acc.name))
+                {LEDGER_ENTRY_COUNTERPARTS}
+            )::json AS accounts
+        FROM
+            entries AS e
+        JOIN
+            django_content_type AS ct ON e.content_type_id = ct.id
+        ORDER BY
+            e.date DESC, e.id DESC
+        """
+        if cursor:
+            params = {**params, "cursor_date": cursor[0], "cursor_id": cursor[1]}
+        return list(
+            Transaction.objects.raw(
+                query,
+                {
+                    **params,
+                    "limit": limit,
+                    "offset": offset,
+                    "date_limit": offset + limit,
+                },
+            )
+        )
+
+    def get_ledger_summary(self, params, start_date, end_date):
+        """
+        Number of entries and their totals in the date range. Computed once for all the
+        pages of the statement and cached until the company's ledger changes.
+        """
+        company_id = params["company_id"]
+        key = "ledger-summary-{}-{}-{}-{}-{}".format(
+            company_id,
+            get_category_tree_version(company_id),
+            ",".join(str(account_id) for account_id in sorted(params["account_ids"])),
+            start_date or "",
+            end_date or "",
+        )
+        summary = cache.get(key)
+        if summary is not None:
+            return summary
+
+        query = f"""
+        SELECT
+            COUNT(DISTINCT (
+                je.source_voucher_id, je.source_voucher_no, je.content_type_id, t.date
+            )) AS count,
+            SUM(t.dr_amount) AS total_dr,
+            SUM(t.cr_amount) AS total_cr
+        {LEDGER_SCOPE}
+            {get_date_filter(start_date, end_date)}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            summary = dict(
+                zip([col[0] for col in cursor.description], cursor.fetchone())
             )
+        cache.set(key, summary, timeout=LEDGER_SUMMARY_TIMEOUT)
+        return summary
+
+    def get_ledger_carry_forward(self, params, date_filter, last_entry):
+        """
+        Totals of the entries after `last_entry`. Only entries on its date are grouped, the
+        ones before are summed straight off the index.
+        """
+        query = f"""
+        SELECT
+            SUM(rest.dr_amount) AS dr,
+            SUM(rest.cr_amount) AS cr
+        FROM (
             SELECT
-                SUM(t.id) as id,
-                aa.source_voucher_id as source_id,
-                aa.source_voucher_no as voucher_no,
-                aa.content_type_model as content_type_model,
-                aa.content_type_app_label as content_type_app_label,
-                SUM(t.dr_amount) AS total_dr_amount,
-                SUM(t.cr_amount) AS total_cr_amount,
-                aa.date,
-                aa.accounts AS accounts
-            FROM
-                ledger_transaction AS t
-            JOIN
-                AccountAggregation AS aa ON t.journal_entry_id = aa.journal_entry_id
-            WHERE
-                t.account_id IN ({account_id_list_str})
-            GROUP BY
-                aa.source_voucher_id,
-                aa.source_voucher_no,
-                aa.date,
-                aa.content_type_model,
-                aa.content_type_app_label,
-                aa.accounts
+                t.dr_amount,
+                t.cr_amount
+            {LEDGER_SCOPE}
+                {date_filter}
+                AND t.date < %(last_date)s
+            UNION ALL
+            SELECT
+                SUM(t.dr_amount),
+                SUM(t.cr_amount)
+            {LEDGER_SCOPE}
+                AND t.date = %(last_date)s
+            {LEDGER_ENTRY_GROUP_BY}
+            HAVING
+                MIN(t.id) < %(last_id)s
+        ) AS rest
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {**params, "last_date": last_entry.date, "last_id": last_entry.id},
+            )
+            dr, cr = cursor.fetchone()
+        return {"dr": zero_for_none(dr), "cr": zero_for_none(cr)}
+
+    def get_statement_rows(self, company_id, account_ids, start_date, end_date):
+        """
+        Entries of the statement oldest first with the running balance, grouped and scoped
+        as on screen, read off a server side cursor in chunks so that memory use does not
+        grow with the account.
+        """
+        opening_dr = opening_cr = Decimal(0)
+        if start_date:
+            opening_dr, opening_cr = get_opening(account_ids, start_date)
+
+        query = f"""
+        WITH entries AS (
+            {LEDGER_ENTRY_COLUMNS}
+            {LEDGER_SCOPE}
+                {get_date_filter(start_date, end_date)}
+            {LEDGER_ENTRY_GROUP_BY}
         )
         SELECT
-            SUM(sa.id) AS id,
-            sa.source_id,
-            sa.voucher_no,
-            SUM(sa.total_dr_amount) AS total_dr_amount,
-            SUM(sa.total_cr_amount) AS total_cr_amount,
-            sa.content_type_model,
-            sa.content_type_app_label,
-            JSONB_CONCAT(sa.accounts)::json as accounts,
-            sa.date
+            e.date,
+            e.content_type_id,
+            e.voucher_no,
+            (
+                SELECT
+                    STRING_AGG(DISTINCT acc.name, ', ')
+                {LEDGER_ENTRY_COUNTERPARTS}
+            ) AS particulars,
+            e.total_dr_amount,
+            e.total_cr_amount
         FROM
-            SourceAggregation AS sa
-        GROUP BY
-            sa.source_id,
-            sa.voucher_no,
-            sa.content_type_model,
-            sa.content_type_app_label,
-            sa.date
+            entries AS e
         ORDER BY
-            sa.date DESC
+            e.date, e.id
         """
+        params = {
+            "company_id": company_id,
+            "account_ids": account_ids,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+
+        source_types = {}
+        balance = opening_dr - opening_cr
+        total_dr = total_cr = Decimal(0)
+        if start_date:
+            yield [
+                start_date,
+                "Opening Balance",
+                "",
+                "",
+                round(opening_dr, 2),
+                round(opening_cr, 2),
+                round(balance, 2),
+            ]
+        for date, content_type_id, voucher_no, particulars, dr, cr in self.iterate_rows(
+            query, params
+        ):
+            if content_type_id not in source_types:
+                source_types[content_type_id] = get_source_type(
+                    ContentType.objects.get_for_id(content_type_id)
+                )
+            dr = zero_for_none(dr)
+            cr = zero_for_none(cr)
+            balance += dr - cr
+            total_dr += dr
+            total_cr += cr
+            yield [
+                date,
+                source_types[content_type_id],
+                voucher_no,
+                particulars,
+                round(dr, 2),
+                round(cr, 2),
+                round(balance, 2),
+            ]
+        yield [
+            "",
+            "Total",
+            "",
+            "",
+            round(opening_dr + total_dr, 2),
+            round(opening_cr + total_cr, 2),
+            round(balance, 2),
+        ]
+
+    @staticmethod
+    def iterate_rows(query, params, chunk_size=2000):
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+
+    @action(detail=True, url_path="transactions/export")
+    def export_transactions(self, request, pk=None, *args, **kwargs):
+        param = request.GET
+        obj = self.get_object()
+        account_ids = [
+            account_id for account_id in self.get_account_ids(obj) if account_id
+        ]
+        rows = self.get_statement_rows(
+            request.company.id,
+            account_ids,
+            param.get("start_date"),
+            param.get("end_date"),
+        )
+        return streaming_export_response(
+            "{}_{}".format(slugify(str(obj)) or "statement", datetime.today().date()),
+            param.get("file_format", "csv"),
+            str(obj),
+            STATEMENT_HEADERS,
+            rows,
+        )
 
-        transactions = Transaction.objects.raw(raw_query)
-        opening_transaction = transactions
+    @action(detail=True, methods=["get"])
+    def transactions(self, request, pk=None, *args, **kwargs):
+        param = request.GET
+        obj = self.get_object()
+        serializer_class = self.get_serializer_class()
+        data = serializer_class(obj).data
+        account_ids = [
+            account_id for account_id in self.get_account_ids(obj) if account_id
+        ]
+        start_date = param.get("start_date", None)
+        end_date = param.get("end_date", None)
+        params = {
+            "company_id": request.company.id,
+            "account_ids": account_ids,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+        date_filter = get_date_filter(start_date, end_date)
+
+        paginator = self.paginator
+        limit = paginator.get_page_size(request)
+        try:
+            page_number = max(int(param.get("page", 1)), 1)
+        except ValueError:
+            page_number = 1
+        cursor = self.get_ledger_cursor(param)
+        # Without a cursor, e.g. for a page picked directly, fall back to an offset
+        offset = 0 if cursor else (page_number - 1) * limit
+
+        entries = self.get_ledger_entries(
+            params, date_filter, cursor, offset, limit + 1
+        )
+        has_next = len(entries) > limit
+        page = entries[:limit]
+        summary = self.get_ledger_summary(params, start_date, end_date)
 
         aggregate = {}
         if start_date or end_date:
-            if start_date:
-                opening_transaction_query = f"""
-                    WITH SourceAggregation AS (
-                        WITH AccountAggregation AS (
-                            SELECT
-                                je.id AS journal_entry_id,
-                                je.source_voucher_id,
-                                je.date,
-                                ct.model AS content_type_model,
-                                ct.app_label AS content_type_app_label,
-                                JSONB_AGG(DISTINCT JSONB_BUILD_OBJECT('id', acc.id, 'name', acc.name)) AS accounts
-                            FROM
-                                ledger_transaction AS t
-                            JOIN
-                                ledger_journalentry AS je ON t.journal_entry_id = je.id
-                            JOIN
-                                ledger_account AS acc ON t.account_id = acc.id
-                            JOIN
-                                django_content_type AS ct ON je.content_type_id = ct.id
-                            WHERE
-                                t.account_id NOT IN ({account_id_list_str})
-                                {"AND je.date < '" + start_date + "'" if start_date else ''}
-                            GROUP BY
-                                je.id, je.source_voucher_id, je.date, ct.model, ct.app_label
-                        )
-                        SELECT
-                            SUM(t.id) as id,
-                            aa.source_voucher_id as source_id,
-                            SUM(t.dr_amount) AS total_dr_amount,
-                            SUM(t.cr_amount) AS total_cr_amount,
-                            aa.date
-                        FROM
-                            ledger_transaction AS t
-                        JOIN
-                            AccountAggregation AS aa ON t.journal_entry_id = aa.journal_entry_id
-                        WHERE
-                            t.account_id IN ({account_id_list_str})
-                        GROUP BY
-                            aa.source_voucher_id,
-                            aa.date,
-                            aa.accounts
-                    )
-                    SELECT
-                        SUM(sa.id) AS id,
-                        sa.source_id,
-                        SUM(sa.total_dr_amount) AS total_dr_amount,
-                        SUM(sa.total_cr_amount) AS total_cr_amount
-                    FROM
-                        SourceAggregation AS sa
-                    GROUP BY
-                        sa.source_id,
-                        sa.date
-                    ORDER BY
-                        sa.date DESC
-                    """
-                opening_transaction = Transaction.objects.raw(opening_transaction_query)
-
-            aggregate["opening"] = {
-                "dr": sum(
-                    [
-                        t.total_dr_amount
-                        for t in opening_transaction
-                        if t.total_dr_amount is not None
-                    ]
-                ),
-                "cr": sum(
-                    [
-                        t.total_cr_amount
-                        for t in opening_transaction
-                        if t.total_cr_amount is not None
-                    ]
-                ),
+            total = {
+                "dr": zero_for_none(summary["total_dr"]),
+                "cr": zero_for_none(summary["total_cr"]),
             }
+            aggregate["total"] = total
+            # * Without a start date the opening is the total of the range, as before
+            if start_date:
+                opening_dr, opening_cr = get_opening(account_ids, start_date)
+                aggregate["opening"] = {"dr": opening_dr, "cr": opening_cr}
+            else:
+                aggregate["opening"] = total
 
-            aggregate["total"] = {
-                "dr": sum(
-                    [
-                        t.total_dr_amount
-                        for t in transactions
-                        if t.total_dr_amount is not None
-                    ]
-                ),
-                "cr": sum(
-                    [
-                        t.total_cr_amount
-                        for t in transactions
-                        if t.total_cr_amount is not None
-                    ]
-                ),
-            }
+        count = summary["count"]
+        url = request.build_absolute_uri()
+        next_link = None
+        if has_next:
+            next_link = replace_query_param(
+                replace_query_param(url, "page", page_number + 1),
+                "cursor",
+                "{}_{}".format(page[-1].date, page[-1].id),
+            )
+        previous_link = None
+        if page_number > 1:
+            # Cursors only page forward
+            previous_link = remove_query_param(
+                replace_query_param(url, "page", page_number - 1), "cursor"
+            )
+            if page_number == 2:
+                previous_link = remove_query_param(previous_link, "page")
 
-        page = self.paginate_queryset(transactions)
-        serializer = TransactionEntrySerializer(page, many=True)
-        data["transactions"] = self.paginator.get_response_data(serializer.data)
+        data["transactions"] = {
+            "pagination": {
+                "count": count,
+                "page": page_number,
+                "pages": (count + (-count % limit)) // limit,  # round-up division
+                "previous": previous_link,
+                "next": next_link,
+                "size": limit,
+            },
+            "results": TransactionEntrySerializer(page, many=True).data,
+        }
         data["aggregate"] = aggregate
-
-        limit = self.paginator.page_size
-        offset = (self.paginator.page.number - 1) * limit
-        # transactions_from_previous_pages = transactions[:offset]
-        transactions_from_next_pages = transactions[offset + limit :]
         data["page_cumulative"] = {
             "current": {
                 "dr": sum(
@@ -271,28 +537,11 @@ class TransactionsViewMixin(object):
                     [t.total_cr_amount for t in page if t.total_cr_amount is not None]
                 ),
             },
-            # 'previous': {
-            #     'dr': sum(
-            #         [t.total_dr_amount for t in transactions_from_previous_pages if t.total_dr_amount is not None]),
-            #     'cr': sum(
-            #         [t.total_cr_amount for t in transactions_from_previous_pages if t.total_cr_amount is not None])
-            # },
-            "next": {
-                "dr": sum(
-                    [
-                        t.total_dr_amount
-                        for t in transactions_from_next_pages
-                        if t.total_dr_amount is not None
-                    ]
-                ),
-                "cr": sum(
-                    [
-                        t.total_cr_amount
-                        for t in transactions_from_next_pages
-                        if t.total_cr_amount is not None
-                    ]
-                ),
-            },
+            "next": (
+                self.get_ledger_carry_forward(params, date_filter, page[-1])
+                if has_next
+                else {"dr": 0, "cr": 0}
+            ),
         }
 
         return Response(data)
@@ -480,6 +480,18 @@ BANK_RECONCILIATION_TOLERANCE = 0.01
 BANK_RECONCILIATION_ADJUSTMENT_THRESHOLD = 1
 BANK_RECONCILIATION_STATEMENT_LOOKBACK_DAYS = 3
 BANK_RECONCILIATION_STATEMENT_LOOKAHEAD_DAYS = 3
+# Most transactions matched as a group against a single one, and the seconds spent searching
+# for such groups, per search and per statement import
+BANK_RECONCILIATION_MAX_GROUP_SIZE = 8
+BANK_RECONCILIATION_GROUP_SEARCH_SECONDS = 1
+BANK_RECONCILIATION_MATCH_SECONDS = 10
+# Days around a statement row within which transactions its description refers to, by
+# voucher, cheque or party, are matched with it
+BANK_RECONCILIATION_REFERENCE_DAYS = 30
+# Days of statement rows reconciled in a transaction, and seconds an import task runs
+# before queuing itself again for the rest
+BANK_RECONCILIATION_IMPORT_CHUNK_DAYS = 7
+BANK_RECONCILIATION_IMPORT_TASK_SECONDS = 15
 
 # File upload settings
 MAX_FILE_UPLOAD_SIZE = 1024 * 1024